@@ -2,8 +2,10 @@ import json
 import os
 import traceback
 import time
+import uuid
+import threading
 
-from flask import Flask, request, Response, jsonify
+from flask import Flask, request, jsonify
 from flask_cors import CORS
 app = Flask(__name__)
 CORS(app)
@@ -14,7 +16,10 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from prompts.baseprompt import clean_txt_content, load_prompt
 
-from core.writer_utils import KeyPointMsg
+from llm_api import get_client_pool_stats, get_scheduler_stats, get_cache_stats, get_single_flight_stats, get_cost_ledger_stats, get_write_behind_stats
+from core.writer_utils import KeyPointMsg, CHUNK_PLAN_MODES
+from write_stream import create_write_session, get_write_session
+from response_encoder import FastJSONProvider, encode_sse, sse_response
 from core.draft_writer import DraftWriter
 from core.plot_writer import PlotWriter
 from core.outline_writer import OutlineWriter
@@ -22,7 +27,10 @@ from core.outline_writer import OutlineWriter
 from setting import setting_bp
 from summary import process_novel
 from backend_utils import get_model_config_from_provider_model
-from config import MAX_NOVEL_SUMMARY_LENGTH, MAX_THREAD_NUM, ENABLE_ONLINE_DEMO
+from config import MAX_NOVEL_SUMMARY_LENGTH, MAX_THREAD_NUM, ENABLE_ONLINE_DEMO, CHUNK_PLAN_MODE, CACHE_REPLAY_MODES
+
+# jsonify直接输出UTF-8（不转义中文），安装了orjson时使用orjson
+app.json = FastJSONProvider(app)
 
 # 导入动态配置API
 try:
@@ -47,6 +55,18 @@ def health_check():
     }), 200
 
 
+@app.route('/llm_api_stats', methods=['GET'])
+def llm_api_stats():
+    return jsonify({
+        'client_pool': get_client_pool_stats(),
+        'scheduler': get_scheduler_stats(),
+        'cache': get_cache_stats(),
+        'single_flight': get_single_flight_stats(),
+        'cost_ledger': get_cost_ledger_stats(),
+        'write_behind': get_write_behind_stats(),
+    }), 200
+
+
 def load_novel_writer(writer_mode, chunk_list, global_context, x_chunk_length, y_chunk_length, main_model, sub_model, max_thread_num) -> DraftWriter:
     import traceback
     
@@ -184,40 +204,7 @@ def generate_enhanced_prompts():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
-def get_delta_chunks(prev_chunks, curr_chunks):
-    """Calculate delta between previous and current chunks"""
-    if not prev_chunks or len(prev_chunks) != len(curr_chunks):
-        return "init", curr_chunks
-    
-    # Check if all strings in current chunks start with their corresponding previous strings
-    is_delta = True
-    for prev_chunk, curr_chunk in zip(prev_chunks, curr_chunks):
-        if len(prev_chunk) != len(curr_chunk):
-            is_delta = False
-            break
-        for prev_str, curr_str in zip(prev_chunk, curr_chunk):
-            if not curr_str.startswith(prev_str):
-                is_delta = False
-                break
-        if not is_delta:
-            break
-    
-    if not is_delta:
-        return "init", curr_chunks
-    
-    # Calculate deltas
-    delta_chunks = []
-    for prev_chunk, curr_chunk in zip(prev_chunks, curr_chunks):
-        delta_chunk = []
-        for prev_str, curr_str in zip(prev_chunk, curr_chunk):
-            delta_str = curr_str[len(prev_str):]
-            delta_chunk.append(delta_str)
-        delta_chunks.append(delta_chunk)
-    
-    return "delta", delta_chunks
-
-
-def call_write(writer_mode, chunk_list, global_context, chunk_span, prompt_content, x_chunk_length, y_chunk_length, main_model, sub_model, max_thread_num, only_prompt):
+def call_write(writer_mode, chunk_list, global_context, chunk_span, prompt_content, x_chunk_length, y_chunk_length, main_model, sub_model, max_thread_num, only_prompt, chunk_plan_mode=None):
     import traceback
     
     print(f"\n{'='*60}")
@@ -234,6 +221,7 @@ def call_write(writer_mode, chunk_list, global_context, chunk_span, prompt_conte
     print(f"📏 X Chunk Length: {x_chunk_length}")
     print(f"📏 Y Chunk Length: {y_chunk_length}")
     print(f"🎯 Only Prompt: {only_prompt}")
+    print(f"📐 Chunk Plan Mode: {chunk_plan_mode or 'default'}")
     print(f"💼 Prompt Content Length: {len(prompt_content) if prompt_content else 0} characters")
     
     # 检查是否使用LM Studio本地模型
@@ -265,33 +253,20 @@ def call_write(writer_mode, chunk_list, global_context, chunk_span, prompt_conte
         chunk_list = [[e.strip() + ('\n' if e.strip() and rowi != len(chunk_list)-1 else '') for e in row] for rowi, row in enumerate(chunk_list)]
         print(f"✅ Chunk列表预处理完成，共处理 {original_chunk_count} 个chunk")
 
-        prev_chunks = None
-        def delta_wrapper(chunk_list, done=False, msg=None):
-            # 返回的chunk_list中每个chunk需要去掉换行
-            chunk_list = [[e.strip() for e in row] for row in chunk_list]
-
-            nonlocal prev_chunks
-            if prev_chunks is None:
-                prev_chunks = chunk_list
-                return {
-                    "done": done,
-                    "chunk_type": "init",
-                    "chunk_list": chunk_list,
-                    "msg": msg
-                }
-            else:
-                chunk_type, new_chunks = get_delta_chunks(prev_chunks, chunk_list)
-                prev_chunks = chunk_list
-                return {
-                    "done": done,
-                    "chunk_type": chunk_type,
-                    "chunk_list": new_chunks,
-                    "msg": msg
-                }
+        def chunk_frame(chunk_rows, done=False, msg=None, changed=None):
+            # chunk_rows为[(key, [x, y, text])]，由WriteStreamSession转换为增量操作，见write_stream.ChunkListStream
+            return {
+                "done": done,
+                "chunk_rows": chunk_rows,
+                "changed": changed,
+                "msg": msg
+            }
             
         print(f"🔧 正在加载小说写作器...")
         writer_load_start = time.time()
         novel_writer = load_novel_writer(writer_mode, chunk_list, global_context, x_chunk_length, y_chunk_length, main_model, sub_model, max_thread_num)
+        if chunk_plan_mode:
+            novel_writer.chunk_plan_mode = chunk_plan_mode
         writer_load_time = time.time() - writer_load_start
         print(f"✅ 小说写作器加载完成，耗时: {writer_load_time:.2f}秒")
         
@@ -312,7 +287,7 @@ def call_write(writer_mode, chunk_list, global_context, chunk_span, prompt_conte
         chunk_span = novel_writer.get_chunk_pair_span(new_target_chunk)
         print(f"✅ Draft模式初始化完成，更新后的chunk_span: {chunk_span}")
     
-    init_novel_writer = load_novel_writer(writer_mode, list(novel_writer.xy_pairs), global_context, x_chunk_length, y_chunk_length, main_model, sub_model, max_thread_num)
+    init_novel_writer = load_novel_writer(writer_mode, novel_writer.xy_pairs.copy(), global_context, x_chunk_length, y_chunk_length, main_model, sub_model, max_thread_num)
     
     # TODO: writer.write 应该保证无论什么prompt，都能够同时适应y为空和y有值地情况
     # 换句话说，就是虽然可以单列出一个"新建正文"，但用扩写正文也能实现同样的效果。
@@ -325,27 +300,44 @@ def call_write(writer_mode, chunk_list, global_context, chunk_span, prompt_conte
     step_count = 0
 
     prompt_name = ''
+    # get_chunks的划分结果，在每个步骤的LLM调用开始前报告计划的调用次数和tokens，划分结果变化时重新计算
+    plan_msg = ''
+    last_chunk_plan = None
+    # 当前步骤各chunk显示的行[x, y, text]（已去掉换行），只有文本有变化的chunk才重新计算
+    step_rows = {}
+    changed_keys = set()
     for kp_msg in generator:
         if isinstance(kp_msg, KeyPointMsg):
             # 如果要支持关键节点保存，需要计算一个编辑上的更改，然后在这里yield writer
             prompt_name = kp_msg.prompt_name
             step_count += 1
+            step_rows = {}
             print(f"🔄 步骤 {step_count}: 开始执行 {prompt_name}")
+            chunk_plan = novel_writer.last_chunk_plan
+            if chunk_plan is not None and chunk_plan is not last_chunk_plan:
+                last_chunk_plan = chunk_plan
+                print(f"📐 {chunk_plan.info}")
+                plan_msg = f"计划调用：{chunk_plan.calls}次 预计输入：{chunk_plan.input_tokens} tokens"
+            if plan_msg and not kp_msg.is_finished() and not only_prompt:
+                # batch_yield在启动LLM调用之前yield关键点消息，这里只推送状态，不改变chunk列表
+                yield {"done": False, "msg": f"正在 {prompt_name} {plan_msg}"}
             continue
         else:
             chunk_list = kp_msg
+        # batch_yield给出了本次有变化的chunk（BatchYields.deltas），这里只用它跳过没有变化的chunk，没有时全部重新计算
+        chunk_deltas = getattr(chunk_list, 'deltas', None)
 
         current_cost = 0
+        current_tokens = 0
         currency_symbol = ''
         current_model = ''
-        data_chunks = []
         prompt_outputs.clear()
         
         # 处理API调用结果
         processed_chunks = 0
         api_call_count = 0
         
-        for e in chunk_list:
+        for i, e in enumerate(chunk_list):
             if e is None: continue  # e为None说明该chunk还未处理
             output, chunk = e
             if output is None: continue # output为None说明该chunk未yield就return，说明未调用llm
@@ -357,7 +349,9 @@ def call_write(writer_mode, chunk_list, global_context, chunk_span, prompt_conte
             prompt_outputs.append(output)
             current_text = ""
             current_model = output['response_msgs'].model
+            # 费用和tokens优先使用提供商返回的实际用量，没有时为估算值
             chunk_cost = output['response_msgs'].cost
+            current_tokens += output['response_msgs'].total_tokens
             current_cost += chunk_cost
             total_cost += chunk_cost
             currency_symbol = output['response_msgs'].currency_symbol
@@ -366,11 +360,15 @@ def call_write(writer_mode, chunk_list, global_context, chunk_span, prompt_conte
             text_length = len(output.get('text', ''))
             total_chars_generated += text_length
             
+            if i in step_rows and chunk_deltas is not None and i not in chunk_deltas:
+                continue
             if 'plot2text' in output:
                 current_text += f"正在建立映射关系..." + '\n'
             else:
                 current_text = output['text']
-            data_chunks.append((chunk.x_chunk, chunk.y_chunk, current_text))
+            # 返回的chunk中需要去掉换行
+            step_rows[i] = [chunk.x_chunk.strip(), chunk.y_chunk.strip(), current_text.strip()]
+            changed_keys.add((step_count, i))
             
         total_processed_chunks += processed_chunks
         
@@ -383,12 +381,14 @@ def call_write(writer_mode, chunk_list, global_context, chunk_span, prompt_conte
         step_elapsed = current_time - last_yield_time
         
         # Create progress info tuple to check for duplicates
-        progress_info = (prompt_name, len(prompt_outputs), len(chunk_list), current_model, current_cost)
+        progress_info = (prompt_name, len(prompt_outputs), len(chunk_list), current_model, current_cost, current_tokens)
         
         if current_time - last_yield_time >= 0.2 and progress_info != last_progress_info:  # Check time and avoid duplicates
             progress_msg = f"正在 {prompt_name} （{len(prompt_outputs)} / {len(chunk_list)}）"
+            if plan_msg:
+                progress_msg += f" {plan_msg}"
             if current_model:
-                progress_msg += f" 模型：{current_model} 花费：{current_cost:.5f}{currency_symbol}"
+                progress_msg += f" 模型：{current_model} tokens：{current_tokens} 花费：{current_cost:.5f}{currency_symbol}"
             
             # 更详细的控制台日志
             print(f"📊 {'='*50}")
@@ -398,10 +398,11 @@ def call_write(writer_mode, chunk_list, global_context, chunk_span, prompt_conte
             print(f"🔢 处理进度: {len(prompt_outputs)} / {len(chunk_list)} 个块")
             print(f"🤖 使用模型: {current_model}")
             print(f"💰 当前花费: {current_cost:.5f}{currency_symbol}")
+            print(f"🔤 当前tokens: {current_tokens}")
             print(f"⏱️ 步骤用时: {step_elapsed:.2f}秒")
-            print(f"🧱 数据块数量: {len(data_chunks)}")
+            print(f"🧱 数据块数量: {len(step_rows)}")
             print(f"📊 API调用次数: {api_call_count}")
-            print(f"📄 生成字符数: {sum(len(chunk[2]) for chunk in data_chunks)}")
+            print(f"📄 生成字符数: {sum(len(row[2]) for row in step_rows.values())}")
             print(f"{'='*50}")
             
             # 累计统计信息
@@ -413,7 +414,9 @@ def call_write(writer_mode, chunk_list, global_context, chunk_span, prompt_conte
             print(f"   ⏱️ 总用时: {current_time - start_time:.2f}秒")
             print(f"{'='*50}\n")
             
-            yield delta_wrapper(data_chunks, done=False, msg=progress_msg)
+            chunk_rows = [((step_count, i), row) for i, row in sorted(step_rows.items())]
+            yield chunk_frame(chunk_rows, done=False, msg=progress_msg, changed=changed_keys)
+            changed_keys = set()
             last_yield_time = current_time  # Update the last yield time
             last_progress_info = progress_info  # Update the last progress info
 
@@ -443,12 +446,15 @@ def call_write(writer_mode, chunk_list, global_context, chunk_span, prompt_conte
     print(f"   📈 生成效率: {total_chars_generated/total_time:.2f} 字符/秒" if total_time > 0 else "")
     print(f"{'='*60}")
     
-    yield delta_wrapper(data_chunks, done=True, msg='创作完成!')
+    chunk_rows = [(('final', i), [e.strip() for e in row]) for i, row in enumerate(data_chunks)]
+    yield chunk_frame(chunk_rows, done=True, msg='创作完成!')
 
 
-@app.route('/write', methods=['POST'])
-def write():
-    data = request.json                 
+def start_write(data):
+    """
+    启动一次/write的生成过程（后台线程），返回WriteStreamSession
+    同步（Flask）和异步（async_app）两种服务方式共用
+    """
     writer_mode = data['writer_mode']
     chunk_list = data['chunk_list']
     chunk_span = data['chunk_span']
@@ -459,13 +465,20 @@ def write():
     sub_model = data['sub_model']
     global_context = data['global_context']
     only_prompt = data['only_prompt']
+    chunk_plan_mode = None
     
     # Update settings if provided
     if 'settings' in data:
         max_thread_num = data['settings']['MAX_THREAD_NUM']
+        # 可选：greedy / balanced，见Writer.get_chunks
+        chunk_plan_mode = data['settings'].get('CHUNK_PLAN_MODE')
+
+    # 在启动生成之前检查划分方式，不合法时直接返回错误，而不是在生成过程中失败
+    if (chunk_plan_mode or CHUNK_PLAN_MODE) not in CHUNK_PLAN_MODES:
+        raise ValueError(f"未知的chunk划分方式: {chunk_plan_mode or CHUNK_PLAN_MODE}，可选：{' / '.join(CHUNK_PLAN_MODES)}")
 
     # Generate unique stream ID
-    stream_id = str(time.time())
+    stream_id = uuid.uuid4().hex
     active_streams[stream_id] = True
     
     # 记录请求信息
@@ -482,15 +495,18 @@ def write():
     print(f"⏰ 请求时间: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())}")
     print(f"{'='*60}\n")
     
+    # 生成过程在后台线程中运行，通过session按序号推送增量事件，客户端断线后可以用GET /write/<stream_id>重新连接
+    session = create_write_session(stream_id)
+
     def generate():
         request_start_time = time.time()
         try:
             # Send stream ID to client
-            yield f"data: {json.dumps({'stream_id': stream_id})}\n\n"
+            session.publish({'stream_id': stream_id})
 
             result_count = 0
-            for result in call_write(writer_mode, list(chunk_list), global_context, chunk_span, prompt_content, x_chunk_length, y_chunk_length, main_model, sub_model, max_thread_num, only_prompt):
-                if not active_streams.get(stream_id, False):
+            for result in call_write(writer_mode, list(chunk_list), global_context, chunk_span, prompt_content, x_chunk_length, y_chunk_length, main_model, sub_model, max_thread_num, only_prompt, chunk_plan_mode=chunk_plan_mode):
+                if not active_streams.get(stream_id, False) or not session.is_active():
                     # Stream was stopped by client
                     print(f"⏹️ Stream被客户端停止: {stream_id}")
                     print(f"⏱️ 运行时间: {time.time() - request_start_time:.2f}秒")
@@ -500,7 +516,7 @@ def write():
                 if result_count <= 3:  # Log first few results
                     print(f"📤 发送结果 #{result_count}: {str(result)[:200]}...")
                 
-                yield f"data: {json.dumps(result)}\n\n"
+                session.publish(result)
                 
             print(f"✅ /write请求处理完成")
             print(f"📊 总计发送 {result_count} 个结果")
@@ -557,35 +573,63 @@ def write():
             elif 'connection' in str(e).lower():
                 error_msg += f"\n\n💡 建议: 这是网络连接错误，建议:\n- 检查网络连接\n- 检查防火墙设置\n- 检查代理设置"
             
-            error_chunk_list = [[*e[:2], error_msg] for e in chunk_list[chunk_span[0]:chunk_span[1]]]
+            error_chunk_rows = [(('error', i), [e.strip() for e in row[:2]] + [error_msg]) for i, row in enumerate(chunk_list[chunk_span[0]:chunk_span[1]])]
             
             error_data = {
                 "done": True,
-                "chunk_type": "init",
-                "chunk_list": error_chunk_list,
+                "chunk_rows": error_chunk_rows,
                 "error": True,
                 "error_details": error_details
             }
             
-            yield f"data: {json.dumps(error_data)}\n\n"
+            session.publish(error_data)
             
         finally:
+            session.close()
             # Clean up stream tracking
             if stream_id in active_streams:
                 del active_streams[stream_id]
                 print(f"🧹 清理Stream跟踪: {stream_id}")
 
-    return Response(generate(), mimetype='text/event-stream')
+    threading.Thread(target=generate, name=f'write-{stream_id}', daemon=True).start()
+    return session
 
 
-@app.route('/summary', methods=['POST'])
-def process_novel_text():
-    data = request.json
+@app.route('/write', methods=['POST'])
+def write():
+    try:
+        session = start_write(request.json)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return sse_response(session.subscribe(), request.headers.get('Accept-Encoding'))
+
+
+@app.route('/write/<stream_id>', methods=['GET'])
+def resume_write(stream_id):
+    """断线重连：补发Last-Event-ID之后的事件，生成过程仍在进行或刚结束时可用"""
+    session = get_write_session(stream_id)
+    if session is None:
+        return jsonify({'error': f'Stream不存在或已过期: {stream_id}'}), 404
+    
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    print(f"🔁 Stream重新连接: {stream_id}, Last-Event-ID: {last_event_id}")
+    return sse_response(session.subscribe(int(last_event_id) if last_event_id else None), request.headers.get('Accept-Encoding'))
+
+
+def summary_stream(data):
+    """
+    /summary的SSE事件生成器（每个事件为bytes），同步和异步两种服务方式共用
+    设置无效时在开始推送前抛出ValueError，由路由返回400
+    """
     content = data['content']
     novel_name = data['novel_name']
+    # 可选：批量或回归任务可以指定instant，缓存命中时立即返回结果
+    cache_replay = data.get('settings', {}).get('CACHE_REPLAY_MODE')
+    if cache_replay and cache_replay not in CACHE_REPLAY_MODES:
+        raise ValueError(f"未知的缓存回放模式: {cache_replay}，可选：{' / '.join(CACHE_REPLAY_MODES)}")
 
     # Generate unique stream ID
-    stream_id = str(time.time())
+    stream_id = uuid.uuid4().hex
     active_streams[stream_id] = True
     
     # 记录请求信息
@@ -604,12 +648,14 @@ def process_novel_text():
     def generate():
         request_start_time = time.time()
         try:
-            yield f"data: {json.dumps({'stream_id': stream_id})}\n\n"
+            yield encode_sse({'stream_id': stream_id})
 
             main_model = get_model_config_from_provider_model(data['main_model'])
             sub_model = get_model_config_from_provider_model(data['sub_model'])
             max_novel_summary_length = data['settings']['MAX_NOVEL_SUMMARY_LENGTH']
             max_thread_num = data['settings']['MAX_THREAD_NUM']
+            if cache_replay:
+                main_model['cache_replay'] = sub_model['cache_replay'] = cache_replay
             
             print(f"📊 处理参数:")
             print(f"   📏 最大小说长度: {max_novel_summary_length}")
@@ -619,6 +665,7 @@ def process_novel_text():
             
             last_yield_time = 0
             result_count = 0
+            last_result = None
             
             for result in process_novel(content, novel_name, main_model, sub_model, max_novel_summary_length, max_thread_num):
                 if not active_streams.get(stream_id, False):
@@ -631,20 +678,20 @@ def process_novel_text():
                 if result_count <= 3:  # Log first few results
                     print(f"📤 发送结果 #{result_count}: {str(result)[:200]}...")
                 
+                # 只编码实际发送的结果，被节流跳过的结果不做序列化
                 current_time = time.time()
-                yield_value = f"data: {json.dumps(result)}\n\n"
+                last_result = result
                 if current_time - last_yield_time >= 0.2:
                     last_yield_time = current_time
-                    yield yield_value
+                    yield encode_sse(result)
                     
-            if current_time - last_yield_time < 0.2:
+            if last_result is not None and current_time - last_yield_time < 0.2:
                 # Save last yield to yaml file
                 import yaml
-                result_dict = json.loads(yield_value.replace('data: ', '').strip())
                 with open('tmp.yaml', 'w', encoding='utf-8') as f:
-                    yaml.dump(result_dict, f, allow_unicode=True)
+                    yaml.dump(json.loads(json.dumps(last_result)), f, allow_unicode=True)
                     
-                yield yield_value   # Ensure last yield is returned
+                yield encode_sse(last_result)   # Ensure last yield is returned
                 
             print(f"✅ /summary请求处理完成")
             print(f"📊 总计发送 {result_count} 个结果")
@@ -710,7 +757,7 @@ def process_novel_text():
                 "error_details": error_details
             }
             
-            yield f"data: {json.dumps(error_data)}\n\n"
+            yield encode_sse(error_data)
             
         finally:
             # Clean up stream tracking
@@ -718,7 +765,16 @@ def process_novel_text():
                 del active_streams[stream_id]
                 print(f"🧹 清理Stream跟踪: {stream_id}")
 
-    return Response(generate(), mimetype='text/event-stream')
+    return generate()
+
+
+@app.route('/summary', methods=['POST'])
+def process_novel_text():
+    try:
+        stream = summary_stream(request.json)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return sse_response(stream, request.headers.get('Accept-Encoding'))
 
 # Dictionary to track active streams
 active_streams = {}
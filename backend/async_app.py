@@ -0,0 +1,182 @@
+"""
+后端的异步服务方式：/write、/write/<stream_id>、/summary的SSE连接由aiohttp的事件循环持有，
+等待新事件时不占用线程；其余路由仍由Flask应用处理（在线程池中运行）
+启动方式：
+    python backend/async_app.py
+    gunicorn async_app:create_app --worker-class aiohttp.GunicornWebWorker
+"""
+import os
+import sys
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+from multidict import CIMultiDict
+from werkzeug.test import EnvironBuilder
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app as flask_app, start_write, summary_stream, BACKEND_HOST, BACKEND_PORT
+from write_stream import get_write_session
+from response_encoder import StreamCompressor, choose_compression, dumps
+from config import ASYNC_WSGI_THREADS
+
+wsgi_executor_key = web.AppKey('wsgi_executor', ThreadPoolExecutor)
+
+# hop-by-hop头和由aiohttp重新计算的头，不从Flask的响应中复制
+SKIP_RESPONSE_HEADERS = {'content-length', 'transfer-encoding', 'connection', 'keep-alive'}
+
+
+async def iterate_in_thread(iterator):
+    """
+    在后台线程中迭代同步生成器（如调用LLM的process_novel），通过队列把结果交给事件循环
+    消费方停止迭代后，后台线程在下一个结果产生时退出
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    finished = object()
+    stopped = threading.Event()
+
+    def pump():
+        try:
+            for item in iterator:
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+                if stopped.is_set():
+                    break
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, e)
+        finally:
+            iterator.close()
+            loop.call_soon_threadsafe(queue.put_nowait, finished)
+
+    threading.Thread(target=pump, name='summary-stream', daemon=True).start()
+    try:
+        while True:
+            item = await queue.get()
+            if item is finished:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stopped.set()
+
+
+async def send_sse(request, frames):
+    """
+    把SSE帧（bytes）的异步生成器写入流式响应，压缩方式与response_encoder.sse_response一致
+    """
+    encoding = choose_compression(request.headers.get('Accept-Encoding'))
+    headers = {
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        # 禁止nginx等反向代理缓冲SSE
+        'X-Accel-Buffering': 'no',
+        'Access-Control-Allow-Origin': '*',
+    }
+    if encoding is not None:
+        headers.update({'Content-Encoding': encoding, 'Vary': 'Accept-Encoding'})
+    compressor = StreamCompressor(encoding) if encoding is not None else None
+
+    response = web.StreamResponse(headers=headers)
+    await response.prepare(request)
+    try:
+        async for frame in frames:
+            await response.write(compressor.compress(frame) if compressor else frame)
+        if compressor:
+            await response.write(compressor.finish())
+    finally:
+        # 客户端断开时关闭上游生成器，WriteStreamSession据此记录订阅者离开
+        await frames.aclose()
+    await response.write_eof()
+    return response
+
+
+async def write(request):
+    data = await request.json()
+    try:
+        session = start_write(data)
+    except ValueError as e:
+        return web.Response(status=400, body=dumps({'error': str(e)}),
+                            content_type='application/json', headers={'Access-Control-Allow-Origin': '*'})
+    return await send_sse(request, session.subscribe_async())
+
+
+async def resume_write(request):
+    """断线重连：补发Last-Event-ID之后的事件，生成过程仍在进行或刚结束时可用"""
+    stream_id = request.match_info['stream_id']
+    session = get_write_session(stream_id)
+    if session is None:
+        return web.Response(status=404, body=dumps({'error': f'Stream不存在或已过期: {stream_id}'}),
+                            content_type='application/json', headers={'Access-Control-Allow-Origin': '*'})
+
+    last_event_id = request.headers.get('Last-Event-ID') or request.query.get('last_event_id')
+    print(f"🔁 Stream重新连接: {stream_id}, Last-Event-ID: {last_event_id}")
+    return await send_sse(request, session.subscribe_async(int(last_event_id) if last_event_id else None))
+
+
+async def summary(request):
+    data = await request.json()
+    try:
+        stream = summary_stream(data)
+    except ValueError as e:
+        return web.Response(status=400, body=dumps({'error': str(e)}),
+                            content_type='application/json', headers={'Access-Control-Allow-Origin': '*'})
+    return await send_sse(request, iterate_in_thread(stream))
+
+
+async def wsgi_fallback(request):
+    """其余路由（设置、提示词、统计等短请求）交给Flask应用，在线程池中运行"""
+    body = await request.read()
+    environ = EnvironBuilder(
+        path=request.path,
+        method=request.method,
+        headers=list(request.headers.items()),
+        query_string=request.query_string,
+        data=body,
+    ).get_environ()
+    if request.remote:
+        environ['REMOTE_ADDR'] = request.remote
+
+    def run():
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = headers
+
+        result = flask_app(environ, start_response)
+        try:
+            response['body'] = b''.join(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        return response
+
+    response = await asyncio.get_running_loop().run_in_executor(request.app[wsgi_executor_key], run)
+    headers = CIMultiDict((key, value) for key, value in response['headers'] if key.lower() not in SKIP_RESPONSE_HEADERS)
+    return web.Response(status=response['status'], headers=headers, body=response['body'])
+
+
+async def create_app():
+    app = web.Application(client_max_size=64 * 1024 * 1024)
+    executor = ThreadPoolExecutor(max_workers=ASYNC_WSGI_THREADS, thread_name_prefix='wsgi')
+    app[wsgi_executor_key] = executor
+
+    async def shutdown_executor(app):
+        executor.shutdown(wait=False)
+    app.on_cleanup.append(shutdown_executor)
+
+    app.router.add_post('/write', write)
+    app.router.add_get('/write/{stream_id}', resume_write)
+    app.router.add_post('/summary', summary)
+    # 其他方法（如CORS预检的OPTIONS）和其余路由交给Flask
+    app.router.add_route('*', '/{tail:.*}', wsgi_fallback)
+    return app
+
+
+if __name__ == '__main__':
+    print(f"🚀 异步服务启动: http://{BACKEND_HOST}:{BACKEND_PORT}")
+    web.run_app(create_app(), host=BACKEND_HOST, port=BACKEND_PORT)
@@ -0,0 +1,112 @@
+import json
+import zlib
+
+from flask import Response
+from flask.json.provider import DefaultJSONProvider
+
+from config import ENABLE_FAST_JSON, SSE_COMPRESSION
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+USE_ORJSON = ENABLE_FAST_JSON and orjson is not None
+
+
+def dumps(obj):
+    """
+    把obj编码为UTF-8的JSON字节串，中文直接输出（不转义为\\uXXXX）
+    安装了orjson时优先使用，orjson不支持的类型回退到json
+    """
+    if USE_ORJSON:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            pass
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def encode_sse(payload, event_id=None):
+    """编码一个SSE事件，event_id不为None时带上id字段，用于断线重连时的Last-Event-ID"""
+    prefix = f"id: {event_id}\n".encode() if event_id is not None else b''
+    return prefix + b"data: " + dumps(payload) + b"\n\n"
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """jsonify使用的JSON编码，输出UTF-8而不是\\uXXXX转义"""
+    ensure_ascii = False
+    sort_keys = False
+
+    def dumps(self, obj, **kwargs):
+        if USE_ORJSON and not kwargs:
+            try:
+                return orjson.dumps(obj).decode('utf-8')
+            except TypeError:
+                pass
+        return super().dumps(obj, **kwargs)
+
+
+class StreamCompressor:
+    """
+    SSE的流式压缩：同一个流共用一个压缩上下文（后面的帧可以引用前面的内容），
+    每帧之后Z_SYNC_FLUSH，客户端收到后立即可以解压，不会被压缩缓冲延迟
+    """
+    def __init__(self, encoding):
+        wbits = 16 + zlib.MAX_WBITS if encoding == 'gzip' else zlib.MAX_WBITS
+        self.encoding = encoding
+        self._compressor = zlib.compressobj(6, zlib.DEFLATED, wbits)
+
+    def compress(self, data):
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+def choose_compression(accept_encoding, compression=SSE_COMPRESSION):
+    """根据配置和客户端的Accept-Encoding选择压缩方式，不压缩时返回None"""
+    if compression not in ('gzip', 'deflate'):
+        return None
+    accepted = [e.split(';')[0].strip() for e in (accept_encoding or '').split(',')]
+    return compression if compression in accepted else None
+
+
+def sse_response(frames, accept_encoding=None):
+    """
+    把SSE帧（bytes或str）的生成器包装为流式响应，按配置对整个流压缩
+    Args:
+        frames: 生成SSE帧的生成器
+        accept_encoding: 请求的Accept-Encoding头
+    """
+    encoding = choose_compression(accept_encoding)
+    headers = {
+        'Cache-Control': 'no-cache',
+        # 禁止nginx等反向代理缓冲SSE
+        'X-Accel-Buffering': 'no',
+    }
+
+    def encode_frames():
+        try:
+            for frame in frames:
+                yield frame.encode('utf-8') if isinstance(frame, str) else frame
+        finally:
+            # 客户端断开时关闭上游生成器
+            if hasattr(frames, 'close'):
+                frames.close()
+
+    def compress_frames():
+        compressor = StreamCompressor(encoding)
+        encoded = encode_frames()
+        try:
+            for frame in encoded:
+                yield compressor.compress(frame)
+            yield compressor.finish()
+        finally:
+            encoded.close()
+
+    if encoding is None:
+        return Response(encode_frames(), mimetype='text/event-stream', headers=headers)
+
+    headers.update({'Content-Encoding': encoding, 'Vary': 'Accept-Encoding'})
+    return Response(compress_frames(), mimetype='text/event-stream', headers=headers)
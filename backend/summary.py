@@ -1,34 +1,20 @@
 import time
 from core.parser_utils import parse_chapters
-from core.summary_novel import summary_draft, summary_plot, summary_chapters
+from core.writer_utils import concurrent_yield
+from core.summary_novel import summary_chapter, summary_chapters
 from config import MAX_NOVEL_SUMMARY_LENGTH, MAX_THREAD_NUM, ENABLE_ONLINE_DEMO
 
 def batch_yield(generators, max_co_num=5, ret=[]):
-    results = [None] * len(generators)
-    yields = [None] * len(generators)
-    finished = [False] * len(generators)
-
-    while True:
-        co_num = 0
-        for i, gen in enumerate(generators):
-            if finished[i]:
-                continue
-
-            try:
-                co_num += 1
-                yield_value = next(gen)
-                yields[i] = yield_value
-            except StopIteration as e:
-                results[i] = e.value
-                finished[i] = True
-            
-            if co_num >= max_co_num:
-                    break
-        
-        if all(finished):
-            break
-
-        yield yields
+    # 每章的生成器在各自的worker上并发运行，最多同时运行max_co_num个
+    runner = concurrent_yield(generators, max_workers=max_co_num)
+    try:
+        while True:
+            yields, finished = next(runner)
+            yield yields
+    except StopIteration as e:
+        results = e.value
+    finally:
+        runner.close()
 
     ret.clear()
     ret.extend(results)
@@ -104,65 +90,47 @@ def process_novel(content, novel_name, model, sub_model, max_novel_summary_lengt
         print(f"❌ 章节解析失败: {error_msg}")
         raise Exception(error_msg)
 
-    # Process draft summaries
-    draft_start_time = time.time()
-    print(f"\n🔄 开始生成剧情摘要...")
-    yield {"progress_msg": "正在生成剧情摘要..."}
+    # Process draft and plot summaries
+    # 每章的剧情摘要完成后立即开始该章的章节大纲，不必等待所有章节的剧情摘要完成
+    chapters_start_time = time.time()
+    print(f"\n🔄 开始生成剧情摘要和章节大纲...")
+    yield {"progress_msg": "正在生成剧情摘要和章节大纲..."}
     
-    dw_list = []
-    gens = [summary_draft(model, sub_model, ' '.join(title), content) for title, content in zip(chapter_titles, chapter_contents)]
+    chapter_results = []
+    gens = [summary_chapter(model, sub_model, ' '.join(title), content) for title, content in zip(chapter_titles, chapter_contents)]
     
-    draft_processed = 0
-    for yields in batch_yield(gens, ret=dw_list, max_co_num=max_thread_num):
+    draft_processed = plot_processed = 0
+    for yields in batch_yield(gens, ret=chapter_results, max_co_num=max_thread_num):
         chars_num = sum([e['chars_num'] for e in yields if e is not None])
         current_cost = sum([e['current_cost'] for e in yields if e is not None])
-        current_currency = next((e['currency_symbol'] for e in yields if e is not None), '')
-        model_text = next((e['model'] for e in yields if e is not None), '')
+        current_currency = next((e['currency_symbol'] for e in yields if e is not None and e['currency_symbol']), '')
+        model_text = next((e['model'] for e in yields if e is not None and e['model']), '')
         
-        completed = sum([1 for e in yields if e is not None])
-        if completed > draft_processed:
-            draft_processed = completed
-            total_cost += current_cost
-            total_chars_generated += chars_num
-            total_api_calls += completed
-            currency_symbol = current_currency
-            
-            print(f"📊 剧情摘要进度: {completed}/{len(yields)} | 模型: {model_text} | 生成字符: {chars_num} | 花费: {current_cost:.4f}{current_currency}")
+        draft_completed = sum([1 for e in yields if e is not None and e['stage'] != 'draft'])
+        plot_completed = sum([1 for e in yields if e is not None and e['stage'] == 'done'])
+        if (draft_completed, plot_completed) != (draft_processed, plot_processed):
+            draft_processed, plot_processed = draft_completed, plot_completed
+            print(f"📊 章节处理进度: 剧情摘要 {draft_completed}/{len(yields)} | 章节大纲 {plot_completed}/{len(yields)} | 模型: {model_text} | 生成字符: {chars_num} | 花费: {current_cost:.4f}{current_currency}")
         
-        yield {"progress_msg": f"正在生成剧情摘要 进度：{completed} / {len(yields)} 模型：{model_text} 已生成字符：{chars_num} 已花费：{current_cost:.4f}{current_currency}"}
+        yield {"progress_msg": f"正在生成剧情摘要和章节大纲 剧情摘要：{draft_completed} / {len(yields)} 章节大纲：{plot_completed} / {len(yields)} 模型：{model_text} 已生成字符：{chars_num} 已花费：{current_cost:.4f}{current_currency}"}
 
-    draft_time = time.time() - draft_start_time
-    print(f"✅ 剧情摘要生成完成，耗时: {draft_time:.2f}秒")
+    chapters_time = time.time() - chapters_start_time
 
-    # Process plot summaries
-    plot_start_time = time.time()
-    print(f"\n🔄 开始生成章节大纲...")
-    yield {"progress_msg": "正在生成章节大纲..."}
-    
-    cw_list = []
-    gens = [summary_plot(model, sub_model, ' '.join(title), dw.x) for title, dw in zip(chapter_titles, dw_list)]
-    
-    plot_processed = 0
-    for yields in batch_yield(gens, ret=cw_list, max_co_num=max_thread_num):
-        chars_num = sum([e['chars_num'] for e in yields if e is not None])
-        current_cost = sum([e['current_cost'] for e in yields if e is not None])
-        current_currency = next((e['currency_symbol'] for e in yields if e is not None), '')
-        model_text = next((e['model'] for e in yields if e is not None), '')
-        
-        completed = sum([1 for e in yields if e is not None])
-        if completed > plot_processed:
-            plot_processed = completed
-            total_cost += current_cost
-            total_chars_generated += chars_num
-            total_api_calls += completed
-            currency_symbol = current_currency
-            
-            print(f"📊 章节大纲进度: {completed}/{len(yields)} | 模型: {model_text} | 生成字符: {chars_num} | 花费: {current_cost:.4f}{current_currency}")
-        
-        yield {"progress_msg": f"正在生成章节大纲 进度：{completed} / {len(yields)} 模型：{model_text} 已生成字符：{chars_num} 已花费：{current_cost:.4f}{current_currency}"}
+    dw_list = [e[0] for e in chapter_results]
+    cw_list = [e[1] for e in chapter_results]
+    chapter_stage_times = [e[2] for e in chapter_results]
+
+    # 每章返回的progress为该章剧情摘要和章节大纲的总计
+    chapter_progress = [e[3] for e in chapter_results]
+    total_cost += sum([e['current_cost'] for e in chapter_progress])
+    total_chars_generated += sum([e['chars_num'] for e in chapter_progress])
+    currency_symbol = next((e['currency_symbol'] for e in chapter_progress if e['currency_symbol']), currency_symbol)
+    total_api_calls += 2 * len(chapter_results)  # 每章各一次剧情摘要和章节大纲
 
-    plot_time = time.time() - plot_start_time
-    print(f"✅ 章节大纲生成完成，耗时: {plot_time:.2f}秒")
+    # 流水线中两个阶段互相重叠，阶段耗时取该阶段从第一章开始到最后一章完成的时间跨度
+    draft_time = max(t['draft_end'] for t in chapter_stage_times) - min(t['draft_start'] for t in chapter_stage_times)
+    plot_time = max(t['plot_end'] for t in chapter_stage_times) - min(t['plot_start'] for t in chapter_stage_times)
+    print(f"✅ 剧情摘要和章节大纲生成完成，耗时: {chapters_time:.2f}秒")
 
     # Process chapter summaries
     outline_start_time = time.time()
@@ -172,21 +140,23 @@ def process_novel(content, novel_name, model, sub_model, max_novel_summary_lengt
     ow_list = []
     gens = [summary_chapters(model, sub_model, novel_name, chapter_titles, [cw.global_context['chapter'] for cw in cw_list])]
     
+    chars_num, current_cost, current_currency = 0, 0, currency_symbol
     for yields in batch_yield(gens, ret=ow_list, max_co_num=max_thread_num):
         chars_num = sum([e['chars_num'] for e in yields if e is not None])
         current_cost = sum([e['current_cost'] for e in yields if e is not None])
         current_currency = next((e['currency_symbol'] for e in yields if e is not None), '')
         model_text = next((e['model'] for e in yields if e is not None), '')
         
-        total_cost += current_cost
-        total_chars_generated += chars_num
-        total_api_calls += 1
-        currency_symbol = current_currency
-        
         print(f"📊 全书大纲进度: 模型: {model_text} | 生成字符: {chars_num} | 花费: {current_cost:.4f}{current_currency}")
         
         yield {"progress_msg": f"正在生成全书大纲 模型：{model_text} 已生成字符：{chars_num} 已花费：{current_cost:.4f}{current_currency}"}
 
+    # yield的是累计值，全书大纲结束后只计入最后一次
+    total_cost += current_cost
+    total_chars_generated += chars_num
+    total_api_calls += 1
+    currency_symbol = current_currency or currency_symbol
+
     outline_time = time.time() - outline_start_time
     print(f"✅ 全书大纲生成完成，耗时: {outline_time:.2f}秒")
 
@@ -205,7 +175,7 @@ def process_novel(content, novel_name, model, sub_model, max_novel_summary_lengt
             'context': chapter_outline # 不采用cw.global_context['chapter']，因为不含章节名
         }
         draft_data[chapter_name] = {
-            'chunks': dw.xy_pairs,
+            'chunks': list(dw.xy_pairs),
             'context': ''  # Draft doesn't have global context
         }
     
@@ -229,6 +199,9 @@ def process_novel(content, novel_name, model, sub_model, max_novel_summary_lengt
     print(f"     🔍 章节解析: {parse_time:.2f}秒")
     print(f"     📝 剧情摘要: {draft_time:.2f}秒")
     print(f"     📋 章节大纲: {plot_time:.2f}秒")
+    print(f"     📖 剧情摘要+章节大纲（流水线）: {chapters_time:.2f}秒")
+    for title, stage_times in zip(chapter_titles, chapter_stage_times):
+        print(f"       📄 {' '.join(title)}: 剧情摘要 {stage_times['draft_time']:.2f}秒 | 章节大纲 {stage_times['plot_time']:.2f}秒")
     print(f"     📚 全书大纲: {outline_time:.2f}秒")
     print(f"     🔄 响应准备: {response_time:.2f}秒")
     print(f"   📈 性能指标:")
@@ -241,7 +214,7 @@ def process_novel(content, novel_name, model, sub_model, max_novel_summary_lengt
     final_response = {
         "progress_msg": "处理完成！",
         "outline": {
-            "chunks": outline.xy_pairs,
+            "chunks": list(outline.xy_pairs),
             "context": outline.global_context['outline']
         },
         "plot": plot_data,
@@ -259,8 +232,13 @@ def process_novel(content, novel_name, model, sub_model, max_novel_summary_lengt
                 "parse_time": parse_time,
                 "draft_time": draft_time,
                 "plot_time": plot_time,
+                "chapters_time": chapters_time,
                 "outline_time": outline_time,
-                "response_time": response_time
+                "response_time": response_time,
+                "chapters": [
+                    {"chapter": ' '.join(title), **stage_times}
+                    for title, stage_times in zip(chapter_titles, chapter_stage_times)
+                ]
             }
         }
     }
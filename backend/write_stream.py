@@ -0,0 +1,281 @@
+import time
+import asyncio
+import threading
+import itertools
+from collections import deque
+
+from config import WRITE_STREAM_BUFFER_EVENTS, WRITE_STREAM_RESUME_TIMEOUT
+from response_encoder import encode_sse
+
+
+class ChunkListStream:
+    """
+    /write的增量推送协议：记录前端当前的chunk列表（每个chunk有唯一的id），每次只生成有变化部分的操作
+    每行为[x, y, text]，field为字段序号，操作需要按顺序应用：
+    - reset: {"op": "reset", "ids": [...], "rows": [...]}，整体替换（首帧、重连时超出缓冲范围）
+    - append: {"op": "append", "id": id, "field": k, "text": s}，在字段末尾追加
+    - replace: {"op": "replace", "id": id, "field": k, "text": s}，替换字段
+    - insert: {"op": "insert", "index": i, "id": id, "row": [...]}，插入到当前列表的第i个位置
+    - delete: {"op": "delete", "id": id}
+    """
+    def __init__(self):
+        self.ids = []
+        self.keys = []
+        self.rows = []
+        self._positions = {}
+        self._next_id = 0
+
+    def _new_id(self):
+        self._next_id += 1
+        return self._next_id
+
+    def snapshot(self):
+        return {'op': 'reset', 'ids': list(self.ids), 'rows': [list(row) for row in self.rows]}
+
+    @staticmethod
+    def _diff_row(chunk_id, old_row, new_row):
+        ops = []
+        for field, (old, new) in enumerate(zip(old_row, new_row)):
+            if old is new or old == new:
+                continue
+            if new.startswith(old):
+                ops.append({'op': 'append', 'id': chunk_id, 'field': field, 'text': new[len(old):]})
+            else:
+                ops.append({'op': 'replace', 'id': chunk_id, 'field': field, 'text': new})
+        return ops
+
+    def update(self, keyed_rows, changed=None):
+        """
+        Args:
+            keyed_rows: [(key, row)]，key唯一标识一个chunk（如(步骤, batch中的序号)），key不变时视为同一个chunk
+            changed: 内容可能有变化的key集合，None表示全部检查；列表结构不变时只检查这些key，复杂度与变化量成正比
+        Returns:
+            操作列表
+        """
+        keys = [key for key, _ in keyed_rows]
+        if keys == self.keys and self.ids:
+            ops = []
+            check = range(len(keys)) if changed is None else [self._positions[key] for key in changed if key in self._positions]
+            for pos in check:
+                new_row = list(keyed_rows[pos][1])
+                ops.extend(self._diff_row(self.ids[pos], self.rows[pos], new_row))
+                self.rows[pos] = new_row
+            return ops
+
+        if not self.ids:
+            self.keys = keys
+            self.ids = [self._new_id() for _ in keys]
+            self.rows = [list(row) for _, row in keyed_rows]
+            self._positions = {key: pos for pos, key in enumerate(keys)}
+            return [self.snapshot()]
+
+        return self._restructure(keyed_rows, keys)
+
+    def _restructure(self, keyed_rows, keys):
+        # 列表结构变化（如开始新的步骤、映射后chunk数量变化）：优先按key，其次按(x, y)内容复用已有的chunk，避免重新发送未变化的内容
+        old_rows = dict(zip(self.ids, self.rows))
+        by_key = {key: chunk_id for key, chunk_id in zip(self.keys, self.ids)}
+        by_content = {}
+        for chunk_id, row in zip(self.ids, self.rows):
+            by_content.setdefault((row[0], row[1]), []).append(chunk_id)
+
+        used = set()
+        new_ids = []
+        for key, row in keyed_rows:
+            chunk_id = by_key.get(key)
+            if chunk_id is None or chunk_id in used:
+                candidates = [e for e in by_content.get((row[0], row[1]), []) if e not in used]
+                chunk_id = candidates[0] if candidates else None
+            if chunk_id is None:
+                chunk_id = self._new_id()
+            used.add(chunk_id)
+            new_ids.append(chunk_id)
+
+        ops = [{'op': 'delete', 'id': chunk_id} for chunk_id in self.ids if chunk_id not in used]
+        current = [chunk_id for chunk_id in self.ids if chunk_id in used]
+        for pos, (chunk_id, (_, row)) in enumerate(zip(new_ids, keyed_rows)):
+            row = list(row)
+            if pos < len(current) and current[pos] == chunk_id:
+                ops.extend(self._diff_row(chunk_id, old_rows[chunk_id], row))
+                continue
+            if chunk_id in old_rows:
+                # 顺序发生变化的chunk，删除后重新插入
+                current.remove(chunk_id)
+                ops.append({'op': 'delete', 'id': chunk_id})
+            current.insert(pos, chunk_id)
+            ops.append({'op': 'insert', 'index': pos, 'id': chunk_id, 'row': row})
+
+        self.keys = keys
+        self.ids = new_ids
+        self.rows = [list(row) for _, row in keyed_rows]
+        self._positions = {key: pos for pos, key in enumerate(keys)}
+        return ops
+
+
+class WriteStreamSession:
+    """
+    一次/write的生成过程，在后台线程中运行，与HTTP连接解耦
+    - 每个事件有递增的序号（SSE的id），最近的事件保存在缓冲中
+    - 客户端断线后带上Last-Event-ID重新连接，补发之后的事件；超出缓冲范围时先发送当前完整列表（reset）
+    - 没有客户端连接超过resume_timeout秒后，is_active()返回False，生成过程应停止
+    - subscribe()在线程中阻塞等待，subscribe_async()在事件循环中等待，不占用线程
+    """
+    def __init__(self, stream_id, max_events=WRITE_STREAM_BUFFER_EVENTS, resume_timeout=WRITE_STREAM_RESUME_TIMEOUT):
+        self.stream_id = stream_id
+        self.resume_timeout = resume_timeout
+        self.chunk_stream = ChunkListStream()
+        self.events = deque(maxlen=max_events)
+        self.seq = 0
+        self.done = False
+        self.subscribers = 0
+        self.detached_at = time.time()
+        self.finished_at = None
+        # 最近一帧的状态字段，断线重连时随完整列表一起发送
+        self.status = {'done': False, 'msg': None}
+        self._cond = threading.Condition()
+        self._async_waiters = set()  # {(loop, asyncio.Event)}
+
+    def publish(self, frame):
+        """
+        发布一帧，frame中有chunk_rows时转换为增量操作（chunk_type为ops），其余字段原样发送
+        """
+        with self._cond:
+            payload = dict(frame)
+            if 'chunk_rows' in payload:
+                ops = self.chunk_stream.update(payload.pop('chunk_rows'), payload.pop('changed', None))
+                payload = {'chunk_type': 'ops', 'ops': ops, **payload}
+            self.status.update({k: payload[k] for k in ('done', 'msg', 'error', 'error_details') if k in payload})
+            self.seq += 1
+            payload['seq'] = self.seq
+            self.events.append((self.seq, encode_sse(payload, self.seq)))
+            self._notify()
+            return self.seq
+
+    def close(self):
+        with self._cond:
+            self.done = True
+            self.finished_at = time.time()
+            self._notify()
+
+    def _notify(self):
+        # 持有锁时调用，唤醒线程中和事件循环中等待的订阅者
+        self._cond.notify_all()
+        for loop, wakeup in self._async_waiters:
+            try:
+                loop.call_soon_threadsafe(wakeup.set)
+            except RuntimeError:
+                # 事件循环已关闭
+                pass
+
+    def is_active(self):
+        with self._cond:
+            return self.subscribers > 0 or time.time() - self.detached_at < self.resume_timeout
+
+    def is_expired(self):
+        with self._cond:
+            return self.done and self.subscribers == 0 and time.time() - max(self.finished_at, self.detached_at) > self.resume_timeout
+
+    def _poll(self, next_seq):
+        """持有锁时调用，返回(待发送的事件, 下一个序号, 是否已结束)"""
+        if self.events and self.events[0][0] > next_seq:
+            # 需要的事件已不在缓冲中，发送当前完整列表
+            payload = {'chunk_type': 'ops', 'ops': [self.chunk_stream.snapshot()], **self.status, 'seq': self.seq}
+            pending = [encode_sse(payload, self.seq)]
+        else:
+            start = next_seq - self.events[0][0] if self.events else 0
+            pending = [data for _, data in itertools.islice(self.events, start, None)]
+        return pending, self.seq + 1, self.done
+
+    def subscribe(self, last_event_id=None):
+        """
+        Args:
+            last_event_id: 客户端已收到的最后一个事件的序号，None表示从头开始
+        Yields:
+            SSE格式的事件
+        """
+        with self._cond:
+            self.subscribers += 1
+        try:
+            next_seq = (last_event_id or 0) + 1
+            while True:
+                with self._cond:
+                    while self.seq < next_seq and not self.done:
+                        self._cond.wait()
+                    pending, next_seq, done = self._poll(next_seq)
+
+                for data in pending:
+                    yield data
+                if done and not pending:
+                    return
+        finally:
+            with self._cond:
+                self.subscribers -= 1
+                self.detached_at = time.time()
+
+    async def subscribe_async(self, last_event_id=None):
+        """subscribe()的异步版本，等待新事件时不占用线程"""
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._cond:
+            self.subscribers += 1
+            self._async_waiters.add(waiter)
+        try:
+            next_seq = (last_event_id or 0) + 1
+            while True:
+                with self._cond:
+                    ready = self.seq >= next_seq or self.done
+                    if ready:
+                        pending, next_seq, done = self._poll(next_seq)
+                    else:
+                        # 在锁内清除，publish在之后set，不会丢失唤醒
+                        waiter[1].clear()
+                if not ready:
+                    await waiter[1].wait()
+                    continue
+
+                for data in pending:
+                    yield data
+                if done and not pending:
+                    return
+        finally:
+            with self._cond:
+                self.subscribers -= 1
+                self._async_waiters.discard(waiter)
+                self.detached_at = time.time()
+
+
+# 会话保存在进程内存中，断线重连和停止请求必须到达同一个进程，见start.sh
+_sessions = {}
+_sessions_lock = threading.Lock()
+_sweeper = None
+
+
+def sweep_write_sessions():
+    """删除已结束且超过resume_timeout没有客户端连接的会话，返回删除的数量"""
+    with _sessions_lock:
+        expired_ids = [k for k, session in _sessions.items() if session.is_expired()]
+        for expired_id in expired_ids:
+            del _sessions[expired_id]
+        return len(expired_ids)
+
+
+def _sweep_forever(interval):
+    while True:
+        time.sleep(interval)
+        sweep_write_sessions()
+
+
+def create_write_session(stream_id):
+    global _sweeper
+    sweep_write_sessions()
+    with _sessions_lock:
+        if _sweeper is None:
+            # 定期清理过期会话，没有新请求时已结束的会话也会被释放
+            _sweeper = threading.Thread(target=_sweep_forever, args=(max(1, WRITE_STREAM_RESUME_TIMEOUT),), name='write-session-sweeper', daemon=True)
+            _sweeper.start()
+        session = _sessions[stream_id] = WriteStreamSession(stream_id)
+        return session
+
+
+def get_write_session(stream_id):
+    with _sessions_lock:
+        return _sessions.get(stream_id)
@@ -1,4 +1,5 @@
 import os
+import json
 from dotenv import dotenv_values, load_dotenv
 
 print("Loading .env file...")
@@ -23,6 +24,31 @@ MAX_THREAD_NUM = int(os.getenv('MAX_THREAD_NUM', 5))
 
 MAX_NOVEL_SUMMARY_LENGTH = int(os.getenv('MAX_NOVEL_SUMMARY_LENGTH', 20000))
 
+# LLM Client Pool Configuration
+CLIENT_POOL_MAX_CONNECTIONS = int(os.getenv('CLIENT_POOL_MAX_CONNECTIONS', 20))
+CLIENT_POOL_MAX_KEEPALIVE = int(os.getenv('CLIENT_POOL_MAX_KEEPALIVE', 10))
+CLIENT_POOL_KEEPALIVE_EXPIRY = float(os.getenv('CLIENT_POOL_KEEPALIVE_EXPIRY', 60))
+CLIENT_POOL_IDLE_TIMEOUT = float(os.getenv('CLIENT_POOL_IDLE_TIMEOUT', 600))
+
+# LLM Request Scheduler Configuration
+# 全局调度器的限制参数，0表示不限制；OpenAI兼容接口以base_url的域名作为提供商名（如api.deepseek.com）
+# 可以通过LLM_RATE_LIMITS环境变量（JSON）为单个提供商覆盖，如 {"api.deepseek.com": {"rpm": 60, "tpm": 100000}}
+LLM_RATE_LIMITS = {
+    'default': {
+        'max_concurrency': int(os.getenv('LLM_MAX_CONCURRENCY', 16)),
+        'key_max_concurrency': int(os.getenv('LLM_KEY_MAX_CONCURRENCY', 8)),
+        'rpm': int(os.getenv('LLM_RPM', 0)),
+        'tpm': int(os.getenv('LLM_TPM', 0)),
+    },
+    **json.loads(os.getenv('LLM_RATE_LIMITS', '{}')),
+}
+LLM_SCHEDULER_MAX_WAIT = float(os.getenv('LLM_SCHEDULER_MAX_WAIT', 600))
+# 合并同时进行的相同LLM请求（相同模型、消息和生成参数），只调用一次上游并只记录一次费用
+ENABLE_SINGLE_FLIGHT = os.getenv('ENABLE_SINGLE_FLIGHT', 'true').lower() == 'true'
+# 流式请求时要求OpenAI兼容接口返回实际用量（stream_options.include_usage），用于统计tokens和费用
+# 不支持该参数的接口返回指出该参数的400错误时，会自动去掉该参数重试一次
+LLM_STREAM_INCLUDE_USAGE = os.getenv('LLM_STREAM_INCLUDE_USAGE', 'true').lower() == 'true'
+
 # MongoDB Configuration
 ENABLE_MONOGODB = os.getenv('ENABLE_MONGODB', 'false').lower() == 'true'
 MONGODB_URI = os.getenv('MONGODB_URI', 'mongodb://127.0.0.1:27017/')
@@ -30,6 +56,24 @@ MONOGODB_DB_NAME = os.getenv('MONGODB_DB_NAME', 'llm_api')
 ENABLE_MONOGODB_CACHE = os.getenv('ENABLE_MONGODB_CACHE', 'true').lower() == 'true'
 CACHE_REPLAY_SPEED = float(os.getenv('CACHE_REPLAY_SPEED', 2))
 CACHE_REPLAY_MAX_DELAY = float(os.getenv('CACHE_REPLAY_MAX_DELAY', 5))
+# 缓存命中时的默认回放模式：typewriter（按记录的间隔回放） / coarse（少量中间帧） / instant（直接返回结果）
+CACHE_REPLAY_MODES = ('typewriter', 'coarse', 'instant')
+CACHE_REPLAY_MODE = os.getenv('CACHE_REPLAY_MODE', 'typewriter').lower()
+if CACHE_REPLAY_MODE not in CACHE_REPLAY_MODES:
+    raise ValueError(f"未知的缓存回放模式: CACHE_REPLAY_MODE={CACHE_REPLAY_MODE}，可选：{' / '.join(CACHE_REPLAY_MODES)}")
+CACHE_REPLAY_COARSE_FRAMES = max(1, int(os.getenv('CACHE_REPLAY_COARSE_FRAMES', 4)))
+# 费用记录和缓存条目在后台线程中批量写入MongoDB（insert_many），不阻塞请求线程
+ENABLE_WRITE_BEHIND = os.getenv('ENABLE_WRITE_BEHIND', 'true').lower() == 'true'
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv('WRITE_BEHIND_BATCH_SIZE', 100))
+WRITE_BEHIND_FLUSH_INTERVAL = float(os.getenv('WRITE_BEHIND_FLUSH_INTERVAL', 1))  # 秒
+WRITE_BEHIND_MAX_QUEUE = int(os.getenv('WRITE_BEHIND_MAX_QUEUE', 10000))  # 队列满时写入方阻塞
+
+# LLM Response Cache Configuration
+# 缓存后端：mongodb / sqlite / none，未设置时开启MongoDB则使用mongodb，否则不缓存
+LLM_CACHE_BACKEND = os.getenv('LLM_CACHE_BACKEND', 'mongodb' if ENABLE_MONOGODB else 'none').lower()
+LLM_CACHE_SQLITE_PATH = os.getenv('LLM_CACHE_SQLITE_PATH', os.path.join(os.path.dirname(__file__), 'cache', 'llm_cache.sqlite3'))
+LLM_CACHE_MAX_BYTES = int(os.getenv('LLM_CACHE_MAX_BYTES', 512 * 1024 * 1024))  # 0表示不限制
+LLM_CACHE_TTL = float(os.getenv('LLM_CACHE_TTL', 30 * 24 * 3600))  # 秒，0表示不过期
 
 # API Cost Limits
 API_COST_LIMITS = {
@@ -37,6 +81,8 @@ API_COST_LIMITS = {
     'DAILY_LIMIT_RMB': float(os.getenv('API_DAILY_LIMIT_RMB', 500)),
     'USD_TO_RMB_RATE': float(os.getenv('API_USD_TO_RMB_RATE', 7))
 }
+# 费用账本与数据库对账的间隔（秒），对账在后台进行，用于同步其他进程产生的费用
+COST_LEDGER_RECONCILE_INTERVAL = float(os.getenv('COST_LEDGER_RECONCILE_INTERVAL', 300))
 
 # API Settings
 API_SETTINGS = {
@@ -78,4 +124,21 @@ for model in API_SETTINGS.values():
 DEFAULT_MAIN_MODEL = os.getenv('DEFAULT_MAIN_MODEL', 'wenxin/ERNIE-Novel-8K')
 DEFAULT_SUB_MODEL = os.getenv('DEFAULT_SUB_MODEL', 'wenxin/ERNIE-3.5-8K')
 
-ENABLE_ONLINE_DEMO = os.getenv('ENABLE_ONLINE_DEMO', 'false').lower() == 'true'
\ No newline at end of file
+ENABLE_ONLINE_DEMO = os.getenv('ENABLE_ONLINE_DEMO', 'false').lower() == 'true'
+
+# /write增量推送：每个生成过程缓冲最近的事件数，客户端断线后可带上Last-Event-ID在resume_timeout秒内重新连接
+WRITE_STREAM_BUFFER_EVENTS = int(os.getenv('WRITE_STREAM_BUFFER_EVENTS', 1000))
+WRITE_STREAM_RESUME_TIMEOUT = float(os.getenv('WRITE_STREAM_RESUME_TIMEOUT', 60))  # 秒，超时没有客户端连接则停止生成
+# 后端JSON/SSE响应直接输出UTF-8，安装了orjson时使用orjson编码
+ENABLE_FAST_JSON = os.getenv('ENABLE_FAST_JSON', 'true').lower() == 'true'
+# SSE流式压缩：none / gzip / deflate，客户端的Accept-Encoding支持时才压缩，每帧之后立即flush
+SSE_COMPRESSION = os.getenv('SSE_COMPRESSION', 'none').lower()
+# 异步服务（backend/async_app.py）中运行其余Flask路由的线程数
+ASYNC_WSGI_THREADS = int(os.getenv('ASYNC_WSGI_THREADS', 8))
+
+# Writer的调试检查：开启后会重新扫描pair区间来验证长度索引，开销与文本长度成正比
+WRITER_DEBUG_CHECKS = os.getenv('WRITER_DEBUG_CHECKS', 'false').lower() == 'true'
+# Writer.get_chunks的chunk划分方式：greedy（每次前进0.8倍chunk长度）/ balanced（chunk数最少且长度均匀）
+CHUNK_PLAN_MODE = os.getenv('CHUNK_PLAN_MODE', 'greedy').lower()
+# Writer.xy_pairs的存储方式：list（普通列表）/ rope（持久化treap，切片替换O(log n)，快照O(1)，适合很长的文本）
+WRITER_PAIR_STORAGE = os.getenv('WRITER_PAIR_STORAGE', 'list').lower()
@@ -0,0 +1,190 @@
+import uuid
+import itertools
+
+
+class FenwickTree:
+    """
+    树状数组：单点更新和前缀和查询都是O(log n)
+    bisect_left/bisect_right与在前缀和数组[0, s1, s1+s2, ...]上调用bisect的结果相同（要求值非负）
+    """
+    def __init__(self, values=()):
+        self.build(values)
+
+    def build(self, values):
+        """O(n)建树"""
+        tree = [0]
+        tree.extend(values)
+        n = len(tree) - 1
+        for i in range(1, n + 1):
+            j = i + (i & -i)
+            if j <= n:
+                tree[j] += tree[i]
+        self.tree = tree
+        self.n = n
+        self._top = 1 << (n.bit_length() - 1) if n else 0
+
+    def __len__(self):
+        return self.n
+
+    def add(self, i, delta):
+        """第i个值（从0开始）加上delta"""
+        i += 1
+        while i <= self.n:
+            self.tree[i] += delta
+            i += i & -i
+
+    def prefix_sum(self, i):
+        """前i个值的和"""
+        total = 0
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+
+    def _descend(self, value, strict):
+        # 返回前缀和 <= value（strict时为 < value）的最大的i，不存在时返回-1
+        if value < 0 or (strict and value <= 0):
+            return -1
+        pos = 0
+        step = self._top
+        while step:
+            nxt = pos + step
+            if nxt <= self.n and (self.tree[nxt] < value if strict else self.tree[nxt] <= value):
+                pos = nxt
+                value -= self.tree[nxt]
+            step >>= 1
+        return pos
+
+    def bisect_left(self, value):
+        return self._descend(value, strict=True) + 1
+
+    def bisect_right(self, value):
+        return self._descend(value, strict=False) + 1
+
+
+class PairLengthIndex:
+    """
+    Writer.xy_pairs中每个pair的x、y长度的前缀和索引，用于O(log n)的区间长度查询和span对齐
+    - 替换相同数量的pair时逐个单点更新
+    - pair数量变化时只更新长度列表，下次查询时再O(n)重建（一次apply_chunks中的多次替换只重建一次）
+    pair数量变化的apply_chunks均摊为O(n)：列表存储下xy_pairs和lengths的切片替换本身就是O(n)，
+    重建的开销与之同阶，因此不再维护可以插入删除的树；需要O(log n)替换时使用WRITER_PAIR_STORAGE=rope，
+    此时PairRope本身作为长度索引，不使用这个类
+    """
+    def __init__(self, pairs):
+        self.lengths = [(len(pair[0]), len(pair[1])) for pair in pairs]
+        self.totals = [sum(e[0] for e in self.lengths), sum(e[1] for e in self.lengths)]
+        self._trees = None
+
+    def __len__(self):
+        return len(self.lengths)
+
+    @property
+    def trees(self):
+        if self._trees is None:
+            self._trees = FenwickTree(e[0] for e in self.lengths), FenwickTree(e[1] for e in self.lengths)
+        return self._trees
+
+    def splice(self, start, end, new_pairs):
+        """与 xy_pairs[start:end] = new_pairs 同步更新"""
+        new_lengths = [(len(pair[0]), len(pair[1])) for pair in new_pairs]
+        old_lengths = self.lengths[start:end]
+        for axis in (0, 1):
+            self.totals[axis] += sum(e[axis] for e in new_lengths) - sum(e[axis] for e in old_lengths)
+
+        if len(new_lengths) == len(old_lengths) and self._trees is not None:
+            for i, (old, new) in enumerate(zip(old_lengths, new_lengths), start=start):
+                for axis in (0, 1):
+                    if new[axis] != old[axis]:
+                        self._trees[axis].add(i, new[axis] - old[axis])
+        else:
+            self._trees = None
+        self.lengths[start:end] = new_lengths
+
+    def total(self, axis):
+        return self.totals[axis]
+
+    def prefix_sums(self, axis):
+        """axis上的前缀和数组[0, l1, l1+l2, ...]，O(n)"""
+        return list(itertools.accumulate((e[axis] for e in self.lengths), initial=0))
+
+    def prefix(self, i, axis):
+        """前i个pair在axis（0为x，1为y）上的总长度"""
+        return self.trees[axis].prefix_sum(i)
+
+    def span_length(self, span):
+        """pair区间[span[0], span[1])的(x长度, y长度)"""
+        x_tree, y_tree = self.trees
+        return x_tree.prefix_sum(span[1]) - x_tree.prefix_sum(span[0]), y_tree.prefix_sum(span[1]) - y_tree.prefix_sum(span[0])
+
+    def align(self, l, r, axis):
+        """
+        把axis上的字符区间[l, r)扩展到pair的边界
+        Returns:
+            (aligned_span, pair_span)
+        """
+        tree = self.trees[axis]
+        start_pair = tree.bisect_right(l) - 1
+        end_pair = tree.bisect_left(r)
+        if not 0 <= start_pair < end_pair <= tree.n:
+            raise IndexError(f"span ({l}, {r}) 超出范围，总长度为{self.totals[axis]}")
+        return (tree.prefix_sum(start_pair), tree.prefix_sum(end_pair)), (start_pair, end_pair)
+
+
+class PairIdIndex:
+    """
+    Writer.xy_pairs中每个pair的id（被替换的pair获得新的id）和id到位置的索引，用于O(1)定位chunk
+    - space区分不同的Writer（以及重新赋值后的xy_pairs），其他来源的id不会被误认
+    - 替换不重建位置索引，只记录一次位移，查询时应用建立索引之后的位移；位移超过MAX_SHIFTS次时下次查询再O(n)重建
+    """
+    MAX_SHIFTS = 64
+
+    def __init__(self, num_pairs):
+        self.space = uuid.uuid4().hex
+        self.ids = list(range(num_pairs))
+        self._next_id = num_pairs
+        self._positions = None  # 建立索引时各id的位置
+        self._new_positions = {}  # 建立索引之后新增的id -> (位置, 当时已有的位移数)
+        self._shifts = []       # (替换区间的原终点, 位移量)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def splice(self, start, end, count):
+        """与 xy_pairs[start:end] = new_pairs 同步更新，count为new_pairs的数量，返回新pair的id"""
+        new_ids = list(range(self._next_id, self._next_id + count))
+        self._next_id += count
+        old_ids = self.ids[start:end]
+        self.ids[start:end] = new_ids
+
+        if self._positions is not None:
+            for pair_id in old_ids:
+                if self._positions.pop(pair_id, None) is None:
+                    del self._new_positions[pair_id]
+            if count != end - start:
+                self._shifts.append((end, count - (end - start)))
+            if len(self._shifts) > self.MAX_SHIFTS:
+                self._positions = None
+            else:
+                version = len(self._shifts)
+                for i, pair_id in enumerate(new_ids, start=start):
+                    self._new_positions[pair_id] = (i, version)
+        return new_ids
+
+    def position(self, pair_id):
+        """pair_id当前的位置，不存在（已被替换）时返回None"""
+        if self._positions is None:
+            self._positions = dict(zip(self.ids, range(len(self.ids))))
+            self._new_positions = {}
+            self._shifts = []
+        i = self._positions.get(pair_id)
+        if i is not None:
+            version = 0
+        elif pair_id in self._new_positions:
+            i, version = self._new_positions[pair_id]
+        else:
+            return None
+        for end, delta in self._shifts[version:]:
+            if i >= end:
+                i += delta
+        return i
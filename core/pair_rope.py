@@ -0,0 +1,269 @@
+import random
+
+
+class _Node:
+    """
+    rope的节点，创建后不再修改（修改时复制路径上的节点），所以不同的快照可以共享节点
+    size/x_len/y_len为子树中pair的数量和x、y的总长度
+    """
+    __slots__ = ('pair', 'priority', 'left', 'right', 'size', 'x_len', 'y_len')
+
+    def __init__(self, pair, priority, left=None, right=None):
+        self.pair = pair
+        self.priority = priority
+        self.left = left
+        self.right = right
+        self.size = 1
+        self.x_len = len(pair[0])
+        self.y_len = len(pair[1])
+        if left is not None:
+            self.size += left.size
+            self.x_len += left.x_len
+            self.y_len += left.y_len
+        if right is not None:
+            self.size += right.size
+            self.x_len += right.x_len
+            self.y_len += right.y_len
+
+    def axis_len(self, axis):
+        return self.x_len if axis == 0 else self.y_len
+
+
+def _size(node):
+    return node.size if node is not None else 0
+
+
+def _axis_len(node, axis):
+    return node.axis_len(axis) if node is not None else 0
+
+
+def _build(pairs):
+    """由pair列表O(n)建立平衡的树，优先级按深度分层，保证堆序"""
+    if not pairs:
+        return None
+    depth = len(pairs).bit_length() + 1
+
+    def build(lo, hi, d):
+        if lo >= hi:
+            return None
+        mid = (lo + hi) // 2
+        priority = (depth - d - random.random()) / depth
+        return _Node(pairs[mid], priority, build(lo, mid, d + 1), build(mid + 1, hi, d + 1))
+
+    return build(0, len(pairs), 0)
+
+
+def _merge(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    if a.priority > b.priority:
+        return _Node(a.pair, a.priority, a.left, _merge(a.right, b))
+    return _Node(b.pair, b.priority, _merge(a, b.left), b.right)
+
+
+def _split(node, k):
+    """分为前k个pair和其余部分"""
+    if node is None:
+        return None, None
+    left_size = _size(node.left)
+    if k <= left_size:
+        a, b = _split(node.left, k)
+        return a, _Node(node.pair, node.priority, b, node.right)
+    a, b = _split(node.right, k - left_size - 1)
+    return _Node(node.pair, node.priority, node.left, a), b
+
+
+def _iter_nodes(node, start, stop):
+    # 中序遍历第[start, stop)个pair
+    stack = []
+    offset = 0
+    while node is not None:
+        left_size = _size(node.left)
+        if start < offset + left_size:
+            stack.append((node, offset))
+            node = node.left
+        else:
+            if start == offset + left_size:
+                stack.append((node, offset))
+                break
+            offset += left_size + 1
+            node = node.right
+
+    index = start
+    while stack and index < stop:
+        node, offset = stack.pop()
+        yield node.pair
+        index += 1
+        node, offset = node.right, offset + _size(node.left) + 1
+        while node is not None:
+            stack.append((node, offset))
+            node = node.left
+
+
+class PairRope:
+    """
+    Writer.xy_pairs的另一种存储方式（见config.WRITER_PAIR_STORAGE）：按位置组织的持久化treap
+    - 支持list的常用操作（len、索引、切片读取和切片赋值、迭代），切片赋值为O(log n + k)
+    - 每个节点缓存子树的x、y总长度，同时实现PairLengthIndex的查询接口（total、prefix、span_length、align、prefix_sums）
+    - 节点不可变，copy()为O(1)的快照，修改互不影响
+    - text(axis)按需拼接文本，内容不变时重复访问直接返回缓存
+    """
+    def __init__(self, pairs=()):
+        self._root = _build(list(pairs))
+        self._text_cache = {}
+
+    @classmethod
+    def _from_root(cls, root):
+        rope = cls.__new__(cls)
+        rope._root = root
+        rope._text_cache = {}
+        return rope
+
+    def copy(self):
+        return self._from_root(self._root)
+
+    def __copy__(self):
+        return self.copy()
+
+    def __deepcopy__(self, memo):
+        # pair中的字符串不可变，节点也不会被修改，共享即可
+        return self.copy()
+
+    def __reduce__(self):
+        return (PairRope, (list(self),))
+
+    def __len__(self):
+        return _size(self._root)
+
+    def __iter__(self):
+        return _iter_nodes(self._root, 0, len(self))
+
+    def __eq__(self, other):
+        if isinstance(other, (PairRope, list, tuple)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    def __repr__(self):
+        return f"PairRope({list(self)!r})"
+
+    def _slice_range(self, index):
+        start, stop, step = index.indices(len(self))
+        if step != 1:
+            raise ValueError("PairRope不支持步长不为1的切片")
+        return start, max(start, stop)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop = self._slice_range(index)
+            return list(_iter_nodes(self._root, start, stop))
+
+        n = len(self)
+        if index < 0:
+            index += n
+        if not 0 <= index < n:
+            raise IndexError("PairRope index out of range")
+        node = self._root
+        while True:
+            left_size = _size(node.left)
+            if index < left_size:
+                node = node.left
+            elif index == left_size:
+                return node.pair
+            else:
+                index -= left_size + 1
+                node = node.right
+
+    def __setitem__(self, index, pairs):
+        if isinstance(index, slice):
+            start, stop = self._slice_range(index)
+            self.splice(start, stop, pairs)
+        else:
+            if index < 0:
+                index += len(self)
+            if not 0 <= index < len(self):
+                raise IndexError("PairRope assignment index out of range")
+            self.splice(index, index + 1, [pairs])
+
+    def __delitem__(self, index):
+        if not isinstance(index, slice):
+            index = slice(index, index + 1 if index != -1 else None)
+        self[index] = []
+
+    def append(self, pair):
+        self.splice(len(self), len(self), [pair])
+
+    def extend(self, pairs):
+        self.splice(len(self), len(self), pairs)
+
+    def splice(self, start, end, new_pairs):
+        """等价于 pairs[start:end] = new_pairs，O(log n + len(new_pairs))"""
+        left, rest = _split(self._root, start)
+        _, right = _split(rest, end - start)
+        self._root = _merge(_merge(left, _build(list(new_pairs))), right)
+        self._text_cache = {}
+
+    def text(self, axis):
+        """所有pair在axis（0为x，1为y）上的文本"""
+        if axis not in self._text_cache:
+            self._text_cache[axis] = ''.join(pair[axis] for pair in self)
+        return self._text_cache[axis]
+
+    # 以下与PairLengthIndex的接口相同
+    def total(self, axis):
+        return _axis_len(self._root, axis)
+
+    def prefix(self, i, axis):
+        """前i个pair在axis上的总长度，O(log n)"""
+        total = 0
+        node = self._root
+        while node is not None and i > 0:
+            left_size = _size(node.left)
+            if i <= left_size:
+                node = node.left
+            else:
+                total += _axis_len(node.left, axis) + len(node.pair[axis])
+                i -= left_size + 1
+                node = node.right
+        return total
+
+    def prefix_sums(self, axis):
+        """axis上的前缀和数组[0, l1, l1+l2, ...]，O(n)"""
+        sums = [0]
+        total = 0
+        for pair in self:
+            total += len(pair[axis])
+            sums.append(total)
+        return sums
+
+    def span_length(self, span):
+        return self.prefix(span[1], 0) - self.prefix(span[0], 0), self.prefix(span[1], 1) - self.prefix(span[0], 1)
+
+    def _descend(self, value, axis, strict):
+        # 返回前缀和 <= value（strict时为 < value）的最大的i，不存在时返回-1
+        if value < 0 or (strict and value <= 0):
+            return -1
+        pos = 0
+        node = self._root
+        while node is not None:
+            length = _axis_len(node.left, axis) + len(node.pair[axis])
+            if length < value if strict else length <= value:
+                value -= length
+                pos += _size(node.left) + 1
+                node = node.right
+            else:
+                node = node.left
+        return pos
+
+    def align(self, l, r, axis):
+        """
+        把axis上的字符区间[l, r)扩展到pair的边界
+        Returns:
+            (aligned_span, pair_span)
+        """
+        start_pair = self._descend(l, axis, strict=False)
+        end_pair = self._descend(r, axis, strict=True) + 1
+        if not 0 <= start_pair < end_pair <= len(self):
+            raise IndexError(f"span ({l}, {r}) 超出范围，总长度为{self.total(axis)}")
+        return (self.prefix(start_pair, axis), self.prefix(end_pair, axis)), (start_pair, end_pair)
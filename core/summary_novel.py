@@ -1,3 +1,4 @@
+import time
 import numpy as np
 from core.draft_writer import DraftWriter
 from core.plot_writer import PlotWriter
@@ -70,6 +71,42 @@ def summary_plot(model, sub_model, chapter_title, chapter_plot):
 
     return pw
 
+def summary_chapter(model, sub_model, chapter_title, chapter_text):
+    """单章流水线：该章的剧情摘要完成后立即开始提炼章节大纲，不等待其他章节"""
+    stage_times = {}
+
+    draft_start = time.time()
+    progress = dict(chars_num=0, current_cost=0, currency_symbol='', model=None)
+    gen = summary_draft(model, sub_model, chapter_title, chapter_text)
+    try:
+        while True:
+            progress = next(gen)
+            yield dict(progress, stage='draft')
+    except StopIteration as e:
+        dw = e.value
+    draft_end = time.time()
+    # 绝对时间戳用于统计整个阶段的时间跨度（流水线中各章的阶段互相重叠）
+    stage_times.update(draft_start=draft_start, draft_end=draft_end, draft_time=draft_end - draft_start)
+
+    # 章节大纲阶段yield的数值需要加上剧情摘要阶段的累计值，这样每章最新的yield就是该章的总计
+    draft_chars_num, draft_cost = progress['chars_num'], progress['current_cost']
+
+    plot_start = time.time()
+    gen = summary_plot(model, sub_model, chapter_title, dw.x)
+    try:
+        while True:
+            progress = next(gen)
+            progress = dict(progress, chars_num=draft_chars_num + progress['chars_num'], current_cost=draft_cost + progress['current_cost'])
+            yield dict(progress, stage='plot')
+    except StopIteration as e:
+        cw = e.value
+    plot_end = time.time()
+    stage_times.update(plot_start=plot_start, plot_end=plot_end, plot_time=plot_end - plot_start)
+
+    yield dict(progress, stage='done')
+
+    return dw, cw, stage_times, progress
+
 def summary_chapters(model, sub_model, title, chapter_titles, chapter_content):
     ow = OutlineWriter([('', '')], {}, model=model, sub_model=sub_model, x_chunk_length=500, y_chunk_length=1000)
     ow.xy_pairs = ow.construct_xy_pairs(chapter_titles, chapter_content)
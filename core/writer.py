@@ -1,18 +1,25 @@
 import re
-import numpy as np
 import bisect
+import numpy as np
 from dataclasses import asdict, dataclass
 
-from llm_api import ModelConfig
+from config import WRITER_DEBUG_CHECKS, CHUNK_PLAN_MODE, WRITER_PAIR_STORAGE
+from llm_api import ModelConfig, StreamDeltaTracker
 from prompts.对齐剧情和正文 import prompt as match_plot_and_text
 from prompts.审阅.prompt import main as prompt_review
-from core.writer_utils import split_text_into_chunks, detect_max_edit_span, run_yield_func
-from core.writer_utils import KeyPointMsg
+from core.writer_utils import split_text_into_chunks, detect_max_edit_span, run_yield_func, concurrent_yield
+from core.writer_utils import KeyPointMsg, BatchYields, ChunkPlan
 from core.diff_utils import get_chunk_changes
+from core.pair_index import PairLengthIndex, PairIdIndex
+from core.pair_rope import PairRope
+
+
+class StaleChunkError(ValueError):
+    """chunk对应的pair已经被其他修改替换，需要重新获取chunk"""
 
 
 class Chunk(dict):
-    def __init__(self, chunk_pairs: tuple[tuple[str, str, str]], source_slice: tuple[int, int], text_slice: tuple[int, int]):
+    def __init__(self, chunk_pairs: tuple[tuple[str, str, str]], source_slice: tuple[int, int], text_slice: tuple[int, int], pair_ids=None, pair_id_space=None):
         super().__init__()
         self['chunk_pairs'] = tuple(chunk_pairs)
         
@@ -25,6 +32,10 @@ class Chunk(dict):
         assert text_slice[1] is None or text_slice[1] < 0, 'text_slice end must be None or negative'
         self['text_slice'] = text_slice
 
+        # chunk_pairs中每个pair在Writer中的id（修改过的pair为None），用于get_chunk_pair_span定位
+        self['pair_ids'] = tuple(pair_ids) if pair_ids is not None else None
+        self['pair_id_space'] = pair_id_space
+
     def edit(self, x_chunk=None, y_chunk=None, text_pairs=None):
         if x_chunk is not None:
             text_pairs = [(x_chunk, self.y_chunk), ]
@@ -36,7 +47,13 @@ class Chunk(dict):
         chunk_pairs = list(self['chunk_pairs'])
         chunk_pairs[self.text_slice] = list(text_pairs)
 
-        return Chunk(chunk_pairs=tuple(chunk_pairs), source_slice=self.source_slice, text_slice=self.text_slice)
+        pair_ids = self.pair_ids
+        if pair_ids is not None:
+            pair_ids = list(pair_ids)
+            pair_ids[self.text_slice] = [None] * len(text_pairs)
+
+        return Chunk(chunk_pairs=tuple(chunk_pairs), source_slice=self.source_slice, text_slice=self.text_slice,
+                     pair_ids=pair_ids, pair_id_space=self.pair_id_space)
     
     @property
     def source_slice(self) -> slice:
@@ -50,6 +67,18 @@ class Chunk(dict):
     def text_slice(self) -> slice:
         return slice(*self['text_slice'])
     
+    @property
+    def pair_ids(self) -> tuple[int]:
+        return self.get('pair_ids')
+
+    @property
+    def pair_id_space(self) -> str:
+        return self.get('pair_id_space')
+
+    @property
+    def text_pair_ids(self) -> tuple[int]:
+        return self.pair_ids[self.text_slice] if self.pair_ids is not None else None
+
     @property
     def text_source_slice(self) -> slice:
         source_start = self.source_slice.start + self.text_slice.start
@@ -109,22 +138,56 @@ class Writer:
         # y_chunk_length对pair大小的影响较少（因为映射是一对多）
 
         self.max_thread_num = max_thread_num    # 使得可以单独控制某个chunk变量的线程数，这在同时运行多个Writer变量时有用
+
+        self.chunk_plan_mode = CHUNK_PLAN_MODE  # get_chunks的划分方式：greedy / balanced
+        self.last_chunk_plan = None  # 最近一次get_chunks的结果，用于在执行前报告预计的调用次数和tokens
     
     @property
-    def x(self):    # TODO: 考虑x经常访问的情况
+    def xy_pairs(self):
+        # 修改pair需要通过apply_chunks或重新赋值，以保持长度索引同步
+        return self._xy_pairs
+
+    @xy_pairs.setter
+    def xy_pairs(self, xy_pairs):
+        if WRITER_PAIR_STORAGE == 'rope' and not isinstance(xy_pairs, PairRope):
+            xy_pairs = PairRope(xy_pairs)
+        self._xy_pairs = xy_pairs
+        # PairRope的节点中已经维护了长度，自身即可作为长度索引
+        self._pair_index = xy_pairs if isinstance(xy_pairs, PairRope) else PairLengthIndex(xy_pairs)
+        # 重新赋值后之前的chunk都按内容定位
+        self._pair_ids = PairIdIndex(len(xy_pairs))
+
+    def __setstate__(self, state):
+        # 兼容旧版本pickle的Writer（没有长度索引和chunk划分方式）
+        state = dict(state)
+        xy_pairs = state.pop('xy_pairs', None)
+        self.chunk_plan_mode = CHUNK_PLAN_MODE
+        self.last_chunk_plan = None
+        self.__dict__.update(state)
+        if xy_pairs is not None:
+            self.xy_pairs = xy_pairs
+        elif '_pair_ids' not in self.__dict__:
+            self._pair_ids = PairIdIndex(len(self._xy_pairs))
+
+    @property
+    def x(self):
+        if isinstance(self.xy_pairs, PairRope):
+            return self.xy_pairs.text(0)
         return ''.join(pair[0] for pair in self.xy_pairs)
 
     @property
     def y(self):
+        if isinstance(self.xy_pairs, PairRope):
+            return self.xy_pairs.text(1)
         return ''.join(pair[1] for pair in self.xy_pairs)
     
     @property
     def x_len(self):
-        return sum(len(pair[0]) for pair in self.xy_pairs)
+        return self._pair_index.total(0)
 
     @property
     def y_len(self):
-        return sum(len(pair[1]) for pair in self.xy_pairs)
+        return self._pair_index.total(1)
 
     def get_model(self):
         return self.model
@@ -133,8 +196,7 @@ class Writer:
         return self.sub_model
     
     def count_span_length(self, span):
-        pairs = self.xy_pairs[span[0]:span[1]]
-        return sum(len(pair[0]) for pair in pairs), sum(len(pair[1]) for pair in pairs)
+        return self._pair_index.span_length(span)
 
     def align_span(self, x_span=None, y_span=None):
         if x_span is None and y_span is None:
@@ -145,23 +207,18 @@ class Writer:
         
         is_x = x_span is not None
         z_span = x_span if is_x else y_span
-        cumsum_z = np.cumsum([0] + [len(pair[0 if is_x else 1]) for pair in self.xy_pairs]).tolist()
         
         l, r = z_span
-        start_chunk = bisect.bisect_right(cumsum_z, l) - 1
-        end_chunk = bisect.bisect_left(cumsum_z, r)
-        
-        aligned_l = cumsum_z[start_chunk]
-        aligned_r = cumsum_z[end_chunk]
-        
-        aligned_span = (aligned_l, aligned_r)
-        pair_span = (start_chunk, end_chunk)
+        aligned_span, pair_span = self._pair_index.align(l, r, 0 if is_x else 1)
+        (aligned_l, aligned_r), (start_chunk, end_chunk) = aligned_span, pair_span
         
         # Add assertions to verify the correctness of the output
         assert aligned_l <= l < aligned_r, "aligned_span does not properly contain the start of the input span"
         assert aligned_l < r <= aligned_r, "aligned_span does not properly contain the end of the input span"
         assert 0 <= start_chunk < end_chunk <= len(self.xy_pairs), "pair_span is out of bounds"
-        assert sum(len(pair[0 if is_x else 1]) for pair in self.xy_pairs[start_chunk:end_chunk]) == aligned_r - aligned_l, "aligned_span and pair_span do not match"
+        if WRITER_DEBUG_CHECKS:
+            # 需要重新扫描区间内的pair，只在调试时检查
+            assert sum(len(pair[0 if is_x else 1]) for pair in self.xy_pairs[start_chunk:end_chunk]) == aligned_r - aligned_l, "aligned_span and pair_span do not match"
 
         return aligned_span, pair_span
     
@@ -201,14 +258,33 @@ class Writer:
         return Chunk(
             chunk_pairs=chunk_pairs,
             source_slice=source_slice,
-            text_slice=text_slice
+            text_slice=text_slice,
+            pair_ids=self._pair_ids.ids[context_pair_span[0]:context_pair_span[1]],
+            pair_id_space=self._pair_ids.space
         )
     
     def get_chunk_pair_span(self, chunk: Chunk):
+        """
+        chunk的text_pairs在xy_pairs中的位置
+        - chunk由本Writer的get_chunk/get_chunks产生或经apply_chunks写入时，按pair id定位，不扫描xy_pairs
+        - 其他chunk（如从前端状态恢复的）按内容查找
+        Raises:
+            StaleChunkError: chunk对应的pair已经被替换
+        """
+        text_pair_ids = chunk.text_pair_ids
+        if chunk.pair_id_space == self._pair_ids.space and text_pair_ids and None not in text_pair_ids:
+            pair_start = self._pair_ids.position(text_pair_ids[0])
+            pair_end = pair_start + len(text_pair_ids) if pair_start is not None else None
+            if pair_start is None or tuple(self._pair_ids.ids[pair_start:pair_end]) != tuple(text_pair_ids):
+                raise StaleChunkError(f"chunk对应的pair已被修改，需要重新获取chunk（原位置: {chunk.text_source_slice.start}-{chunk.text_source_slice.stop}）")
+            if WRITER_DEBUG_CHECKS:
+                assert [tuple(p[:2]) for p in self.xy_pairs[pair_start:pair_end]] == [tuple(p[:2]) for p in chunk.text_pairs], "pair id与内容不一致"
+            return pair_start, pair_end
+
         pair_start, pair_end = chunk.text_source_slice.start, chunk.text_source_slice.stop
         merged_x_chunk = ''.join(p[0] for p in self.xy_pairs[pair_start:pair_end])
         merged_y_chunk = ''.join(p[1] for p in self.xy_pairs[pair_start:pair_end])
-        if merged_x_chunk == chunk.x_chunk and merged_y_chunk == chunk.y_chunk:
+        if pair_end <= len(self.xy_pairs) and merged_x_chunk == chunk.x_chunk and merged_y_chunk == chunk.y_chunk:
             return pair_start, pair_end
 
         pair_start, pair_end = 0, len(self.xy_pairs)
@@ -227,29 +303,55 @@ class Writer:
         # Verify the pair_span
         merged_x_chunk = ''.join(p[0] for p in self.xy_pairs[pair_start:pair_end])
         merged_y_chunk = ''.join(p[1] for p in self.xy_pairs[pair_start:pair_end])
-        assert x_chunk == merged_x_chunk and y_chunk == merged_y_chunk, "Chunk mismatch"
+        if x_chunk != merged_x_chunk or y_chunk != merged_y_chunk:
+            raise StaleChunkError("Chunk mismatch: 在xy_pairs中找不到chunk的内容，需要重新获取chunk")
 
         return (pair_start, pair_end)
     
     def apply_chunks(self, chunks: list[Chunk], new_chunks: list[Chunk]):
-        occupied_pair_span = [False] * len(self.xy_pairs)
+        """
+        用new_chunks的text_pairs替换chunks对应的pair
+        new_chunks会记录新pair的id，之后可以直接用get_chunk_pair_span(new_chunk)定位
+        """
         pair_span_list = [self.get_chunk_pair_span(e) for e in chunks]
-        for pair_span in pair_span_list:
-            assert not any(occupied_pair_span[pair_span[0]:pair_span[1]]), "Chunk overlap"
-            occupied_pair_span[pair_span[0]:pair_span[1]] = [True] * (pair_span[1] - pair_span[0])
-        # TODO: 这里可以验证occupied_pair_span是否全被占据
-        new_pairs_list = [e.text_pairs for e in new_chunks]
-
-        sorted_spans_with_new_pairs = sorted(
-            zip(pair_span_list, new_pairs_list),
+        sorted_pair_spans = sorted(pair_span_list)
+        for prev_span, pair_span in zip(sorted_pair_spans, sorted_pair_spans[1:]):
+            assert prev_span[1] <= pair_span[0], "Chunk overlap"
+        # TODO: 这里可以验证pair_span是否覆盖了全部pair
+
+        sorted_spans_with_new_chunks = sorted(
+            zip(pair_span_list, new_chunks),
             key=lambda x: x[0][0],
             reverse=True
         )
 
-        for (start, end), new_pairs in sorted_spans_with_new_pairs:
+        for (start, end), new_chunk in sorted_spans_with_new_chunks:
+            new_pairs = new_chunk.text_pairs
             self.xy_pairs[start:end] = new_pairs
-
-    def get_chunks(self, pair_span=None, chunk_length_ratio=1, context_length_ratio=1, offset_ratio=0):
+            if self._pair_index is not self.xy_pairs:
+                self._pair_index.splice(start, end, new_pairs)
+
+            new_ids = self._pair_ids.splice(start, end, len(new_pairs))
+            pair_ids = list(new_chunk.pair_ids or [None] * len(new_chunk.chunk_pairs))
+            pair_ids[new_chunk.text_slice] = new_ids
+            new_chunk['pair_ids'] = tuple(pair_ids)
+            new_chunk['pair_id_space'] = self._pair_ids.space
+
+        if WRITER_DEBUG_CHECKS:
+            for axis in (0, 1):
+                assert self._pair_index.prefix_sums(axis) == list(np.cumsum([0] + [len(pair[axis]) for pair in self.xy_pairs])), "pair长度索引与xy_pairs不一致"
+
+    def get_chunks(self, pair_span=None, chunk_length_ratio=1, context_length_ratio=1, offset_ratio=0, mode=None):
+        """
+        把pair_span划分为若干chunk，每个chunk对应一次LLM调用
+        Args:
+            mode: 划分方式，None时使用self.chunk_plan_mode
+                - greedy: 每次前进0.8倍chunk_length（八二原则，不求最优划分）
+                - balanced: 在pair边界上动态规划，chunk数最少，且各chunk长度尽量均匀，每个chunk不超过chunk_length
+        Returns:
+            ChunkPlan（chunk列表，带有预计的调用次数和输入tokens）
+        """
+        mode = mode or self.chunk_plan_mode
         pair_span = pair_span or (0, len(self.xy_pairs))
         chunk_length = self.x_chunk_length * chunk_length_ratio, self.y_chunk_length * chunk_length_ratio
         context_length = self.x_chunk_length//2 * context_length_ratio, self.y_chunk_length//2 * context_length_ratio
@@ -257,11 +359,45 @@ class Writer:
         if 0 < offset_ratio < 1:
             offset_ratio = int(chunk_length[0] * offset_ratio), int(chunk_length[1] * offset_ratio)
 
-        # Generate chunks
+        # 前缀和只计算一次，之后每个chunk的对齐都是在前缀和上二分，不再重新扫描pair
+        # greedy的结果与逐个调用get_chunk(x_span=...)/get_chunk(y_span=...)相同
+        prefix = self._pair_index.prefix_sums(0), self._pair_index.prefix_sums(1)
+
+        if mode == 'greedy':
+            plans = self._plan_greedy(prefix, pair_span, chunk_length, context_length, offset_ratio)
+        elif mode == 'balanced':
+            plans = self._plan_balanced(prefix, pair_span, chunk_length, context_length, offset_ratio)
+        else:
+            raise ValueError(f"未知的chunk划分方式: {mode}")
+
         chunks = []
+        for (context_start, context_end), (text_start, text_end) in plans:
+            chunks.append(Chunk(
+                chunk_pairs=self.xy_pairs[context_start:context_end],
+                source_slice=(context_start, context_end),
+                text_slice=(text_start - context_start, None if text_end == context_end else text_end - context_end),
+                pair_ids=self._pair_ids.ids[context_start:context_end],
+                pair_id_space=self._pair_ids.space
+            ))
+            # assert chunk.x_chunk_context_len <= self.x_chunk_length * 2 and chunk.y_chunk_context_len <= self.y_chunk_length * 2, \
+            #     "无法获取到一个足够短的区块，请调整区块长度或窗口长度！"
+
+        self.last_chunk_plan = ChunkPlan(chunks, mode=mode)
+        return self.last_chunk_plan
+
+    @staticmethod
+    def _plan_context(prefix, axis, span, context_length):
+        # 与get_chunk相同：先把span对齐到pair边界，再向两侧扩展context_length并对齐，返回(context_pair_span, pair_span)
+        p = prefix[axis]
+        start_pair, end_pair = bisect.bisect_right(p, span[0]) - 1, bisect.bisect_left(p, span[1])
+        context_span = max(0, p[start_pair] - context_length[axis]), min(p[-1], p[end_pair] + context_length[axis])
+        return (bisect.bisect_right(p, context_span[0]) - 1, bisect.bisect_left(p, context_span[1])), (start_pair, end_pair)
+
+    def _plan_greedy(self, prefix, pair_span, chunk_length, context_length, offset_ratio):
+        plans = []
         start = pair_span[0]
-        cstart = self.count_span_length((0, start))  # char_start
-        max_cend = self.count_span_length((0, pair_span[1]))  # char_end
+        cstart = prefix[0][start], prefix[1][start]  # char_start
+        max_cend = prefix[0][pair_span[1]], prefix[1][pair_span[1]]  # char_end
         while start < pair_span[1]:
             if offset_ratio != 0:
                 cend = cstart[0] + offset_ratio[0], cstart[1] + offset_ratio[1]
@@ -273,66 +409,119 @@ class Writer:
             # 选择非零长度的span来获取chunk
             x_len, y_len = cend[0] - cstart[0], cend[1] - cstart[1]
             if x_len > 0:
-                chunk1 = self.get_chunk(x_span=(cstart[0], cend[0]), context_length=context_length[0])
+                plan1 = self._plan_context(prefix, 0, (cstart[0], cend[0]), context_length)
             if y_len > 0:
-                chunk2 = self.get_chunk(y_span=(cstart[1], cend[1]), context_length=context_length[1])
+                plan2 = self._plan_context(prefix, 1, (cstart[1], cend[1]), context_length)
             
             if x_len > 0 and y_len == 0:
-                chunk = chunk1
+                plan = plan1
             elif x_len == 0 and y_len > 0:
-                chunk = chunk2
+                plan = plan2
             elif x_len > 0 and y_len > 0:
                 # 选其中source_slice更小的chunk
-                chunk = chunk1 if chunk1.source_slice.stop - chunk1.source_slice.start < chunk2.source_slice.stop - chunk2.source_slice.start else chunk2
+                plan = plan1 if plan1[0][1] - plan1[0][0] < plan2[0][1] - plan2[0][0] else plan2
             else:
                 raise ValueError("Both x_span and y_span have zero length")
-             
-            # assert chunk.x_chunk_context_len <= self.x_chunk_length * 2 and chunk.y_chunk_context_len <= self.y_chunk_length * 2, \
-            #     "无法获取到一个足够短的区块，请调整区块长度或窗口长度！"
 
-            chunks.append(chunk)
-            start = chunk.text_source_slice.stop
-            cstart = self.count_span_length((0, start))
-
-        return chunks
+            plans.append(plan)
+            start = plan[1][1]
+            cstart = prefix[0][start], prefix[1][start]
+        return plans
+
+    def _plan_balanced(self, prefix, pair_span, chunk_length, context_length, offset_ratio):
+        """
+        在pair边界上划分[pair_span[0], pair_span[1])，按(chunk数, 各chunk负载的平方和)最小化
+        负载为max(x长度 / x的chunk_length, y长度 / y的chunk_length)，单个pair超过chunk_length时单独成为一个chunk
+        offset_ratio不为0时，第一个chunk的长度以offset为上限
+        """
+        px, py = prefix
+        start, end = pair_span
+        if px[end] - px[start] == 0 and py[end] - py[start] == 0:
+            raise ValueError("Both x_span and y_span have zero length")
+
+        def load(i, j, limit):
+            return max((px[j] - px[i]) / max(limit[0], 1), (py[j] - py[i]) / max(limit[1], 1))
+
+        # best[j]为划分[start, j)的(chunk数, 负载平方和)，prev[j]为最后一个chunk的起点
+        best = {start: (0, 0.0)}
+        prev = {}
+        lo = start  # 以j结尾的可行chunk的最小起点，随j单调不减
+        for j in range(start + 1, end + 1):
+            while lo < j - 1 and load(lo, j, chunk_length) > 1:
+                lo += 1
+            for i in range(lo, j):
+                limit = offset_ratio if offset_ratio != 0 and i == start else chunk_length
+                if j - i > 1 and load(i, j, limit) > 1:
+                    continue
+                count, cost = best[i]
+                value = (count + 1, cost + load(i, j, chunk_length) ** 2)
+                if j not in best or value < best[j]:
+                    best[j], prev[j] = value, i
+
+        text_spans = []
+        j = end
+        while j != start:
+            text_spans.append((prev[j], j))
+            j = prev[j]
+        text_spans.reverse()
+
+        plans = []
+        for text_start, text_end in text_spans:
+            # 与greedy相同，在有文本的轴上扩展上下文，选择source_slice更小的一个
+            candidates = [
+                self._plan_context(prefix, axis, (prefix[axis][text_start], prefix[axis][text_end]), context_length)[0]
+                for axis in (0, 1) if prefix[axis][text_end] > prefix[axis][text_start]
+            ] or [(text_start, text_end)]
+            context_start, context_end = min(reversed(candidates), key=lambda e: e[1] - e[0])
+            plans.append(((min(context_start, text_start), max(context_end, text_end)), (text_start, text_end)))
+        return plans
 
     # TODO: batch_yield 可以考虑输入生成器，而不是函数及参数 
     def batch_yield(self, generators, chunks, prompt_name=None):
         # TODO: 后续考虑只输出new_chunks, 不必重复输出chunks
 
-        # Process all pairs with the prompt and yield intermediate results
-        results = [None] * len(generators)
-        yields = [None] * len(generators)
-        finished = [False] * len(generators)
-        first_iter_flag = True
-        while True:
-            co_num = 0
-            for i, gen in enumerate(generators):
-                if finished[i]:
-                    continue
-
-                try:
-                    co_num += 1
-                    yield_value = next(gen)
-                    yields[i] = (yield_value, chunks[i])    # TODO: yield 带上chunk是为了配合前端
-                except StopIteration as e:
-                    results[i] = e.value
-                    finished[i] = True
-                    if yields[i] is None: yields[i] = (None, chunks[i])
-                
-                if co_num >= self.max_thread_num:
-                        break
-            
-            if all(finished):
-                break
-
-            if first_iter_flag and prompt_name is not None:
+        # 每个生成器在独立的worker上运行（最多max_thread_num个同时运行），这里汇总各chunk的最新结果并yield
+        # 关键点消息在启动生成器之前yield，消费者此时可以读取last_chunk_plan，在第一次LLM调用前报告计划
+        emit_kp_msg = prompt_name is not None and len(generators) > 0
+        runner = concurrent_yield(generators, max_workers=self.max_thread_num)
+        # concurrent_yield只保留各生成器最新的值，中间的增量可能被合并，所以按chunk重新计算相对上次yield的增量
+        trackers = [StreamDeltaTracker(chunk_id=i) for i in range(len(generators))]
+        last_values = [None] * len(generators)
+        last_versions = [None] * len(generators)
+        try:
+            if emit_kp_msg:
                 yield (kp_msg := KeyPointMsg(prompt_name=prompt_name))
-                first_iter_flag = False
 
-            yield yields  # 如果是yield的值，那必定为tuple
+            while True:
+                yield_values, finished = next(runner)
+
+                yields = [None] * len(generators)
+                deltas = {}
+                for i, yield_value in enumerate(yield_values):
+                    if yield_value is not None or finished[i]:
+                        yields[i] = (yield_value, chunks[i])    # TODO: yield 带上chunk是为了配合前端
+
+                    if yield_value is last_values[i] and finished[i] == trackers[i].finished:
+                        continue
+                    last_values[i] = yield_value
+                    if isinstance(yield_value, dict) and isinstance(yield_value.get('text'), str):
+                        # 上游的增量版本号没变时，说明期间没有整体替换，文本只在末尾追加
+                        upstream = yield_value.get('delta')
+                        version = upstream.version if upstream is not None else None
+                        append_only = version is not None and version == last_versions[i]
+                        last_versions[i] = version
+                        response_msgs = yield_value.get('response_msgs')
+                        delta = trackers[i].update(yield_value['text'], finished=finished[i], usage=getattr(response_msgs, 'usage', None), append_only=append_only)
+                        if delta is not None:
+                            deltas[i] = delta
+
+                yield BatchYields(yields, deltas)  # 如果是yield的值，那必定为tuple
+        except StopIteration as e:
+            results = e.value
+        finally:
+            runner.close()
 
-        if not first_iter_flag and prompt_name is not None:
+        if emit_kp_msg:
             yield kp_msg.set_finished()
 
         return results
@@ -1,4 +1,9 @@
 import uuid
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from llm_api.chat_messages import count_characters, counts_to_tokens
 
 # 定义了用于Wirter yield的数据类型，同时也是前端展示的“关键点”消息
 class KeyPointMsg(dict):
@@ -53,6 +58,42 @@ class KeyPointMsg(dict):
         return prompt_name
 
 
+# Writer.batch_yield每次yield的各chunk最新结果，本身仍是原来的列表[(yield_value, chunk) or None, ...]，兼容只需要完整快照的消费者
+# deltas为本次有变化的chunk的增量 {chunk序号: StreamDelta}，消费者可以只处理新增的文本
+class BatchYields(list):
+    def __init__(self, yields, deltas=None):
+        super().__init__(yields)
+        self.deltas = deltas if deltas is not None else {}
+
+
+# Writer.get_chunks支持的划分方式
+CHUNK_PLAN_MODES = ('greedy', 'balanced')
+
+# Writer.get_chunks的划分结果，本身仍是chunk列表，每个chunk对应一次LLM调用
+# 执行前即可得到预计的调用次数和tokens（按chunk的文本估算，不含prompt模板）
+class ChunkPlan(list):
+    def __init__(self, chunks, mode='greedy'):
+        super().__init__(chunks)
+        self.mode = mode
+
+    @property
+    def calls(self):
+        return len(self)
+
+    @property
+    def input_tokens(self):
+        return sum(counts_to_tokens(count_characters(chunk.x_chunk_context + chunk.y_chunk_context)) for chunk in self)
+
+    @property
+    def text_tokens(self):
+        # 只统计chunk本身，不含上下文
+        return sum(counts_to_tokens(count_characters(chunk.x_chunk + chunk.y_chunk)) for chunk in self)
+
+    @property
+    def info(self):
+        return f"{self.mode}划分：{self.calls}次调用，预计输入约{self.input_tokens} tokens（上下文以外约{self.text_tokens} tokens）"
+
+
 import re
 from difflib import Differ
 
@@ -137,6 +178,73 @@ def run_yield_func(func, *args, **kwargs):
     except StopIteration as e:
         return e.value
 
+def concurrent_yield(generators, max_workers=5):
+    """
+    用有界线程池并发驱动多个生成器，每个生成器在一个worker上独立运行到结束，中间值汇入共享队列
+    Args:
+        generators: 生成器列表
+        max_workers: 同时运行的生成器数量上限
+    Yields:
+        (yields, finished): 各生成器最近一次yield的值（还未yield则为None），以及各生成器是否已结束，有新的yield值时才输出
+    Returns:
+        各生成器的返回值列表
+    """
+    n = len(generators)
+    yields = [None] * n
+    results = [None] * n
+    finished = [False] * n
+    if n == 0:
+        return results
+
+    events = queue.Queue()
+    stop_event = threading.Event()
+
+    def drive(i, gen):
+        # 生成器只能在驱动它的线程中关闭，所以由worker自己检查停止信号
+        try:
+            while not stop_event.is_set():
+                events.put((i, 'yield', next(gen)))
+            gen.close()
+        except StopIteration as e:
+            events.put((i, 'return', e.value))
+        except BaseException as e:
+            events.put((i, 'error', e))
+
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, n)))
+    try:
+        for i, gen in enumerate(generators):
+            executor.submit(drive, i, gen)
+
+        while not all(finished):
+            # 阻塞等待第一个事件，再取走队列中已有的全部事件，合并为一次yield
+            pending = [events.get()]
+            while True:
+                try:
+                    pending.append(events.get_nowait())
+                except queue.Empty:
+                    break
+
+            updated = False
+            for i, kind, value in pending:
+                if kind == 'yield':
+                    yields[i] = value
+                    updated = True
+                elif kind == 'return':
+                    results[i] = value
+                    finished[i] = True
+                else:
+                    raise value
+
+            # 只有新的yield值到达时才输出，保证每个生成器最后一次yield的值总能被调用方看到
+            if updated:
+                yield yields, finished
+    finally:
+        # 调用方提前退出或出错时，通知仍在运行的worker停止，并取消尚未开始的生成器
+        stop_event.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    return results
+
 def split_text_into_chunks(text, max_chunk_size, min_chunk_n, min_chunk_size=1, max_chunk_n=1000):
     def split_paragraph(para):
         mid = len(para) // 2
@@ -12,6 +12,7 @@ document.addEventListener('DOMContentLoaded', () => {
     let currentStreamId = null;
     let currentMode = 'outline';
     let isViewingPrompt = false;
+    const MAX_RESUME_COUNT = 3;  // /write断线后最多重新连接的次数
 
     function handleChunkSelection(e) {
         // 如果正在创作，则不允许选择
@@ -77,6 +78,29 @@ document.addEventListener('DOMContentLoaded', () => {
         actionBtn.textContent = isWriting ? '取消创作' : '开始创作';
     }
 
+    // 应用/write返回的增量操作（reset / append / replace / insert / delete），state.rows为[x, y, text]列表
+    function applyChunkOps(state, ops) {
+        for (const op of ops) {
+            if (op.op === 'reset') {
+                state.ids = op.ids;
+                state.rows = op.rows;
+                continue;
+            }
+            const index = state.ids.indexOf(op.id);
+            if (op.op === 'append') {
+                state.rows[index][op.field] += op.text;
+            } else if (op.op === 'replace') {
+                state.rows[index][op.field] = op.text;
+            } else if (op.op === 'insert') {
+                state.ids.splice(op.index, 0, op.id);
+                state.rows.splice(op.index, 0, op.row);
+            } else if (op.op === 'delete') {
+                state.ids.splice(index, 1);
+                state.rows.splice(index, 1);
+            }
+        }
+    }
+
     // 添加新的函数来处理端请求
     async function requestAIWriting(allChunks, span, callbacks) {
         try {
@@ -117,7 +141,7 @@ document.addEventListener('DOMContentLoaded', () => {
                 only_prompt: isViewingPrompt
             };
             
-            const response = await fetch(`${window._env_?.SERVER_URL}/write`, {
+            let response = await fetch(`${window._env_?.SERVER_URL}/write`, {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
@@ -125,23 +149,37 @@ document.addEventListener('DOMContentLoaded', () => {
                 body: JSON.stringify(requestData),
                 signal: currentController.signal
             });
+            // 参数错误（如未知的chunk划分方式）时后端返回400和错误信息
+            if (!response.ok) {
+                const error = await response.json().catch(() => ({}));
+                throw new Error(error.error || `HTTP ${response.status}`);
+            }
 
-            const reader = response.body.getReader();
+            let reader = response.body.getReader();
             const decoder = new TextDecoder();
             let buffer = '';
-            let prevChunks = null;
+            // 增量协议的状态（见backend/write_stream.py）：chunk的id和当前内容，以及最后收到的事件序号
+            const chunkState = { ids: [], rows: [] };
+            let lastEventId = null;
+            let streamFinished = false;
+            let resumeCount = 0;
 
             while (true) {
                 try {
                     const {value, done} = await reader.read();
-                    if (done) break;
+                    if (done) {
+                        if (streamFinished || !currentStreamId) break;
+                        throw new Error('连接在创作完成前断开');
+                    }
                     
                     buffer += decoder.decode(value, {stream: true});
                     const lines = buffer.split('\n');
                     
                     while (lines.length > 1) {
                         const line = lines.shift();
-                        if (line.startsWith('data: ')) {
+                        if (line.startsWith('id: ')) {
+                            lastEventId = line.slice(4).trim();
+                        } else if (line.startsWith('data: ')) {
                             try {
                                 const data = JSON.parse(line.slice(6));
                                 
@@ -167,14 +205,14 @@ document.addEventListener('DOMContentLoaded', () => {
                                     return;
                                 }
                                 
-                                // 处理delta更新
-                                if (data.chunk_type === 'delta' && prevChunks) {
-                                    const updatedChunks = data.chunk_list.map((chunk, i) => {
-                                        return chunk.map((str, j) => prevChunks[i][j] + str);
-                                    });
-                                    data.chunk_list = updatedChunks;
+                                // 按顺序应用增量操作，得到完整的chunk列表
+                                if (data.chunk_type === 'ops') {
+                                    applyChunkOps(chunkState, data.ops);
+                                    data.chunk_list = chunkState.rows;
+                                }
+                                if (data.done) {
+                                    streamFinished = true;
                                 }
-                                prevChunks = data.chunk_list;
                                 callbacks.onData(data);
                             } catch (e) {
                                 console.error('Error parsing SSE data:', e);
@@ -188,6 +226,20 @@ document.addEventListener('DOMContentLoaded', () => {
                         throw error;
                     }
                     console.error('Stream processing error:', error);
+                    // 断线后带上Last-Event-ID重新连接，只补发缺失的事件
+                    if (currentStreamId && !streamFinished && resumeCount < MAX_RESUME_COUNT) {
+                        resumeCount++;
+                        await new Promise(resolve => setTimeout(resolve, 1000 * resumeCount));
+                        response = await fetch(`${window._env_?.SERVER_URL}/write/${currentStreamId}`, {
+                            headers: lastEventId ? { 'Last-Event-ID': lastEventId } : {},
+                            signal: currentController.signal
+                        });
+                        if (response.ok) {
+                            reader = response.body.getReader();
+                            buffer = '';
+                            continue;
+                        }
+                    }
                     throw error;
                 }
             }
@@ -281,8 +333,11 @@ document.addEventListener('DOMContentLoaded', () => {
             if (span[0] < 0 || span[1] < 0) throw new Error('span不合法');
             await requestAIWriting(chunksData, span, {
                 onData: (data) => {
-                    updateChunksContent(data.chunk_list, selectedChunks, data.done);
-                    selectedChunks.forEach(chunk => chunk.classList.add('selected'));
+                    // 只有状态（如计划的调用次数）的帧不改变chunk列表
+                    if (data.chunk_list) {
+                        updateChunksContent(data.chunk_list, selectedChunks, data.done);
+                        selectedChunks.forEach(chunk => chunk.classList.add('selected'));
+                    }
                     
                     // 更新cost display
                     if (data.msg) {
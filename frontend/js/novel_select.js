@@ -232,6 +232,10 @@ async function handleFileSelect(event) {
                 }),
                 signal: currentFetchController.signal
             });
+            if (!response.ok) {
+                const error = await response.json().catch(() => ({}));
+                throw new Error(error.error || `HTTP ${response.status}`);
+            }
 
             const reader = response.body.getReader();
             const decoder = new TextDecoder();
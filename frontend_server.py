@@ -7,9 +7,7 @@ Frontend development server with API proxy support
 import os
 import sys
 import http.server
-import socketserver
-import urllib.request
-import urllib.parse
+import http.client
 import webbrowser
 import threading
 import time
@@ -20,6 +18,64 @@ from pathlib import Path
 FRONTEND_PORT = int(os.environ.get('FRONTEND_PORT', 8099))
 BACKEND_PORT = int(os.environ.get('BACKEND_PORT', 7869))
 BACKEND_HOST = os.environ.get('BACKEND_HOST', '127.0.0.1').strip()
+BACKEND_POOL_SIZE = int(os.environ.get('BACKEND_POOL_SIZE', 8))  # 与后端保持的空闲长连接数
+BACKEND_TIMEOUT = 300  # 针对LM Studio本地模型延长到5分钟
+PROXY_READ_SIZE = 64 * 1024
+
+# hop-by-hop头只对单个连接有效，不转发
+HOP_BY_HOP_HEADERS = {'connection', 'keep-alive', 'proxy-connection', 'te', 'trailer', 'transfer-encoding', 'upgrade'}
+# 连接断开后可以安全重发的请求方法
+IDEMPOTENT_METHODS = {'GET', 'HEAD'}
+
+
+class BackendConnectionPool:
+    """
+    到后端的HTTP/1.1长连接池，响应完整读完的连接放回池中复用，避免每个请求重新建立TCP连接
+    """
+    def __init__(self, host, port, max_idle=BACKEND_POOL_SIZE, timeout=BACKEND_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def get(self):
+        """返回(连接, 是否为复用的连接)"""
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(), True
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout), False
+
+    def put(self, conn):
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def request(self, method, path, body, headers):
+        """
+        发送请求并返回(连接, 响应)
+        复用的连接可能已被后端关闭，此时用新连接重试一次。只有请求没有发送出去，或者请求是幂等的（GET/HEAD）时才重试：
+        读取响应时断开的POST可能已经被后端处理（如已开始一次/write生成），重发会重复执行
+        """
+        conn, reused = self.get()
+        sent = False
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            sent = True
+            return conn, conn.getresponse()
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            conn.close()
+            if not reused or (sent and method not in IDEMPOTENT_METHODS):
+                raise
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        conn.request(method, path, body=body, headers=headers)
+        return conn, conn.getresponse()
+
+
+backend_pool = BackendConnectionPool(BACKEND_HOST, BACKEND_PORT)
 
 class APIProxyHandler(http.server.SimpleHTTPRequestHandler):
     """支持API代理的HTTP请求处理器"""
@@ -48,57 +104,72 @@ class APIProxyHandler(http.server.SimpleHTTPRequestHandler):
             super().do_OPTIONS()
     
     def proxy_to_backend(self):
-        """代理请求到后端服务"""
-        # 构建后端URL（移除/api前缀）
+        """
+        代理请求到后端服务
+        响应体边收边转发（SSE的每个事件到达后立即发给浏览器），不在内存中缓冲整个响应；
+        Content-Encoding等响应头原样转发，后端压缩的流不在这里解压
+        """
+        # 构建后端路径（移除/api前缀）
         backend_path = self.path[4:] if self.path.startswith('/api/') else self.path
-        backend_url = f"http://{BACKEND_HOST}:{BACKEND_PORT}{backend_path}"
         
+        conn = None
         try:
             # 读取请求体
             content_length = int(self.headers.get('Content-Length', 0))
             post_data = self.rfile.read(content_length) if content_length > 0 else None
             
-            # 创建请求
-            req = urllib.request.Request(backend_url, data=post_data, method=self.command)
-            
             # 复制请求头（排除一些不需要的头）
-            skip_headers = {'host', 'content-length', 'connection'}
-            for key, value in self.headers.items():
-                if key.lower() not in skip_headers:
-                    req.add_header(key, value)
+            skip_headers = {'host', 'content-length'} | HOP_BY_HOP_HEADERS
+            headers = {key: value for key, value in self.headers.items() if key.lower() not in skip_headers}
+            
+            conn, response = backend_pool.request(self.command, backend_path, post_data, headers)
+        except Exception as e:
+            if conn is not None:
+                conn.close()
+            print(f"代理请求失败: {e}")
+            self.send_error(502, f"Bad Gateway: {e}")
+            return
+        
+        try:
+            # 设置响应状态码
+            self.send_response(response.status)
+            
+            # 复制响应头
+            skip_response_headers = {'server', 'date'} | HOP_BY_HOP_HEADERS
+            for key, value in response.getheaders():
+                if key.lower() not in skip_response_headers:
+                    self.send_header(key, value)
             
-            # 发送请求 - 针对LM Studio本地模型延长到5分钟
-            with urllib.request.urlopen(req, timeout=300) as response:
-                # 设置响应状态码
-                self.send_response(response.getcode())
-                
-                # 复制响应头
-                skip_response_headers = {'server', 'date', 'transfer-encoding'}
-                for key, value in response.headers.items():
-                    if key.lower() not in skip_response_headers:
-                        self.send_header(key, value)
-                
-                # 添加CORS头
-                self.send_header('Access-Control-Allow-Origin', '*')
-                self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-                self.send_header('Access-Control-Allow-Headers', 'Content-Type, Authorization')
-                
-                self.end_headers()
-                
-                # 发送响应体
-                self.wfile.write(response.read())
-                
-        except urllib.error.HTTPError as e:
-            # HTTP错误
-            self.send_response(e.code)
+            # 添加CORS头
             self.send_header('Access-Control-Allow-Origin', '*')
+            self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
+            self.send_header('Access-Control-Allow-Headers', 'Content-Type, Authorization')
+            
             self.end_headers()
-            self.wfile.write(e.read())
             
+            # 转发响应体：read1返回当前已到达的数据，不等待凑满
+            while True:
+                data = response.read1(PROXY_READ_SIZE)
+                if not data:
+                    break
+                self.wfile.write(data)
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # 浏览器断开连接，关闭到后端的连接，后端据此停止推送
+            print(f"客户端已断开: {self.path}")
+            conn.close()
+            return
         except Exception as e:
-            # 其他错误
-            print(f"代理请求失败: {e}")
-            self.send_error(502, f"Bad Gateway: {e}")
+            print(f"代理响应失败: {e}")
+            conn.close()
+            return
+        
+        # 响应已读完，连接可以发送下一个请求
+        response.close()
+        if response.will_close:
+            conn.close()
+        else:
+            backend_pool.put(conn)
     
     def log_message(self, format, *args):
         """自定义日志格式"""
@@ -189,7 +260,8 @@ def main():
     open_browser(frontend_url)
     
     try:
-        with socketserver.TCPServer(("0.0.0.0", FRONTEND_PORT), APIProxyHandler) as httpd:
+        # 每个连接一个线程，多个用户的SSE流互不阻塞
+        with http.server.ThreadingHTTPServer(("0.0.0.0", FRONTEND_PORT), APIProxyHandler) as httpd:
             print(f"✅ 前端服务器已启动在端口 {FRONTEND_PORT}")
             httpd.serve_forever()
     except KeyboardInterrupt:
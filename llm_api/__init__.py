@@ -6,6 +6,13 @@ from .doubao_api import stream_chat_with_doubao, doubao_model_config
 from .chat_messages import ChatMessages
 from .openai_api import stream_chat_with_gpt, gpt_model_config
 from .zhipuai_api import stream_chat_with_zhipuai, zhipuai_model_config
+from .client_pool import get_client_pool_stats
+from .scheduler import request_scheduler, get_scheduler_stats
+from .cache_backend import get_cache_stats
+from .single_flight import single_flight, get_single_flight_stats
+from .mongodb_cost import get_cost_ledger_stats
+from .write_behind import get_write_behind_stats
+from .stream_delta import StreamDelta, StreamDeltaTracker
 
 class ModelConfig(dict):
     def __init__(self, model: str, **options):
@@ -52,6 +59,58 @@ class ModelConfig(dict):
     def get_api_keys(self) -> Dict[str, str]:
         return {k: v for k, v in self.items() if k not in ['model']}
 
+def prepare_chat(model_config: ModelConfig, messages: list):
+    """校验模型配置、注入系统提示词并检查token上限，stream_chat使用"""
+    if isinstance(model_config, dict):
+        model_config = ModelConfig(**model_config)
+    
+    model_config.validate()
+    print(f"✅ Model config validated successfully")
+
+    # Inject system prompt if provided
+    if model_config.get('system_prompt') and model_config['system_prompt'].strip():
+        # Add system prompt as the first message if not already present
+        if not messages or messages[0].get('role') != 'system':
+            system_message = {'role': 'system', 'content': model_config['system_prompt']}
+            messages = [system_message] + list(messages)
+            print(f"✅ System prompt injected: {model_config['system_prompt'][:100]}...")
+        else:
+            # If first message is already a system message, prepend our system prompt
+            existing_system = messages[0]['content']
+            combined_system = f"{model_config['system_prompt']}\n\n{existing_system}"
+            messages[0]['content'] = combined_system
+            print(f"✅ System prompt prepended to existing system message")
+
+    messages = ChatMessages(messages, model=model_config['model'])
+    print(f"✅ Chat messages processed, token count: {messages.count_message_tokens()}")
+
+    assert model_config['max_tokens'] <= 8192, 'max_tokens最大为8192！'
+
+    if messages.count_message_tokens() > model_config['max_tokens']:
+        error_msg = f'请求的文本过长，超过最大tokens:{model_config["max_tokens"]}。'
+        print(f"❌ Token limit exceeded: {error_msg}")
+        raise Exception(error_msg)
+    
+    return model_config, messages
+
+def get_schedule_target(model_config: ModelConfig):
+    """返回调度器使用的(提供商名称, api_key)"""
+    model_name = model_config['model']
+    if model_name in wenxin_model_config:
+        return 'wenxin', model_config['ak']
+    elif model_name in doubao_model_config:
+        return 'doubao', model_config['api_key']
+    elif model_name in zhipuai_model_config:
+        return 'zhipuai', model_config['api_key']
+    return request_scheduler.get_provider_name('openai', model_config.get('base_url')), model_config['api_key']
+
+def record_queue_wait(messages: ChatMessages, ticket):
+    """记录排队时间到messages上，与费用一同统计"""
+    messages.queue_wait = ticket.queue_wait
+    if ticket.queue_wait >= 0.1:
+        print(f"⏳ {ticket.provider} 请求排队等待 {ticket.queue_wait:.2f}s")
+
+@single_flight()
 @llm_api_cache()
 def stream_chat(model_config: ModelConfig, messages: list, response_json=False) -> Generator:
     import json
@@ -61,39 +120,17 @@ def stream_chat(model_config: ModelConfig, messages: list, response_json=False)
     print(f"Messages Count: {len(messages)}")
     print(f"Response JSON: {response_json}")
     
+    ticket = None
     try:
-        if isinstance(model_config, dict):
-            model_config = ModelConfig(**model_config)
-        
-        model_config.validate()
-        print(f"✅ Model config validated successfully")
-
-        # Inject system prompt if provided
-        if model_config.get('system_prompt') and model_config['system_prompt'].strip():
-            # Add system prompt as the first message if not already present
-            if not messages or messages[0].get('role') != 'system':
-                system_message = {'role': 'system', 'content': model_config['system_prompt']}
-                messages = [system_message] + list(messages)
-                print(f"✅ System prompt injected: {model_config['system_prompt'][:100]}...")
-            else:
-                # If first message is already a system message, prepend our system prompt
-                existing_system = messages[0]['content']
-                combined_system = f"{model_config['system_prompt']}\n\n{existing_system}"
-                messages[0]['content'] = combined_system
-                print(f"✅ System prompt prepended to existing system message")
-
-        messages = ChatMessages(messages, model=model_config['model'])
-        print(f"✅ Chat messages processed, token count: {messages.count_message_tokens()}")
-
-        assert model_config['max_tokens'] <= 8192, 'max_tokens最大为8192！'
-
-        if messages.count_message_tokens() > model_config['max_tokens']:
-            error_msg = f'请求的文本过长，超过最大tokens:{model_config["max_tokens"]}。'
-            print(f"❌ Token limit exceeded: {error_msg}")
-            raise Exception(error_msg)
+        model_config, messages = prepare_chat(model_config, messages)
         
         yield messages
         
+        # 经过全局调度器排队，满足提供商的并发和速率限制后再发出请求
+        provider, api_key = get_schedule_target(model_config)
+        ticket = request_scheduler.acquire(provider, api_key, messages.count_message_tokens())
+        record_queue_wait(messages, ticket)
+        
         model_name = model_config['model']
         print(f"🎯 Routing to appropriate API provider for model: {model_name}")
         
@@ -156,6 +193,8 @@ def stream_chat(model_config: ModelConfig, messages: list, response_json=False)
         traceback.print_exc()
         raise
     finally:
+        if ticket is not None:
+            ticket.release(messages.total_tokens)
         print(f"=== LLM API Stream Chat Finished ===\n")
 
 def test_stream_chat(model_config: ModelConfig):
@@ -196,4 +235,4 @@ def test_stream_chat(model_config: ModelConfig):
         print(f"=== Model Test Finished ===\n")
 
 # 导出必要的函数和配置
-__all__ = ['ChatMessages', 'stream_chat', 'wenxin_model_config', 'doubao_model_config', 'gpt_model_config', 'zhipuai_model_config', 'ModelConfig']
+__all__ = ['ChatMessages', 'stream_chat', 'StreamDelta', 'StreamDeltaTracker', 'wenxin_model_config', 'doubao_model_config', 'gpt_model_config', 'zhipuai_model_config', 'ModelConfig', 'get_client_pool_stats', 'get_scheduler_stats', 'get_cache_stats', 'get_single_flight_stats', 'get_cost_ledger_stats', 'get_write_behind_stats']
@@ -1,5 +1,6 @@
 import qianfan
 from .chat_messages import ChatMessages
+from .client_pool import client_pool
 
 # ak和sk获取：https://console.bce.baidu.com/qianfan/ais/console/applicationConsole/application
 
@@ -41,10 +42,12 @@ def stream_chat_with_wenxin(messages, model='ERNIE-Bot', response_json=False, ak
         print(f"❌ API Key Error: {error_msg}")
         raise Exception(error_msg)
 
+    # qianfan.ChatCompletion内部缓存了access token和会话，相同ak/sk的请求复用同一个实例
+    lease = client_pool.acquire('wenxin', lambda: qianfan.ChatCompletion(ak=ak, sk=sk), api_key=f"{ak}:{sk}")
+
     try:
-        print(f"✅ Creating Wenxin client...")
-        client = qianfan.ChatCompletion(ak=ak, sk=sk)
-        print(f"✅ Wenxin client created successfully")
+        client = lease.client
+        print(f"✅ Wenxin client acquired from pool")
         
         # 构建请求参数
         system_msg = messages[0]['content'] if messages[0]['role'] == 'system' else None
@@ -74,7 +77,9 @@ def stream_chat_with_wenxin(messages, model='ERNIE-Bot', response_json=False, ak
         print(f"✅ API request initiated successfully in {time.time() - start_time:.2f}s, starting to stream response")
         
         messages.append({'role': 'assistant', 'content': ''})
-        content = ''
+        # 增量过滤思考过程（处理 <think> </think> 等标签）
+        from prompts.prompt_utils import ThinkingProcessFilter
+        thinking_filter = ThinkingProcessFilter()
         chunk_count = 0
         first_chunk_time = None
         
@@ -87,15 +92,16 @@ def stream_chat_with_wenxin(messages, model='ERNIE-Bot', response_json=False, ak
             if chunk_count <= 3:  # Log first few chunks for debugging
                 print(f"📦 Chunk #{chunk_count}: {str(part)[:200]}...")
             
-            content += part['body']['result'] or ''
-            
-            # 对内容进行思考过程过滤（处理 <think> </think> 等标签）
-            from prompts.prompt_utils import filter_thinking_process
-            filtered_content = filter_thinking_process(content)
+            thinking_filter.feed(part['body']['result'] or '')
+            # 千帆每个chunk的usage为截至当前的用量，以最后一个为准
+            messages.update_usage(part['body'].get('usage'))
             
-            messages[-1]['content'] = filtered_content
+            messages[-1]['content'] = thinking_filter.text
             yield messages
         
+        thinking_filter.finish()
+        messages[-1]['content'] = thinking_filter.text
+        
         total_time = time.time() - start_time
         print(f"✅ Wenxin API call completed successfully in {total_time:.2f}s, received {chunk_count} chunks")
         return messages
@@ -109,6 +115,7 @@ def stream_chat_with_wenxin(messages, model='ERNIE-Bot', response_json=False, ak
         raise Exception(f"Wenxin API调用失败 - {type(e).__name__}: {str(e)}")
         
     finally:
+        lease.release()
         print(f"=== Wenxin API Call Finished ===\n")
 
     
@@ -0,0 +1,216 @@
+import os
+import time
+import json
+import sqlite3
+import datetime
+import threading
+
+from config import LLM_CACHE_BACKEND, LLM_CACHE_SQLITE_PATH, LLM_CACHE_MAX_BYTES, LLM_CACHE_TTL, MONOGODB_DB_NAME, ENABLE_MONOGODB_CACHE
+
+from .write_behind import insert_document
+
+
+class CacheBackend:
+    """
+    LLM响应缓存后端接口，缓存条目为dict，至少包含return_value（消息列表）和yields（回放用的流式记录）
+    """
+    name = 'none'
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._counter_lock = threading.Lock()
+
+    def lookup(self, cache_key):
+        """get并统计命中次数"""
+        entry = self.get(cache_key)
+        with self._counter_lock:
+            if entry:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return entry
+
+    def get(self, cache_key):
+        """返回缓存条目，未命中返回None"""
+        raise NotImplementedError
+
+    def put(self, cache_key, entry):
+        raise NotImplementedError
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'backend': self.name,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0,
+        }
+
+    def close(self):
+        pass
+
+
+class MongoCacheBackend(CacheBackend):
+    """基于MongoDB的缓存，同一个key可以有多条记录，读取时随机返回一条"""
+    name = 'mongodb'
+
+    def __init__(self, client, db_name=MONOGODB_DB_NAME, collection_name='stream_chat', read_enabled=True):
+        super().__init__()
+        self.collection_name = collection_name
+        self.collection = client[db_name][collection_name]
+        self.collection.create_index('cache_key')
+        self.read_enabled = read_enabled
+
+    def get(self, cache_key):
+        if not self.read_enabled:
+            return None
+        cached_data = list(self.collection.aggregate([
+            {'$match': {'cache_key': cache_key}},
+            {'$sample': {'size': 1}}
+        ]))
+        return cached_data[0] if cached_data else None
+
+    def put(self, cache_key, entry):
+        insert_document(self.collection_name, {'created_at': datetime.datetime.now(), **entry, 'cache_key': cache_key})
+
+
+class SQLiteCacheBackend(CacheBackend):
+    """
+    基于SQLite的本地磁盘缓存，不依赖MongoDB
+    - 总大小超过max_bytes时按最近访问时间淘汰（LRU）
+    - 超过ttl秒的条目视为过期，ttl为0表示不过期
+    - 使用WAL模式，读取不会被写入阻塞，每个线程使用独立的连接，可以在多线程/多进程间共享同一个文件
+    只保存回放需要的return_value、yields和usage，不保存包含api_key的调用参数
+    """
+    name = 'sqlite'
+
+    def __init__(self, path=LLM_CACHE_SQLITE_PATH, max_bytes=LLM_CACHE_MAX_BYTES, ttl=LLM_CACHE_TTL):
+        super().__init__()
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._evictions = 0
+        self._expirations = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._get_conn()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                cache_key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_llm_cache_accessed_at ON llm_cache (accessed_at)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_llm_cache_created_at ON llm_cache (created_at)')
+        conn.commit()
+
+    def _get_conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _is_expired(self, created_at, now):
+        return self.ttl and now - created_at > self.ttl
+
+    def get(self, cache_key):
+        conn = self._get_conn()
+        row = conn.execute('SELECT value, created_at FROM llm_cache WHERE cache_key = ?', (cache_key,)).fetchone()
+        if row is None:
+            return None
+
+        now = time.time()
+        if self._is_expired(row[1], now):
+            with conn:
+                conn.execute('DELETE FROM llm_cache WHERE cache_key = ?', (cache_key,))
+            self._expirations += 1
+            return None
+
+        with conn:
+            conn.execute('UPDATE llm_cache SET accessed_at = ? WHERE cache_key = ?', (now, cache_key))
+        return json.loads(row[0])
+
+    def put(self, cache_key, entry):
+        value = json.dumps({'return_value': entry['return_value'], 'yields': entry['yields'], 'usage': entry.get('usage')}, ensure_ascii=False)
+        size = len(value.encode('utf-8'))
+        if self.max_bytes and size > self.max_bytes:
+            print(f"⚠️ 缓存条目大小({size}字节)超过缓存上限，跳过写入")
+            return
+
+        now = time.time()
+        conn = self._get_conn()
+        with self._lock, conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO llm_cache (cache_key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)',
+                (cache_key, value, size, now, now)
+            )
+            self._evict(conn, now)
+
+    def _evict(self, conn, now):
+        if self.ttl:
+            self._expirations += conn.execute('DELETE FROM llm_cache WHERE created_at < ?', (now - self.ttl,)).rowcount
+
+        if not self.max_bytes:
+            return
+        total_bytes = conn.execute('SELECT COALESCE(SUM(size), 0) FROM llm_cache').fetchone()[0]
+        if total_bytes <= self.max_bytes:
+            return
+
+        # 按最近访问时间从旧到新删除，直到总大小回到上限以内
+        evict_keys = []
+        for cache_key, size in conn.execute('SELECT cache_key, size FROM llm_cache ORDER BY accessed_at'):
+            if total_bytes <= self.max_bytes:
+                break
+            evict_keys.append((cache_key,))
+            total_bytes -= size
+        conn.executemany('DELETE FROM llm_cache WHERE cache_key = ?', evict_keys)
+        self._evictions += len(evict_keys)
+
+    def stats(self):
+        entries, total_bytes = self._get_conn().execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache').fetchone()
+        return {
+            **super().stats(),
+            'path': self.path,
+            'entries': entries,
+            'bytes': total_bytes,
+            'max_bytes': self.max_bytes,
+            'ttl': self.ttl,
+            'evictions': self._evictions,
+            'expirations': self._expirations,
+        }
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def create_cache_backend(backend=LLM_CACHE_BACKEND):
+    """根据config.LLM_CACHE_BACKEND创建缓存后端，'none'返回None"""
+    if backend == 'mongodb':
+        from .mongodb_init import mongo_client
+        if mongo_client is None:
+            raise ValueError("LLM_CACHE_BACKEND为mongodb时需要设置ENABLE_MONGODB=true")
+        return MongoCacheBackend(mongo_client, read_enabled=ENABLE_MONOGODB_CACHE)
+    elif backend == 'sqlite':
+        return SQLiteCacheBackend()
+    elif backend == 'none':
+        return None
+    raise ValueError(f"不支持的缓存后端: {backend}，可选值为 mongodb / sqlite / none")
+
+
+cache_backend = create_cache_backend()
+
+
+def get_cache_stats():
+    return cache_backend.stats() if cache_backend is not None else {'backend': 'none'}
@@ -3,21 +3,26 @@ import re
 import json
 import os
 
-def count_characters(text):
-    chinese_pattern = re.compile(r'[\u4e00-\u9fff]+')
-    english_pattern = re.compile(r'[a-zA-Z]+')
-    other_pattern = re.compile(r'[^\u4e00-\u9fffa-zA-Z]+')
+chinese_pattern = re.compile(r'[\u4e00-\u9fff]+')
+english_pattern = re.compile(r'[a-zA-Z]+')
 
+def count_characters(text):
     chinese_characters = chinese_pattern.findall(text)
     english_characters = english_pattern.findall(text)
-    other_characters = other_pattern.findall(text)
 
     chinese_count = sum(len(char) for char in chinese_characters)
     english_count = sum(len(char) for char in english_characters)
-    other_count = sum(len(char) for char in other_characters)
+    other_count = len(text) - chinese_count - english_count  # 其余字符
 
     return chinese_count, english_count, other_count
 
+def add_counts(a, b):
+    return a[0] + b[0], a[1] + b[1], a[2] + b[2]
+
+def counts_to_tokens(counts):
+    chinese_count, english_count, other_count = counts
+    return chinese_count // 2 + english_count // 5 + other_count // 2
+
 
 model_config = {}
 
@@ -35,6 +40,13 @@ class ChatMessages(list):
         super().__init__(*args)
         self.model = kwargs['model'] if 'model' in kwargs else None
         self.finished = False
+        # 每个消息位置各字段的字符统计缓存 {位置: {key: (value, counts)}}，切片和拼接得到的对象共享同一个缓存
+        # 按位置而不是消息对象缓存：缓存回放、流式输出每帧都会新建最后一条消息的dict，同一位置的内容只是在末尾追加
+        self._counts_cache = kwargs['_counts_cache'] if '_counts_cache' in kwargs else {}
+        self._slot_offset = kwargs['_slot_offset'] if '_slot_offset' in kwargs else 0 # 切片在原消息列表中的起始位置
+        # 提供商返回的实际用量 {'prompt_tokens', 'completion_tokens', 'cached_tokens'}，没有时使用估算值
+        self.usage = None
+        self.queue_wait = 0 # 在调度器中排队等待的秒数
         
         assert 'currency_symbol' not in kwargs
 
@@ -48,26 +60,95 @@ class ChatMessages(list):
     def __getitem__(self, index):
         result = super().__getitem__(index)
         if isinstance(index, slice):
-            return ChatMessages(result, model=self.model)
+            start, _, step = index.indices(len(self))
+            if step != 1:
+                return ChatMessages(result, model=self.model)
+            return ChatMessages(result, model=self.model, _counts_cache=self._counts_cache, _slot_offset=self._slot_offset + start)
         return result
     
     def __add__(self, other):
         if isinstance(other, list):
-            return ChatMessages(super().__add__(other), model=self.model)
+            return ChatMessages(super().__add__(other), model=self.model, _counts_cache=self._counts_cache, _slot_offset=self._slot_offset)
         return NotImplemented 
 
     def count_message_tokens(self):
         return self.get_estimated_tokens()
     
     def copy(self):
-        return ChatMessages(self, model=self.model)
+        messages = ChatMessages(self, model=self.model, _counts_cache=self._counts_cache, _slot_offset=self._slot_offset)
+        messages.usage = self.usage
+        return messages
+    
+    def set_usage(self, prompt_tokens, completion_tokens, cached_tokens=0):
+        self.usage = {
+            'prompt_tokens': int(prompt_tokens or 0),
+            'completion_tokens': int(completion_tokens or 0),
+            'cached_tokens': int(cached_tokens or 0),
+        }
     
+    def update_usage(self, usage):
+        """
+        从提供商返回的usage（对象或dict）中读取用量，usage为空时保持不变
+        兼容OpenAI的prompt_tokens_details.cached_tokens和DeepSeek的prompt_cache_hit_tokens
+        """
+        if not usage:
+            return
+        get = usage.get if isinstance(usage, dict) else lambda name: getattr(usage, name, None)
+        details = get('prompt_tokens_details')
+        if isinstance(details, dict):
+            cached_tokens = details.get('cached_tokens')
+        else:
+            cached_tokens = getattr(details, 'cached_tokens', None)
+        if not cached_tokens:
+            cached_tokens = get('prompt_cache_hit_tokens')
+        self.set_usage(get('prompt_tokens'), get('completion_tokens'), cached_tokens)
+    
+    @property
+    def input_tokens(self):
+        if self.usage:
+            return self.usage['prompt_tokens']
+        return self[:-1].count_message_tokens()
+    
+    @property
+    def output_tokens(self):
+        if self.usage:
+            return self.usage['completion_tokens']
+        return self[-1:].count_message_tokens()
+    
+    @property
+    def cached_tokens(self):
+        return self.usage['cached_tokens'] if self.usage else 0
+    
+    @property
+    def total_tokens(self):
+        return self.input_tokens + self.output_tokens
+    
+    def _get_value_counts(self, slot, key, value):
+        """
+        返回某个位置的消息某个字段的字符统计：内容未变时直接使用缓存，
+        内容是在原有内容后追加（流式输出）时只统计新增的部分
+        """
+        value_cache = self._counts_cache.setdefault(self._slot_offset + slot, {})
+
+        cached = value_cache.get(key)
+        if cached is not None:
+            old_value, old_counts = cached
+            if value is old_value:
+                return old_counts
+            if len(value) > len(old_value) and value.startswith(old_value):
+                counts = add_counts(old_counts, count_characters(value[len(old_value):]))
+                value_cache[key] = (value, counts)
+                return counts
+
+        counts = count_characters(value)
+        value_cache[key] = (value, counts)
+        return counts
+
     def get_estimated_tokens(self):
         num_tokens = 0
-        for message in self:
+        for slot, message in enumerate(self):
             for key, value in message.items():
-                chinese_count, english_count, other_count = count_characters(value)
-                num_tokens += chinese_count // 2 + english_count // 5 + other_count // 2
+                num_tokens += counts_to_tokens(self._get_value_counts(slot, key, value))
         return num_tokens
     
     def get_prompt_messages_hash(self):
@@ -80,12 +161,19 @@ class ChatMessages(list):
         if len(self) == 0:
             return 0
         
+        # 优先使用提供商返回的用量，没有时使用估算值
+        input_tokens, output_tokens = self.input_tokens, self.output_tokens
         if self.model in model_config:
-            return model_config[self.model]["Pricing"][0] * self[:-1].count_message_tokens() / 1_000 + model_config[self.model]["Pricing"][1] * self[-1:].count_message_tokens() / 1_000
+            return model_config[self.model]["Pricing"][0] * input_tokens / 1_000 + model_config[self.model]["Pricing"][1] * output_tokens / 1_000
         elif self.model in model_prices:
+            prices = model_prices[self.model]
+            # 命中提供商缓存的输入tokens按缓存价格计费
+            cached_tokens = min(self.cached_tokens, input_tokens)
+            cache_price = prices.get('cache_read_input_token_cost', prices.get('input_cost_per_token_cache_hit', prices["input_cost_per_token"]))
             return (
-                model_prices[self.model]["input_cost_per_token"] * self[:-1].count_message_tokens() +
-                model_prices[self.model]["output_cost_per_token"] * self[-1:].count_message_tokens()
+                prices["input_cost_per_token"] * (input_tokens - cached_tokens) +
+                cache_price * cached_tokens +
+                prices["output_cost_per_token"] * output_tokens
             )
         return 0
     
@@ -0,0 +1,168 @@
+import time
+import threading
+import hashlib
+
+import httpx
+
+from config import CLIENT_POOL_MAX_CONNECTIONS, CLIENT_POOL_MAX_KEEPALIVE, CLIENT_POOL_KEEPALIVE_EXPIRY, CLIENT_POOL_IDLE_TIMEOUT
+
+
+def create_http_client(proxies=None, timeout=300):
+    """
+    创建带连接复用的httpx客户端，连接上限和keep-alive时长由config.py控制
+    timeout可以是秒数或httpx.Timeout（如openai.DEFAULT_TIMEOUT，保持SDK默认的超时）
+    """
+    limits = httpx.Limits(
+        max_connections=CLIENT_POOL_MAX_CONNECTIONS,
+        max_keepalive_connections=CLIENT_POOL_MAX_KEEPALIVE,
+        keepalive_expiry=CLIENT_POOL_KEEPALIVE_EXPIRY,
+    )
+    if proxies:
+        return httpx.Client(proxy=proxies, timeout=timeout, limits=limits)
+    return httpx.Client(timeout=timeout, limits=limits)
+
+
+class _PoolEntry:
+    def __init__(self, client):
+        self.client = client
+        self.in_use = 0
+        self.uses = 0
+        self.created_at = time.time()
+        self.last_used = self.created_at
+
+
+class ClientLease:
+    def __init__(self, pool, entry):
+        self._pool = pool
+        self._entry = entry
+        self._released = False
+
+    @property
+    def client(self):
+        return self._entry.client
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._pool._release(self._entry)
+
+    def __enter__(self):
+        return self.client
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class ClientPool:
+    """
+    进程内共享的provider客户端池，按(provider, base_url, api_key, proxy, timeout)复用客户端，
+    使同一配置的请求共享底层的keep-alive连接，空闲超过idle_timeout的客户端会被关闭并移除
+    """
+    def __init__(self, idle_timeout=CLIENT_POOL_IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    @staticmethod
+    def make_key(provider, base_url=None, api_key=None, proxy=None, timeout=None):
+        # api_key只以哈希形式保存在key中，避免出现在统计信息里
+        api_key_hash = hashlib.md5((api_key or '').encode()).hexdigest()
+        # 客户端创建时绑定了超时时间，不同超时的调用不能共用一个客户端
+        return (provider, base_url or '', api_key_hash, proxy or '', timeout)
+
+    def acquire(self, provider, factory, base_url=None, api_key=None, proxy=None, timeout=None):
+        """
+        获取一个客户端，不存在时调用factory()创建，使用完毕后需要调用release()（也可以用with语句）
+        Args:
+            provider: 提供商名称
+            factory: 无参数的客户端构造函数
+            base_url, api_key, proxy: 与provider一起组成复用的key
+            timeout: factory创建的客户端绑定的超时秒数，也是key的一部分，None表示使用SDK默认的超时
+        Returns:
+            ClientLease，通过.client获取客户端
+        """
+        key = self.make_key(provider, base_url, api_key, proxy, timeout)
+        with self._lock:
+            self._evict_idle()
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                entry = self._entries[key] = _PoolEntry(factory())
+            else:
+                self._hits += 1
+            entry.in_use += 1
+            entry.uses += 1
+        return ClientLease(self, entry)
+
+    def _release(self, entry):
+        with self._lock:
+            entry.in_use -= 1
+            entry.last_used = time.time()
+
+    def _evict_idle(self):
+        now = time.time()
+        for key, entry in list(self._entries.items()):
+            if entry.in_use == 0 and now - entry.last_used > self.idle_timeout:
+                del self._entries[key]
+                self._evictions += 1
+                _close_client(entry.client)
+
+    def stats(self):
+        """返回客户端池的统计信息，用于衡量连接复用情况"""
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                'clients': len(self._entries),
+                'in_use': sum(e.in_use for e in self._entries.values()),
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'hit_rate': self._hits / total if total else 0,
+                'per_client': [
+                    {
+                        'provider': key[0],
+                        'base_url': key[1],
+                        'proxy': key[3],
+                        'timeout': key[4],
+                        'in_use': e.in_use,
+                        'uses': e.uses,
+                        'idle_seconds': time.time() - e.last_used,
+                    }
+                    for key, e in self._entries.items()
+                ],
+            }
+
+    def close_all(self):
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+        for entry in entries:
+            _close_client(entry.client)
+
+
+def close_stream(stream):
+    """关闭流式响应，使连接回到连接池（部分SDK的流没有close()，只能关闭其底层的response）"""
+    close = getattr(stream, 'close', None)
+    if not callable(close):
+        close = getattr(getattr(stream, 'response', None), 'close', None)
+    if callable(close):
+        close()
+
+
+def _close_client(client):
+    close = getattr(client, 'close', None)
+    if callable(close):
+        try:
+            close()
+        except Exception as e:
+            print(f"⚠️ 关闭客户端失败: {type(e).__name__}: {str(e)}")
+
+
+client_pool = ClientPool()
+
+
+def get_client_pool_stats():
+    return client_pool.stats()
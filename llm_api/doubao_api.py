@@ -1,5 +1,8 @@
-from openai import OpenAI
+from openai import OpenAI, DEFAULT_TIMEOUT
+from config import LLM_STREAM_INCLUDE_USAGE
 from .chat_messages import ChatMessages
+from .client_pool import client_pool, create_http_client
+from .openai_api import create_chat_stream
 
 doubao_model_config = {
     "doubao-lite-32k":{
@@ -46,13 +49,18 @@ def stream_chat_with_doubao(messages, model='doubao-lite-32k', endpoint_id=None,
 
     base_url = "https://ark.cn-beijing.volces.com/api/v3"
     
+    # 相同api_key的请求共享同一个客户端及其keep-alive连接
+    lease = client_pool.acquire(
+        'doubao',
+        lambda: OpenAI(api_key=api_key, base_url=base_url, http_client=create_http_client(timeout=DEFAULT_TIMEOUT)),
+        base_url=base_url,
+        api_key=api_key
+    )
+    stream = None
+
     try:
-        print(f"✅ Creating Doubao client...")
-        client = OpenAI(
-            api_key=api_key,
-            base_url=base_url,
-        )
-        print(f"✅ Doubao client created successfully")
+        client = lease.client
+        print(f"✅ Doubao client acquired from pool")
         
         request_params = {
             'model': endpoint_id,
@@ -60,6 +68,8 @@ def stream_chat_with_doubao(messages, model='doubao-lite-32k', endpoint_id=None,
             'stream': True,
             'response_format': { "type": "json_object" } if response_json else None
         }
+        if LLM_STREAM_INCLUDE_USAGE:
+            request_params['stream_options'] = {'include_usage': True}
         
         print(f"\n🌐 === Doubao API Request Details ===")
         print(f"Base URL: {base_url}")
@@ -77,12 +87,14 @@ def stream_chat_with_doubao(messages, model='doubao-lite-32k', endpoint_id=None,
         print(f"🚀 Sending request to Doubao API")
         start_time = time.time()
         
-        stream = client.chat.completions.create(**request_params)
+        stream = create_chat_stream(client, request_params, base_url=base_url)
         
         print(f"✅ API request initiated successfully in {time.time() - start_time:.2f}s, starting to stream response")
         
         messages.append({'role': 'assistant', 'content': ''})
-        content = ''
+        # 增量过滤思考过程（处理 <think> </think> 等标签）
+        from prompts.prompt_utils import ThinkingProcessFilter
+        thinking_filter = ThinkingProcessFilter()
         chunk_count = 0
         first_chunk_time = None
         
@@ -95,17 +107,17 @@ def stream_chat_with_doubao(messages, model='doubao-lite-32k', endpoint_id=None,
             if chunk_count <= 3:  # Log first few chunks for debugging
                 print(f"📦 Chunk #{chunk_count}: {str(chunk)[:200]}...")
             
+            messages.update_usage(getattr(chunk, 'usage', None))
             if chunk.choices:
                 delta_content = chunk.choices[0].delta.content or ''
-                content += delta_content
-                
-                # 对内容进行思考过程过滤（处理 <think> </think> 等标签）
-                from prompts.prompt_utils import filter_thinking_process
-                filtered_content = filter_thinking_process(content)
+                thinking_filter.feed(delta_content)
                 
-                messages[-1]['content'] = filtered_content
+                messages[-1]['content'] = thinking_filter.text
                 yield messages
         
+        thinking_filter.finish()
+        messages[-1]['content'] = thinking_filter.text
+        
         total_time = time.time() - start_time
         print(f"✅ Doubao API call completed successfully in {total_time:.2f}s, received {chunk_count} chunks")
         return messages
@@ -130,6 +142,10 @@ def stream_chat_with_doubao(messages, model='doubao-lite-32k', endpoint_id=None,
         raise Exception(f"Doubao API调用失败 - {type(e).__name__}: {str(e)}")
         
     finally:
+        # 提前结束（如客户端停止）时关闭流，使连接回到连接池
+        if stream is not None:
+            stream.close()
+        lease.release()
         print(f"=== Doubao API Call Finished ===\n")
 
 if __name__ == '__main__':
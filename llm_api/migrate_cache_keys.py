@@ -0,0 +1,66 @@
+"""
+将MongoDB stream_chat集合中的旧缓存记录迁移到新的缓存键（与api_key等凭据无关，区分提供商和base_url）
+
+用法: python -m llm_api.migrate_cache_keys [--dry-run]
+
+旧记录保存了完整的调用参数(args/kwargs)，其中的ModelConfig包含base_url，据此重新计算cache_key
+原来的键保存在legacy_cache_key字段（已是旧版本键的记录再次迁移时保留最早的键）
+本地SQLite缓存没有保存调用参数，无法迁移，旧条目会在TTL或容量淘汰时自然清除
+"""
+import sys
+
+from pymongo import UpdateOne
+
+from config import MONOGODB_DB_NAME
+
+from .mongodb_init import mongo_client
+from .mongodb_cache import create_cache_key, CACHE_KEY_VERSION
+
+
+def migrate_cache_keys(collection_name='stream_chat', batch_size=1000, dry_run=False):
+    """
+    重新计算旧记录的cache_key
+    Returns:
+        (迁移数量, 跳过数量)
+    """
+    if mongo_client is None:
+        raise ValueError("需要设置ENABLE_MONGODB=true才能迁移MongoDB缓存")
+
+    collection = mongo_client[MONOGODB_DB_NAME][collection_name]
+    cursor = collection.find(
+        {'key_version': {'$ne': CACHE_KEY_VERSION}},
+        {'args': 1, 'kwargs': 1, 'cache_key': 1, 'legacy_cache_key': 1}
+    )
+
+    migrated, skipped = 0, 0
+    operations = []
+    for doc in cursor:
+        try:
+            cache_key = create_cache_key(*doc['args'], **doc.get('kwargs', {}))
+        except (KeyError, TypeError, IndexError, AttributeError) as e:
+            print(f"⚠️ 跳过无法解析的缓存记录 {doc['_id']}: {type(e).__name__}: {str(e)}")
+            skipped += 1
+            continue
+
+        operations.append(UpdateOne(
+            {'_id': doc['_id']},
+            {'$set': {'cache_key': cache_key, 'legacy_cache_key': doc.get('legacy_cache_key') or doc.get('cache_key'), 'key_version': CACHE_KEY_VERSION}}
+        ))
+        migrated += 1
+        if len(operations) >= batch_size:
+            if not dry_run:
+                collection.bulk_write(operations, ordered=False)
+            operations = []
+            print(f"🔄 已迁移 {migrated} 条缓存记录")
+
+    if operations and not dry_run:
+        collection.bulk_write(operations, ordered=False)
+
+    if not dry_run:
+        collection.create_index('cache_key')
+    print(f"✅ 缓存键迁移完成: 迁移{migrated}条，跳过{skipped}条{'（dry run，未写入）' if dry_run else ''}")
+    return migrated, skipped
+
+
+if __name__ == '__main__':
+    migrate_cache_keys(dry_run='--dry-run' in sys.argv)
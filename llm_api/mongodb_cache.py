@@ -1,86 +1,175 @@
 import time
 import functools
-from typing import Generator, Any
-from pymongo import MongoClient
 import hashlib
 import json
-import datetime
-import random
+from urllib.parse import urlparse
 
-from config import ENABLE_MONOGODB, MONOGODB_DB_NAME, ENABLE_MONOGODB_CACHE, CACHE_REPLAY_SPEED, CACHE_REPLAY_MAX_DELAY
+from config import ENABLE_MONOGODB, CACHE_REPLAY_SPEED, CACHE_REPLAY_MAX_DELAY, CACHE_REPLAY_MODE, CACHE_REPLAY_MODES, CACHE_REPLAY_COARSE_FRAMES
 
 from .chat_messages import ChatMessages
 from .mongodb_cost import record_api_cost, check_cost_limits
-from .mongodb_init import mongo_client as client
+from .cache_backend import cache_backend
+from .baidu_api import wenxin_model_config
+from .doubao_api import doubao_model_config
+from .zhipuai_api import zhipuai_model_config
 
-def create_cache_key(func_name: str, args: tuple, kwargs: dict) -> str:
-    """创建缓存键"""
-    # 将参数转换为可序列化的格式
+# 缓存键的版本，键的计算方式变化时递增，旧记录可用migrate_cache_keys.py迁移
+CACHE_KEY_VERSION = 3
+
+# 影响生成结果的参数，api_key、timeout等与调用方式相关的参数不参与缓存键
+GENERATION_PARAMS = ('max_tokens', 'temperature', 'top_p', 'n', 'presence_penalty', 'frequency_penalty', 'stop', 'seed')
+
+def normalize_messages(messages: list, system_prompt: str = '') -> list:
+    """
+    规范化消息列表：只保留role和content，统一换行符（CRLF和LF视为相同的请求），
+    并按prepare_chat的规则合并ModelConfig中的system_prompt
+    首尾空白会原样发送给模型、可能影响生成结果，因此不做去除，只差首尾空白的请求使用不同的缓存键
+    """
+    normalized = [
+        {'role': message['role'], 'content': message['content'].replace('\r\n', '\n')}
+        for message in messages
+    ]
+    if system_prompt and system_prompt.strip():
+        system_prompt = system_prompt.replace('\r\n', '\n')
+        if normalized and normalized[0]['role'] == 'system':
+            normalized[0]['content'] = f"{system_prompt}\n\n{normalized[0]['content']}"
+        else:
+            normalized.insert(0, {'role': 'system', 'content': system_prompt})
+    return normalized
+
+def normalize_base_url(base_url) -> str:
+    """规范化base_url：协议和域名小写，去掉默认端口和末尾的/"""
+    if not base_url:
+        return ''
+    parsed = urlparse(base_url.strip())
+    scheme = parsed.scheme.lower()
+    host = (parsed.hostname or '').lower()
+    port = parsed.port
+    if port and (scheme, port) not in (('http', 80), ('https', 443)):
+        host = f"{host}:{port}"
+    return f"{scheme}://{host}{parsed.path.rstrip('/')}"
+
+def get_cache_endpoint(model_config: dict) -> tuple:
+    """
+    (提供商, 端点)：同名模型在不同端点上（如本地LM Studio和远程服务）的结果不同，不能共享缓存
+    OpenAI兼容接口的端点为规范化后的base_url，豆包为endpoint_id
+    """
+    model_name = model_config['model']
+    if model_name in wenxin_model_config:
+        return 'wenxin', ''
+    elif model_name in doubao_model_config:
+        return 'doubao', model_config.get('endpoint_id') or ''
+    elif model_name in zhipuai_model_config:
+        return 'zhipuai', ''
+    return 'openai', normalize_base_url(model_config.get('base_url'))
+
+def create_cache_key(model_config: dict, messages: list, response_json=False) -> str:
+    """
+    创建缓存键，由提供商和端点、模型名、规范化后的消息、response_json和生成参数决定，
+    与api_key等凭据无关，因此更换key或不同用户的相同请求可以共享缓存
+    参数与stream_chat一致
+    """
+    provider, endpoint = get_cache_endpoint(model_config)
     cache_dict = {
-        'func_name': func_name,
-        'args': args,
-        'kwargs': kwargs
+        'version': CACHE_KEY_VERSION,
+        'provider': provider,
+        'endpoint': endpoint,
+        'model': model_config['model'],
+        'messages': normalize_messages(messages, model_config.get('system_prompt', '')),
+        'response_json': bool(response_json),
+        'params': {k: model_config[k] for k in GENERATION_PARAMS if k in model_config},
     }
     # 转换为JSON字符串并创建哈希
-    cache_string = json.dumps(cache_dict, sort_keys=True)
+    cache_string = json.dumps(cache_dict, sort_keys=True, ensure_ascii=False)
     return hashlib.md5(cache_string.encode()).hexdigest()
 
 
+def get_replay_mode(args: tuple, kwargs: dict) -> str:
+    """
+    缓存命中时的回放模式，优先级：调用参数cache_replay > ModelConfig中的cache_replay > config.CACHE_REPLAY_MODE
+    批量任务和回归测试可以使用instant，交互界面保持默认的typewriter
+    无效的回放模式在调用时就抛出ValueError，不等到缓存命中
+    """
+    replay_mode = kwargs.pop('cache_replay', None)   # 同use_cache，不能传给原函数
+    if replay_mode is None and args and isinstance(args[0], dict):
+        replay_mode = args[0].get('cache_replay')
+    replay_mode = replay_mode or CACHE_REPLAY_MODE
+    if replay_mode not in CACHE_REPLAY_MODES:
+        raise ValueError(f"未知的缓存回放模式: {replay_mode}，可选：{' / '.join(CACHE_REPLAY_MODES)}")
+    return replay_mode
+
 
 def llm_api_cache():
-    """MongoDB缓存装饰器"""
-    db_name=MONOGODB_DB_NAME
-    collection_name='stream_chat'
+    """
+    LLM响应缓存装饰器，缓存后端由config.LLM_CACHE_BACKEND选择（mongodb / sqlite / none）
+    开启MongoDB时同时负责费用检查和记录
+    """
     
     def dummy_decorator(func):
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
             # 移除 use_cache 参数，避免传递给原函数
             kwargs.pop('use_cache', None)
+            kwargs.pop('cache_replay', None)
             return func(*args, **kwargs)
         return wrapper
     
 
-    if not ENABLE_MONOGODB:
+    if not ENABLE_MONOGODB and cache_backend is None:
         return dummy_decorator
     
+    def replay(cached_data, model, replay_mode):
+        """
+        按回放模式生成(等待秒数, 消息)，最后一项为finished的完整结果
+        - typewriter: 按记录的间隔（除以CACHE_REPLAY_SPEED）逐段回放，保留打字机效果
+        - coarse: 不等待，只输出CACHE_REPLAY_COARSE_FRAMES个中间帧
+        - instant: 不等待，直接输出完整结果
+        """
+        messages = ChatMessages(cached_data['return_value'])
+        messages.model = model
+        # 缓存中保存的是列表，提供商返回的用量需要单独恢复
+        messages.usage = cached_data.get('usage')
+
+        def partial(index):
+            if index > 0:
+                return messages.prompt_messages + [{'role': 'assistant', 'content': messages.response[:index]}]
+            return messages.prompt_messages
+
+        items = cached_data['yields']
+        if replay_mode == 'typewriter':
+            for item in items:
+                sacled_delay = min(item['delay'] / CACHE_REPLAY_SPEED, CACHE_REPLAY_MAX_DELAY)
+                if sacled_delay > 0:  # 应用加速倍数
+                    yield sacled_delay, partial(item['index'])
+        elif replay_mode == 'coarse' and items:
+            step = len(items) / CACHE_REPLAY_COARSE_FRAMES
+            for i in range(1, CACHE_REPLAY_COARSE_FRAMES):
+                yield 0, partial(items[min(int(i * step), len(items) - 1)]['index'])
+        
+        messages.finished = True
+        yield 0, messages
+    
     def decorator(func):
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
-            check_cost_limits()
+            if ENABLE_MONOGODB:
+                check_cost_limits()
 
             use_cache = kwargs.pop('use_cache', True)   # pop很重要
-            
-            if not ENABLE_MONOGODB_CACHE:
-                use_cache = False
-
-            db = client[db_name]
-            collection = db[collection_name]
+            replay_mode = get_replay_mode(args, kwargs)
             
             # 创建缓存键
-            cache_key = create_cache_key(func.__name__, args, kwargs)
+            cache_key = create_cache_key(*args, **kwargs)
             
             # 检查缓存
-            if use_cache:
-                cached_data = list(collection.aggregate([
-                    {'$match': {'cache_key': cache_key}},
-                    {'$sample': {'size': 1}}
-                ]))
-                cached_data = cached_data[0] if cached_data else None
+            if use_cache and cache_backend is not None:
+                cached_data = cache_backend.lookup(cache_key)
                 if cached_data:
                     # 如果有缓存，yield缓存的结果
-                    messages = ChatMessages(cached_data['return_value'])
-                    messages.model = args[0]['model']
-                    for item in cached_data['yields']:
-                        sacled_delay = min(item['delay'] / CACHE_REPLAY_SPEED, CACHE_REPLAY_MAX_DELAY)
-                        if sacled_delay > 0: time.sleep(sacled_delay)  # 应用加速倍数
-                        else: continue
-                        if item['index'] > 0:
-                            yield messages.prompt_messages + [{'role': 'assistant', 'content': messages.response[:item['index']]}]
-                        else:
-                            yield messages.prompt_messages
-                    messages.finished = True
-                    yield messages
+                    messages = None
+                    for sacled_delay, messages in replay(cached_data, args[0]['model'], replay_mode):
+                        if sacled_delay > 0: time.sleep(sacled_delay)
+                        yield messages
                     return messages
             
             # 如果没有缓存，执行原始函数并记录结果
@@ -107,19 +196,20 @@ def llm_api_cache():
                 return_value = e.value
                 
                 # 记录API调用费用
-                record_api_cost(return_value)
+                if ENABLE_MONOGODB:
+                    record_api_cost(return_value)
                 
-                # 存储到MongoDB
-                cache_data = {
-                    'created_at':datetime.datetime.now(),
-                    'return_value': return_value,
-                    'func_name': func.__name__,
-                    'args': args,
-                    'kwargs': kwargs,
-                    'yields': yields_data,
-                    'cache_key': cache_key,
-                }
-                collection.insert_one(cache_data)
+                # 写入缓存
+                if cache_backend is not None:
+                    cache_backend.put(cache_key, {
+                        'return_value': return_value,
+                        'func_name': func.__name__,
+                        'args': args,
+                        'kwargs': kwargs,
+                        'yields': yields_data,
+                        'usage': return_value.usage,
+                        'key_version': CACHE_KEY_VERSION,
+                    })
                 
                 return return_value
             
@@ -1,26 +1,32 @@
+import time
 import datetime
+import threading
+from collections import deque
 
-from config import API_COST_LIMITS, MONOGODB_DB_NAME
+from config import API_COST_LIMITS, MONOGODB_DB_NAME, COST_LEDGER_RECONCILE_INTERVAL
 
 from .chat_messages import ChatMessages
 from .mongodb_init import mongo_client as client
+from .write_behind import insert_document, flush_writes
 
 def record_api_cost(messages: ChatMessages):
     """记录API调用费用"""
 
-    db = client[MONOGODB_DB_NAME]
-    collection = db['api_cost']
-
     cost_data = {
         'created_at': datetime.datetime.now(),
         'model': messages.model,
         'cost': messages.cost,
         'currency_symbol': messages.currency_symbol,
-        'input_tokens': messages[:-1].count_message_tokens(),
-        'output_tokens': messages[-1:].count_message_tokens(),
-        'total_tokens': messages.count_message_tokens()
+        'input_tokens': messages.input_tokens,
+        'output_tokens': messages.output_tokens,
+        'cached_tokens': messages.cached_tokens,
+        'total_tokens': messages.total_tokens,
+        'usage_source': 'provider' if messages.usage else 'estimate',
+        'queue_wait': getattr(messages, 'queue_wait', 0),
     }
-    collection.insert_one(cost_data)
+    # 后台批量写入，不阻塞请求线程；账本立即更新，限额检查不受写入延迟影响
+    insert_document('api_cost', cost_data)
+    cost_ledger.add(to_rmb(cost_data['cost'], cost_data['currency_symbol']), cost_data['created_at'])
 
 def get_model_cost_stats(start_date: datetime.datetime, end_date: datetime.datetime) -> list:
     """获取指定时间段内的模型调用费用统计"""
@@ -41,7 +47,10 @@ def get_model_cost_stats(start_date: datetime.datetime, end_date: datetime.datet
                 'total_input_tokens': { '$sum': '$input_tokens' },
                 'total_output_tokens': { '$sum': '$output_tokens' },
                 'total_tokens': { '$sum': '$total_tokens' },
+                'total_cached_tokens': { '$sum': '$cached_tokens' },
                 'avg_cost_per_call': { '$avg': '$cost' },
+                'total_queue_wait': { '$sum': '$queue_wait' },
+                'avg_queue_wait': { '$avg': '$queue_wait' },
                 'currency_symbol': { '$first': '$currency_symbol' }
             }
         },
@@ -53,7 +62,10 @@ def get_model_cost_stats(start_date: datetime.datetime, end_date: datetime.datet
                 'total_input_tokens': 1,
                 'total_output_tokens': 1,
                 'total_tokens': 1,
+                'total_cached_tokens': 1,
                 'avg_cost_per_call': { '$round': ['$avg_cost_per_call', 4] },
+                'total_queue_wait': { '$round': ['$total_queue_wait', 2] },
+                'avg_queue_wait': { '$round': ['$avg_queue_wait', 2] },
                 'currency_symbol': 1,
                 '_id': 0
             }
@@ -85,29 +97,179 @@ def print_cost_report(days: int = 30, hours: int = 0):
         print(f"Total Calls: {model_stat['total_calls']}")
         print(f"Total Tokens: {model_stat['total_tokens']:,}")
         print(f"Avg Cost/Call: {model_stat['currency_symbol']}{model_stat['avg_cost_per_call']:.4f}")
+        print(f"Avg Queue Wait: {model_stat.get('avg_queue_wait') or 0:.2f}s")
+
+def to_rmb(cost, currency_symbol):
+    return cost * (API_COST_LIMITS['USD_TO_RMB_RATE'] if currency_symbol == '$' else 1)
+
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+def _to_timestamp(dt: datetime.datetime) -> float:
+    # created_at以本地时间的naive datetime保存，统一按相同方式换算，与MongoDB中的$toLong一致
+    return (dt - _EPOCH).total_seconds()
+
+
+class _RollingWindow:
+    """按时间桶累计费用的滑动窗口，过期的桶从左侧弹出，求和为O(1)"""
+    def __init__(self, window_seconds):
+        self.window_seconds = window_seconds
+        self.buckets = deque()  # [bucket_start, rmb]
+        self.total = 0.0
+
+    def add(self, bucket_start, rmb):
+        if self.buckets and self.buckets[-1][0] == bucket_start:
+            self.buckets[-1][1] += rmb
+        else:
+            # 记录的时间通常是递增的，乱序时插入到对应位置
+            index = len(self.buckets)
+            while index > 0 and self.buckets[index - 1][0] > bucket_start:
+                index -= 1
+            if index > 0 and self.buckets[index - 1][0] == bucket_start:
+                self.buckets[index - 1][1] += rmb
+            else:
+                self.buckets.insert(index, [bucket_start, rmb])
+        self.total += rmb
+
+    def expire(self, now):
+        while self.buckets and self.buckets[0][0] <= now - self.window_seconds:
+            self.total -= self.buckets.popleft()[1]
+        if not self.buckets:
+            self.total = 0.0  # 消除浮点累计误差
+
+
+class CostLedger:
+    """
+    进程内的滚动费用账本，按分钟分桶累计最近1小时和最近1天的费用（人民币）
+    启动后第一次检查时在后台从MongoDB载入（载入完成前只包含本进程记录的费用），之后由record_api_cost实时更新，
+    每隔COST_LEDGER_RECONCILE_INTERVAL秒在后台与数据库重新对账（同步其他进程产生的费用）
+    """
+    bucket_seconds = 60
+
+    def __init__(self, reconcile_interval=COST_LEDGER_RECONCILE_INTERVAL):
+        self.reconcile_interval = reconcile_interval
+        self._lock = threading.Lock()
+        self._hour = _RollingWindow(3600)
+        self._day = _RollingWindow(24 * 3600)
+        self._seeded = False
+        self._reconciling = False
+        self._recorded_during_reconcile = None
+        self._last_reconcile = 0
+        self.reconcile_count = 0
+        self.last_reconcile_seconds = 0
+
+    def _bucket(self, timestamp):
+        return timestamp - timestamp % self.bucket_seconds
+
+    def _add(self, bucket_start, rmb):
+        self._hour.add(bucket_start, rmb)
+        self._day.add(bucket_start, rmb)
+
+    def add(self, rmb, created_at: datetime.datetime):
+        timestamp = _to_timestamp(created_at)
+        with self._lock:
+            self._add(self._bucket(timestamp), rmb)
+            if self._recorded_during_reconcile is not None:
+                self._recorded_during_reconcile.append((timestamp, rmb))
+
+    def _load_buckets(self):
+        """从MongoDB按分钟聚合最近1天的费用"""
+        day_ago = datetime.datetime.now() - datetime.timedelta(days=1)
+        pipeline = [
+            {'$match': {'created_at': {'$gte': day_ago}}},
+            {'$project': {
+                'cost': 1,
+                'currency_symbol': 1,
+                'minute': {'$subtract': [{'$toLong': '$created_at'}, {'$mod': [{'$toLong': '$created_at'}, self.bucket_seconds * 1000]}]},
+            }},
+            {'$group': {
+                '_id': {'minute': '$minute', 'currency_symbol': '$currency_symbol'},
+                'cost': {'$sum': '$cost'},
+            }},
+        ]
+        collection = client[MONOGODB_DB_NAME]['api_cost']
+        buckets = {}
+        for row in collection.aggregate(pipeline):
+            bucket_start = row['_id']['minute'] / 1000
+            buckets[bucket_start] = buckets.get(bucket_start, 0) + to_rmb(row['cost'], row['_id']['currency_symbol'])
+        return buckets
+
+    def reconcile(self):
+        """用数据库中的记录重建账本，对账期间本进程新记录的费用会补记到新账本中"""
+        start_time = time.time()
+        # 先开始记录新的费用再写完缓冲：写完之后记录的费用可能不在查询结果中，需要补记
+        with self._lock:
+            self._recorded_during_reconcile = []
+        try:
+            # 写完本进程缓冲中的费用记录，保证查询结果包含它们
+            flush_writes()
+            buckets = self._load_buckets()
+        except Exception:
+            with self._lock:
+                self._recorded_during_reconcile = None
+            raise
+
+        with self._lock:
+            hour, day = _RollingWindow(3600), _RollingWindow(24 * 3600)
+            for bucket_start in sorted(buckets):
+                hour.add(bucket_start, buckets[bucket_start])
+                day.add(bucket_start, buckets[bucket_start])
+            # 查询期间新记录的费用可能已包含在查询结果中，宁可暂时重复计算（偏保守），下次对账时修正
+            for timestamp, rmb in self._recorded_during_reconcile:
+                hour.add(self._bucket(timestamp), rmb)
+                day.add(self._bucket(timestamp), rmb)
+            self._hour, self._day = hour, day
+            self._recorded_during_reconcile = None
+            self._seeded = True
+            self._last_reconcile = time.time()
+            self.reconcile_count += 1
+            self.last_reconcile_seconds = time.time() - start_time
+
+    def _reconcile_in_background(self):
+        try:
+            self.reconcile()
+        except Exception as e:
+            print(f"⚠️ 费用账本对账失败: {type(e).__name__}: {str(e)}")
+        finally:
+            with self._lock:
+                self._reconciling = False
+
+    def totals(self):
+        """
+        返回(最近1小时费用, 最近1天费用)，单位为人民币
+        尚未从数据库载入或到期时在后台线程对账，不阻塞调用方（载入等待写入缓冲写完），期间使用当前账本
+        """
+        with self._lock:
+            if not self._reconciling and (not self._seeded or time.time() - self._last_reconcile > self.reconcile_interval):
+                self._reconciling = True
+                threading.Thread(target=self._reconcile_in_background, daemon=True).start()
+
+            now = _to_timestamp(datetime.datetime.now())
+            self._hour.expire(now)
+            self._day.expire(now)
+            return self._hour.total, self._day.total
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hour_total_rmb': self._hour.total,
+                'day_total_rmb': self._day.total,
+                'buckets': len(self._day.buckets),
+                'reconcile_count': self.reconcile_count,
+                'last_reconcile_seconds': self.last_reconcile_seconds,
+                'seconds_since_reconcile': time.time() - self._last_reconcile if self._seeded else None,
+            }
+
+
+cost_ledger = CostLedger()
+
 
 def check_cost_limits() -> bool:
     """
-    检查API调用费用是否超过限制
-    返回: 如果未超过限制返回True，否则返回False
+    检查API调用费用是否超过限制，费用来自进程内的滚动账本，不再每次查询数据库
+    返回: 如果未超过限制返回True，否则抛出异常
     """
-    now = datetime.datetime.now()
-    hour_ago = now - datetime.timedelta(hours=1)
-    day_ago = now - datetime.timedelta(days=1)
-    
-    # 获取统计数据
-    hour_stats = get_model_cost_stats(hour_ago, now)
-    day_stats = get_model_cost_stats(day_ago, now)
-    
-    # 计算总费用并根据需要转换为人民币
-    hour_total_rmb = sum(
-        stat['total_cost'] * (API_COST_LIMITS['USD_TO_RMB_RATE'] if stat['currency_symbol'] == '$' else 1)
-        for stat in hour_stats
-    )
-    day_total_rmb = sum(
-        stat['total_cost'] * (API_COST_LIMITS['USD_TO_RMB_RATE'] if stat['currency_symbol'] == '$' else 1)
-        for stat in day_stats
-    )
+    hour_total_rmb, day_total_rmb = cost_ledger.totals()
     
     # 检查是否超过限制
     if hour_total_rmb >= API_COST_LIMITS['HOURLY_LIMIT_RMB']:
@@ -118,4 +280,9 @@ def check_cost_limits() -> bool:
         print(f"警告：最近24小时API费用（￥{day_total_rmb:.2f}）超过限制（￥{API_COST_LIMITS['DAILY_LIMIT_RMB']}）")
         raise Exception("最近1天内API调用费用超过设定上限！")
     
-    return True
\ No newline at end of file
+    return True
+
+
+def get_cost_ledger_stats():
+    # 未开启MongoDB时不记录费用
+    return cost_ledger.stats() if client is not None else None
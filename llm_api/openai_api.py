@@ -1,6 +1,7 @@
-import httpx
-from openai import OpenAI
+from openai import OpenAI, BadRequestError
+from config import LLM_STREAM_INCLUDE_USAGE
 from .chat_messages import ChatMessages
+from .client_pool import client_pool, create_http_client
 
 # Pricing reference: https://openai.com/api/pricing/
 gpt_model_config = {
@@ -35,11 +36,78 @@ gpt_model_config = {
 }
 # https://platform.openai.com/docs/guides/reasoning
 
+def build_gpt_request_params(messages, model, max_tokens, n=1, response_json=False):
+    # 检查是否为o1系列模型（支持思考功能）
+    is_reasoning_model = model.startswith('o1-') or model in ['o1-preview', 'o1-mini']
+    
+    if is_reasoning_model and messages[0]['role'] == 'system':
+        print(f"🔄 Converting system message for reasoning model: {model}")
+        messages[0:1] = [{'role': 'user', 'content': messages[0]['content']}, {'role': 'assistant', 'content': ''}]
+    
+    request_params = {
+        'stream': True,
+        'model': model, 
+        'messages': messages, 
+        'max_tokens': max_tokens,
+        'n': n
+    }
+    
+    # 流式响应的最后一个chunk返回实际用量（prompt/completion/cached tokens）
+    if LLM_STREAM_INCLUDE_USAGE:
+        request_params['stream_options'] = {'include_usage': True}
+    
+    # Only add response_format if response_json is True
+    if response_json:
+        request_params['response_format'] = {
+            "type": "json_schema",
+            "json_schema": {
+                "name": "response_schema",
+                "schema": {
+                    "type": "object",
+                    "properties": {
+                        "text": {"type": "string"}
+                    },
+                    "required": ["text"],
+                    "additionalProperties": True
+                }
+            }
+        }
+    
+    return request_params
+
+# 返回过400、不支持stream_options的接口（base_url），之后的请求不再发送该参数
+_no_stream_options = set()
+
+def is_stream_options_error(e):
+    """400错误的param或错误信息是否指向stream_options"""
+    return 'stream_options' in str(getattr(e, 'param', None) or '') or 'stream_options' in str(e)
+
+def create_chat_stream(client, request_params, base_url=None, **kwargs):
+    """
+    创建流式请求。部分OpenAI兼容接口（如旧版LM Studio、vLLM）不支持stream_options，
+    返回的400错误指出该参数时去掉它重试一次，并记住该接口；其他400错误（如上下文超长）直接抛出
+    """
+    if base_url in _no_stream_options:
+        request_params = {k: v for k, v in request_params.items() if k != 'stream_options'}
+    try:
+        return client.chat.completions.create(**request_params, **kwargs)
+    except BadRequestError as e:
+        if 'stream_options' not in request_params or not is_stream_options_error(e):
+            raise
+        print(f"⚠️ 接口返回400，去掉stream_options后重试（用量将使用估算值）: {e}")
+        _no_stream_options.add(base_url)
+        request_params = {k: v for k, v in request_params.items() if k != 'stream_options'}
+        return client.chat.completions.create(**request_params, **kwargs)
+
+def get_filtered_content(thinking_filters):
+    return [f.text for f in thinking_filters] if len(thinking_filters) > 1 else thinking_filters[0].text
+
 def stream_chat_with_gpt(messages, model='gpt-3.5-turbo-1106', response_json=False, api_key=None, base_url=None, max_tokens=4_096, n=1, proxies=None, timeout=300):
     import traceback
     import json
     import requests
     import time
+    from prompts.prompt_utils import ThinkingProcessFilter
     
     # 详细日志记录API调用信息
     print(f"=== OpenAI API Call Details ===")
@@ -122,70 +190,41 @@ def stream_chat_with_gpt(messages, model='gpt-3.5-turbo-1106', response_json=Fal
     print(json.dumps(safe_body, indent=2, ensure_ascii=False))
     print(f"=== End HTTP Request Details ===\n")
     
-    client_params = {
-        "api_key": api_key,
-    }
+    def create_client():
+        client_params = {
+            "api_key": api_key,
+            "http_client": create_http_client(proxies=proxies, timeout=timeout),
+        }
+        if base_url:
+            client_params['base_url'] = base_url
+        return OpenAI(**client_params)
 
     if base_url:
-        client_params['base_url'] = base_url
         print(f"✅ Using custom base URL: {base_url}")
-
-    # 配置HTTP客户端的超时设置
-    httpx_timeout = httpx.Timeout(timeout=timeout)
     if proxies:
-        httpx_client = httpx.Client(proxy=proxies, timeout=httpx_timeout)
-        client_params["http_client"] = httpx_client
         print(f"✅ Using proxy: {proxies}")
-    else:
-        httpx_client = httpx.Client(timeout=httpx_timeout)
-        client_params["http_client"] = httpx_client
-        print(f"✅ Using timeout: {timeout}s")
+    print(f"✅ Using timeout: {timeout}s")
+
+    # 相同(base_url, api_key, proxies, timeout)的请求共享同一个客户端及其keep-alive连接
+    lease = client_pool.acquire('openai', create_client, base_url=base_url, api_key=api_key, proxy=proxies, timeout=timeout)
+    chatstream = None
     
     try:
-        client = OpenAI(**client_params)
-        print("✅ OpenAI client created successfully")
+        client = lease.client
+        print("✅ OpenAI client acquired from pool")
 
-        # 检查是否为o1系列模型（支持思考功能）
-        is_reasoning_model = model.startswith('o1-') or model in ['o1-preview', 'o1-mini']
-        
-        if is_reasoning_model and messages[0]['role'] == 'system':
-            print(f"🔄 Converting system message for reasoning model: {model}")
-            messages[0:1] = [{'role': 'user', 'content': messages[0]['content']}, {'role': 'assistant', 'content': ''}]
-        
-        request_params = {
-            'stream': True,
-            'model': model, 
-            'messages': messages, 
-            'max_tokens': max_tokens,
-            'n': n
-        }
-        
-        # Only add response_format if response_json is True
-        if response_json:
-            request_params['response_format'] = {
-                "type": "json_schema",
-                "json_schema": {
-                    "name": "response_schema",
-                    "schema": {
-                        "type": "object",
-                        "properties": {
-                            "text": {"type": "string"}
-                        },
-                        "required": ["text"],
-                        "additionalProperties": True
-                    }
-                }
-            }
+        request_params = build_gpt_request_params(messages, model, max_tokens, n, response_json)
         
         print(f"🚀 Sending request to {api_url}")
         start_time = time.time()
         
-        chatstream = client.chat.completions.create(**request_params)
+        chatstream = create_chat_stream(client, request_params, base_url=base_url, timeout=timeout)
         
         print(f"✅ API request initiated successfully in {time.time() - start_time:.2f}s, starting to stream response")
         
         messages.append({'role': 'assistant', 'content': ''})
-        content = ['' for _ in range(n)]
+        # 每个choice一个流式过滤器，增量过滤思考过程（处理 <think> </think> 等标签）
+        thinking_filters = [ThinkingProcessFilter() for _ in range(n)]
         chunk_count = 0
         first_chunk_time = None
         
@@ -198,10 +237,13 @@ def stream_chat_with_gpt(messages, model='gpt-3.5-turbo-1106', response_json=Fal
             if chunk_count <= 3:  # Log first few chunks for debugging
                 print(f"📦 Chunk #{chunk_count}: {str(part)[:200]}...")
             
+            # include_usage时最后一个chunk的choices为空，只包含usage
+            messages.update_usage(getattr(part, 'usage', None))
+            
             for choice in part.choices:
                 # 处理具有思考功能的模型（如o1系列）
                 if hasattr(choice.delta, 'content') and choice.delta.content:
-                    content[choice.index] += choice.delta.content
+                    thinking_filters[choice.index].feed(choice.delta.content)
                 
                 # 过滤掉思考过程，只保留实际的回答内容
                 # 对于o1系列模型，思考过程在reasoning字段中，我们只取content字段
@@ -210,17 +252,13 @@ def stream_chat_with_gpt(messages, model='gpt-3.5-turbo-1106', response_json=Fal
                     if chunk_count <= 3:
                         print(f"🧠 Reasoning chunk #{chunk_count}: {str(choice.delta.reasoning)[:100]}...")
                 
-                # 对最终内容进行思考过程过滤（处理 <think> </think> 等标签）
-                from prompts.prompt_utils import filter_thinking_process
-                filtered_content = content if n > 1 else content[0]
-                if isinstance(filtered_content, str):
-                    filtered_content = filter_thinking_process(filtered_content)
-                elif isinstance(filtered_content, list):
-                    filtered_content = [filter_thinking_process(c) if isinstance(c, str) else c for c in filtered_content]
-                
-                messages[-1]['content'] = filtered_content
+                messages[-1]['content'] = get_filtered_content(thinking_filters)
                 yield messages
         
+        for thinking_filter in thinking_filters:
+            thinking_filter.finish()
+        messages[-1]['content'] = get_filtered_content(thinking_filters)
+        
         total_time = time.time() - start_time
         print(f"✅ API call completed successfully in {total_time:.2f}s, received {chunk_count} chunks")
         return messages
@@ -245,6 +283,10 @@ def stream_chat_with_gpt(messages, model='gpt-3.5-turbo-1106', response_json=Fal
         raise Exception(f"OpenAI API调用失败 - {type(e).__name__}: {str(e)}")
         
     finally:
+        # 提前结束（如客户端停止）时关闭流，使连接回到连接池
+        if chatstream is not None:
+            chatstream.close()
+        lease.release()
         print(f"=== API Call Finished ===\n")
 
     
@@ -0,0 +1,219 @@
+import time
+import hashlib
+import threading
+from collections import deque
+from urllib.parse import urlparse
+
+from config import LLM_RATE_LIMITS, LLM_SCHEDULER_MAX_WAIT
+
+
+class TokenBucket:
+    """
+    按分钟速率补充的令牌桶，rate_per_minute为0表示不限制
+    允许余额为负（实际用量超过预估时），之后的请求需要等待余额恢复
+    """
+    def __init__(self, rate_per_minute):
+        self.capacity = rate_per_minute
+        self.tokens = rate_per_minute
+        self.updated_at = time.time()
+
+    def _refill(self):
+        now = time.time()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.capacity / 60)
+        self.updated_at = now
+
+    def wait_time(self, amount):
+        """返回获得amount个令牌还需等待的秒数，0表示可以立即获得"""
+        if not self.capacity:
+            return 0
+        self._refill()
+        # 单次请求超过桶容量时按桶容量计算，避免永远无法满足
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0
+        return (amount - self.tokens) * 60 / self.capacity
+
+    def consume(self, amount):
+        if self.capacity:
+            self._refill()
+            self.tokens -= min(amount, self.capacity)
+
+    def adjust(self, amount):
+        """按实际用量追加扣除（amount为负时返还）"""
+        if self.capacity:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class _LimitState:
+    def __init__(self, max_concurrency=0, rpm=0, tpm=0):
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self.waiters = deque()
+        self.rpm_bucket = TokenBucket(rpm)
+        self.tpm_bucket = TokenBucket(tpm)
+        self.requests = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record_wait(self, wait):
+        self.requests += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+    def stats(self):
+        return {
+            'in_flight': self.in_flight,
+            'queued': len(self.waiters),
+            'requests': self.requests,
+            'avg_queue_wait': self.total_wait / self.requests if self.requests else 0,
+            'max_queue_wait': self.max_wait,
+        }
+
+
+class SchedulerTicket:
+    """调度器发放的请求许可，请求结束后需调用release()归还并按实际用量结算tokens"""
+    def __init__(self, scheduler, provider, key, estimated_tokens, queue_wait):
+        self._scheduler = scheduler
+        self.provider = provider
+        self.key = key
+        self.estimated_tokens = estimated_tokens
+        self.queue_wait = queue_wait
+        self._released = False
+
+    def release(self, used_tokens=None):
+        if not self._released:
+            self._released = True
+            self._scheduler._release(self, used_tokens)
+
+
+class RequestScheduler:
+    """
+    进程内全局的LLM请求调度器，所有stream_chat调用都需先获取许可
+    同时限制每个提供商的总并发，以及每个api_key的并发、每分钟请求数(RPM)和每分钟tokens数(TPM)
+    同一个api_key的请求按到达顺序排队（FIFO）
+    限制参数来自config.LLM_RATE_LIMITS，未单独配置的提供商使用'default'
+    """
+    def __init__(self, limits=None, max_wait=LLM_SCHEDULER_MAX_WAIT):
+        self.limits = limits if limits is not None else LLM_RATE_LIMITS
+        self.max_wait = max_wait
+        self._providers = {}
+        self._keys = {}
+        self._cond = threading.Condition()
+
+    @staticmethod
+    def get_provider_name(provider, base_url=None):
+        # OpenAI兼容接口按base_url的域名区分提供商，如api.deepseek.com
+        if base_url:
+            return urlparse(base_url).hostname or base_url
+        return provider
+
+    def _get_limits(self, provider):
+        return {**self.limits.get('default', {}), **self.limits.get(provider, {})}
+
+    def _get_states(self, provider, api_key):
+        key = (provider, hashlib.md5((api_key or '').encode()).hexdigest())
+        if provider not in self._providers:
+            limits = self._get_limits(provider)
+            self._providers[provider] = _LimitState(max_concurrency=limits.get('max_concurrency', 0))
+        if key not in self._keys:
+            limits = self._get_limits(provider)
+            self._keys[key] = _LimitState(
+                max_concurrency=limits.get('key_max_concurrency', 0),
+                rpm=limits.get('rpm', 0),
+                tpm=limits.get('tpm', 0),
+            )
+        return key, self._providers[provider], self._keys[key]
+
+    def _try_acquire(self, waiter, provider_state, key_state, estimated_tokens):
+        """尝试获取许可，成功返回0，否则返回建议的等待秒数（None表示等待其他请求结束）"""
+        if key_state.waiters[0] is not waiter:
+            return None
+        if provider_state.max_concurrency and provider_state.in_flight >= provider_state.max_concurrency:
+            return None
+        if key_state.max_concurrency and key_state.in_flight >= key_state.max_concurrency:
+            return None
+        wait = max(key_state.rpm_bucket.wait_time(1), key_state.tpm_bucket.wait_time(estimated_tokens))
+        if wait > 0:
+            return wait
+        key_state.waiters.popleft()
+        key_state.rpm_bucket.consume(1)
+        key_state.tpm_bucket.consume(estimated_tokens)
+        provider_state.in_flight += 1
+        key_state.in_flight += 1
+        return 0
+
+    def _grant(self, provider, key, provider_state, key_state, estimated_tokens, start_time):
+        queue_wait = time.time() - start_time
+        provider_state.record_wait(queue_wait)
+        key_state.record_wait(queue_wait)
+        # 队首变化后唤醒其他等待者
+        self._cond.notify_all()
+        return SchedulerTicket(self, provider, key, estimated_tokens, queue_wait)
+
+    def _timeout(self, key_state, waiter):
+        key_state.waiters.remove(waiter)
+        self._cond.notify_all()
+        raise Exception(f"LLM请求排队等待超过{self.max_wait}秒，请稍后重试！")
+
+    def acquire(self, provider, api_key=None, estimated_tokens=0):
+        """
+        阻塞直到获得许可
+        Args:
+            provider: 提供商名称，见get_provider_name
+            api_key: 用于区分同一提供商下的不同key
+            estimated_tokens: 预估的输入tokens数，用于TPM限制，实际用量在release时结算
+        Returns:
+            SchedulerTicket，queue_wait为排队等待的秒数
+        """
+        start_time = time.time()
+        waiter = object()
+        with self._cond:
+            key, provider_state, key_state = self._get_states(provider, api_key)
+            key_state.waiters.append(waiter)
+            while True:
+                wait = self._try_acquire(waiter, provider_state, key_state, estimated_tokens)
+                if wait == 0:
+                    return self._grant(provider, key, provider_state, key_state, estimated_tokens, start_time)
+                remaining = self.max_wait - (time.time() - start_time) if self.max_wait else None
+                if remaining is not None and remaining <= 0:
+                    self._timeout(key_state, waiter)
+                if wait is None:
+                    wait = remaining
+                elif remaining is not None:
+                    wait = min(wait, remaining)
+                self._cond.wait(timeout=wait)
+
+    def _release(self, ticket, used_tokens):
+        with self._cond:
+            provider_state = self._providers[ticket.provider]
+            key_state = self._keys[ticket.key]
+            provider_state.in_flight -= 1
+            key_state.in_flight -= 1
+            if used_tokens is not None:
+                key_state.tpm_bucket.adjust(used_tokens - ticket.estimated_tokens)
+            self._cond.notify_all()
+
+    def stats(self):
+        """返回各提供商及各api_key的并发、排队和等待时间统计"""
+        with self._cond:
+            return {
+                'providers': {name: state.stats() for name, state in self._providers.items()},
+                'keys': [
+                    {
+                        'provider': key[0],
+                        'key_hash': key[1][:8],
+                        **state.stats(),
+                        'rpm_available': state.rpm_bucket.tokens if state.rpm_bucket.capacity else None,
+                        'tpm_available': state.tpm_bucket.tokens if state.tpm_bucket.capacity else None,
+                    }
+                    for key, state in self._keys.items()
+                ],
+            }
+
+
+request_scheduler = RequestScheduler()
+
+
+def get_scheduler_stats():
+    return request_scheduler.stats()
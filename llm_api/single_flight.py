@@ -0,0 +1,229 @@
+import hashlib
+import functools
+import threading
+from collections import deque
+
+from config import ENABLE_SINGLE_FLIGHT
+
+from .mongodb_cache import create_cache_key, get_cache_endpoint, normalize_base_url
+
+
+class _Flight:
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.latest = None
+        self.done = False
+        self.cancelled = False
+        self.result = None
+        self.error = None
+        self.leader_attached = True    # 发起调用方还在消费（上游在它的线程中运行）
+        self.buffers = {}              # 其他调用方 {token: 待消费的帧}
+        self.next_token = 0
+
+
+class SingleFlightGroup:
+    """
+    合并同时进行的相同请求：相同key的调用共享同一个上游生成器，所有调用方收到相同的yield值和返回值
+    上游生成器在第一个调用方的线程中运行，没有合并时不会额外启动线程；
+    第一个调用方提前退出而其他调用方还在等待时，上游转到后台线程继续运行，全部调用方都退出后才会被关闭
+    """
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self._leaders = 0
+        self._followers = 0
+        self._handoffs = 0
+
+    def run(self, key, start, snapshot=None):
+        """
+        Args:
+            key: 请求的唯一标识
+            start: 无参数函数，返回上游生成器，只有第一个调用方会执行
+            snapshot: 复制yield值的函数，上游原地修改并重复yield同一个对象时需要提供，
+                否则缓冲中的帧都会变成最新的状态
+        Yields:
+            第一个调用方直接收到上游的yield值；其他调用方从加入时的最新值开始，
+            按顺序收到之后的每一帧（各自缓冲，消费较慢也不会丢帧，上游的速度由第一个调用方决定）
+        Returns:
+            上游生成器的返回值
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = _Flight()
+                self._leaders += 1
+                token = None
+            else:
+                self._followers += 1
+                print(f"🔗 合并相同的进行中请求，共享上游结果")
+                with flight.cond:
+                    token = flight.next_token
+                    flight.next_token += 1
+                    buffer = flight.buffers[token] = deque()
+                    if flight.latest is not None:
+                        buffer.append(snapshot(flight.latest) if snapshot else flight.latest)
+
+        if token is None:
+            return (yield from self._lead(key, flight, start, snapshot))
+        return (yield from self._follow(key, flight, token))
+
+    def _publish(self, flight, value, snapshot):
+        with flight.cond:
+            flight.latest = value
+            if flight.buffers:
+                frame = snapshot(value) if snapshot else value
+                for buffer in flight.buffers.values():
+                    buffer.append(frame)
+                flight.cond.notify_all()
+
+    def _finish(self, key, flight, result=None, error=None):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        with flight.cond:
+            flight.result = result
+            flight.error = error
+            flight.done = True
+            flight.cond.notify_all()
+
+    def _lead(self, key, flight, start, snapshot):
+        gen = None
+        try:
+            try:
+                gen = start()
+            except BaseException as e:
+                self._finish(key, flight, error=e)
+                raise
+            while True:
+                try:
+                    value = next(gen)
+                except StopIteration as e:
+                    self._finish(key, flight, result=e.value)
+                    return e.value
+                except BaseException as e:
+                    # 上游出错，所有调用方收到相同的异常
+                    self._finish(key, flight, error=e)
+                    raise
+                self._publish(flight, value, snapshot)
+                yield value
+        finally:
+            if not flight.done:
+                self._detach_leader(key, flight, gen, snapshot)
+
+    def _detach_leader(self, key, flight, gen, snapshot):
+        """发起调用方提前退出：还有其他调用方时上游转到后台线程继续运行，否则关闭上游"""
+        with self._lock, flight.cond:
+            flight.leader_attached = False
+            handoff = gen is not None and bool(flight.buffers)
+            if handoff:
+                self._handoffs += 1
+            else:
+                flight.cancelled = True
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+        if handoff:
+            threading.Thread(target=self._drive, args=(key, flight, gen, snapshot), daemon=True).start()
+        elif gen is not None:
+            gen.close()
+
+    def _drive(self, key, flight, gen, snapshot):
+        result, error = None, None
+        try:
+            try:
+                while not flight.cancelled:
+                    self._publish(flight, next(gen), snapshot)
+            finally:
+                gen.close()
+        except StopIteration as e:
+            result = e.value
+        except BaseException as e:
+            error = e
+        self._finish(key, flight, result, error)
+
+    def _follow(self, key, flight, token):
+        buffer = flight.buffers[token]
+        try:
+            while True:
+                with flight.cond:
+                    while not buffer and not flight.done:
+                        flight.cond.wait()
+                    if not buffer:
+                        break
+                    value = buffer.popleft()
+                yield value
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        finally:
+            with self._lock, flight.cond:
+                del flight.buffers[token]
+                if not flight.buffers and not flight.leader_attached and not flight.done:
+                    # 所有调用方都已退出，通知后台的上游停止，新的相同请求不再加入这个flight
+                    flight.cancelled = True
+                    if self._flights.get(key) is flight:
+                        del self._flights[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._flights),
+                'subscribers': sum(len(f.buffers) + f.leader_attached for f in self._flights.values()),
+                'upstream_calls': self._leaders,
+                'coalesced_calls': self._followers,
+                'handoffs': self._handoffs,
+            }
+
+
+flight_group = SingleFlightGroup()
+
+
+def credential_hash(model_config: dict) -> str:
+    """凭据(api_key/ak/sk)、base_url和提供商的哈希，不同凭据的请求不能共享同一次上游调用"""
+    provider, _ = get_cache_endpoint(model_config)
+    credentials = '\0'.join([
+        provider,
+        normalize_base_url(model_config.get('base_url')),
+        model_config.get('api_key') or '',
+        model_config.get('ak') or '',
+        model_config.get('sk') or '',
+    ])
+    return hashlib.sha256(credentials.encode()).hexdigest()
+
+
+def create_flight_key(func_name: str, args: tuple, kwargs: dict) -> tuple:
+    """
+    合并key：缓存键 + 凭据哈希 + use_cache
+    缓存键与凭据无关，但上游调用使用调用方的凭据，用不同key的请求合并后会用错key、共享别人的鉴权和额度错误
+    """
+    key_kwargs = {k: v for k, v in kwargs.items() if k not in ('use_cache', 'cache_replay')}
+    return (func_name, create_cache_key(*args, **key_kwargs), credential_hash(args[0]), kwargs.get('use_cache', True))
+
+
+def snapshot_messages(messages):
+    """流式接口每次yield同一个ChatMessages并原地更新最后一条消息，合并的调用方缓冲的帧需要复制"""
+    snapshot = messages.copy()
+    if snapshot:
+        snapshot[-1] = dict(snapshot[-1])
+    snapshot.finished = messages.finished
+    return snapshot
+
+
+def single_flight():
+    """
+    stream_chat的请求合并装饰器，需放在llm_api_cache外层，这样合并后的请求只查询缓存、记录费用一次
+    只合并参数和凭据都相同的请求，见create_flight_key
+    """
+    def decorator(func):
+        if not ENABLE_SINGLE_FLIGHT:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = create_flight_key(func.__name__, args, kwargs)
+            return (yield from flight_group.run(key, lambda: func(*args, **kwargs), snapshot=snapshot_messages))
+        return wrapper
+    return decorator
+
+
+def get_single_flight_stats():
+    return flight_group.stats()
@@ -0,0 +1,88 @@
+class StreamDelta(dict):
+    """
+    流式输出的增量事件，只包含本次新增的文本，消费者每个token只需做O(delta)的工作
+    - chunk_id: 所属的流（如Writer中chunk的序号），由产生方指定
+    - seq: 同一个流内递增的序号，用于丢弃重复或过期的事件
+    - offset: 本次文本的起始位置，应用方式为 text = text[:offset] + appended_text
+      绝大多数情况下offset等于已有文本的长度（纯追加）
+    - appended_text: 新增的文本
+    - version: 文本被整体替换（非追加）的次数，变化时消费者需要按offset重建文本
+    - finished: 流是否已结束
+    - usage: 提供商返回的用量（见ChatMessages.usage），未知时为None
+    """
+    def __init__(self, chunk_id=None, seq=0, offset=0, appended_text='', version=0, finished=False, usage=None):
+        super().__init__()
+        self.update({
+            'chunk_id': chunk_id,
+            'seq': seq,
+            'offset': offset,
+            'appended_text': appended_text,
+            'version': version,
+            'finished': finished,
+            'usage': usage,
+        })
+
+    @property
+    def chunk_id(self):
+        return self['chunk_id']
+
+    @property
+    def seq(self):
+        return self['seq']
+
+    @property
+    def offset(self):
+        return self['offset']
+
+    @property
+    def appended_text(self):
+        return self['appended_text']
+
+    @property
+    def version(self):
+        return self['version']
+
+    @property
+    def finished(self):
+        return self['finished']
+
+    @property
+    def usage(self):
+        return self['usage']
+
+class StreamDeltaTracker:
+    """
+    把流式输出的完整快照转换为StreamDelta
+    提供商适配器yield的是原地更新的ChatMessages（完整快照），增量从prompt层（baseprompt.main）开始产生
+    快照通常只在末尾追加，update(text, append_only=True)时只检查长度，复杂度为O(delta)；
+    不能保证只追加时（如解析后的文本）会与上一次的快照比较前缀，前缀改变时产生offset为0的替换事件
+    """
+    def __init__(self, chunk_id=None):
+        self.chunk_id = chunk_id
+        self.seq = 0
+        self.version = 0
+        self.text = ''
+        self.finished = False
+
+    def update(self, text, finished=False, usage=None, append_only=False):
+        """
+        Args:
+            text: 最新的完整文本
+            append_only: 调用方保证text是上一次text追加得到的
+        Returns:
+            StreamDelta，文本和状态都没有变化时返回None
+        """
+        prev = self.text
+        if (append_only and len(text) >= len(prev)) or text.startswith(prev):
+            offset = len(prev)
+        else:
+            offset = 0
+            self.version += 1
+
+        if offset == len(text) and offset == len(prev) and finished == self.finished:
+            return None
+
+        self.text = text
+        self.finished = finished
+        self.seq += 1
+        return StreamDelta(self.chunk_id, self.seq, offset, text[offset:], self.version, finished, usage)
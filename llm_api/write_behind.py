@@ -0,0 +1,150 @@
+import time
+import queue
+import atexit
+import threading
+
+from config import MONOGODB_DB_NAME, ENABLE_WRITE_BEHIND, WRITE_BEHIND_BATCH_SIZE, WRITE_BEHIND_FLUSH_INTERVAL, WRITE_BEHIND_MAX_QUEUE
+
+from .mongodb_init import mongo_client
+
+_STOP = object()
+
+
+class WriteBehindBuffer:
+    """
+    MongoDB写入的后台缓冲：调用方把文档放入有界队列后立即返回，
+    后台线程攒够batch_size条或等待flush_interval秒后按集合分组insert_many
+    队列满时submit会阻塞，直到后台线程腾出空间（限制内存占用）
+    进程退出时（atexit）会写完队列中剩余的文档
+    """
+    def __init__(self, client, db_name=MONOGODB_DB_NAME, batch_size=WRITE_BEHIND_BATCH_SIZE,
+                 flush_interval=WRITE_BEHIND_FLUSH_INTERVAL, max_queue=WRITE_BEHIND_MAX_QUEUE):
+        self.db = client[db_name]
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._closed = False
+        self._submitted = 0
+        self._written = 0
+        self._failed = 0
+        self._batches = 0
+        self._max_depth = 0
+        self._total_flush_seconds = 0.0
+        self._max_flush_seconds = 0.0
+        self._last_flush_seconds = 0.0
+        self._thread = threading.Thread(target=self._run, name='mongodb-write-behind', daemon=True)
+        self._thread.start()
+
+    def submit(self, collection_name, document):
+        if self._closed:
+            # 关闭后直接同步写入，避免丢失
+            self.db[collection_name].insert_one(document)
+            return
+        self._queue.put((collection_name, document))
+        with self._lock:
+            self._submitted += 1
+            self._max_depth = max(self._max_depth, self._queue.qsize())
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                self._queue.task_done()
+                return
+
+            batch = [item]
+            stop = False
+            deadline = time.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get(timeout=max(0, deadline - time.time()))
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+
+            try:
+                self._write(batch)
+            finally:
+                for _ in range(len(batch) + stop):
+                    self._queue.task_done()
+            if stop:
+                return
+
+    def _write(self, batch):
+        documents = {}
+        for collection_name, document in batch:
+            documents.setdefault(collection_name, []).append(document)
+
+        for collection_name, docs in documents.items():
+            start_time = time.time()
+            try:
+                self.db[collection_name].insert_many(docs, ordered=False)
+                written, failed = len(docs), 0
+            except Exception as e:
+                # 部分文档可能已写入（ordered=False），以数据库返回的结果为准
+                details = getattr(e, 'details', None)
+                written = details.get('nInserted', 0) if isinstance(details, dict) else 0
+                failed = len(docs) - written
+                print(f"⚠️ 批量写入{collection_name}失败({failed}/{len(docs)}条): {type(e).__name__}: {str(e)[:200]}")
+            flush_seconds = time.time() - start_time
+
+            with self._lock:
+                self._written += written
+                self._failed += failed
+                self._batches += 1
+                self._last_flush_seconds = flush_seconds
+                self._total_flush_seconds += flush_seconds
+                self._max_flush_seconds = max(self._max_flush_seconds, flush_seconds)
+
+    def flush(self):
+        """阻塞直到已提交的文档全部写入"""
+        self._queue.join()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'queue_depth': self._queue.qsize(),
+                'max_queue_depth': self._max_depth,
+                'max_queue': self._queue.maxsize,
+                'submitted': self._submitted,
+                'written': self._written,
+                'failed': self._failed,
+                'batches': self._batches,
+                'avg_batch_size': self._written / self._batches if self._batches else 0,
+                'last_flush_seconds': self._last_flush_seconds,
+                'avg_flush_seconds': self._total_flush_seconds / self._batches if self._batches else 0,
+                'max_flush_seconds': self._max_flush_seconds,
+            }
+
+
+write_behind = WriteBehindBuffer(mongo_client) if mongo_client is not None and ENABLE_WRITE_BEHIND else None
+if write_behind is not None:
+    atexit.register(write_behind.close)
+
+
+def insert_document(collection_name, document):
+    """写入MongoDB文档，开启write-behind时放入后台批量写入，否则同步写入"""
+    if write_behind is not None:
+        write_behind.submit(collection_name, document)
+    else:
+        mongo_client[MONOGODB_DB_NAME][collection_name].insert_one(document)
+
+
+def flush_writes():
+    if write_behind is not None:
+        write_behind.flush()
+
+
+def get_write_behind_stats():
+    return write_behind.stats() if write_behind is not None else None
@@ -1,5 +1,6 @@
 from zhipuai import ZhipuAI
 from .chat_messages import ChatMessages
+from .client_pool import client_pool, close_stream
 
 # Pricing
 # https://open.bigmodel.cn/pricing
@@ -49,10 +50,12 @@ def stream_chat_with_zhipuai(messages, model='glm-4-flash', response_json=False,
         print(f"❌ API Key Error: {error_msg}")
         raise Exception(error_msg)
     
+    # 相同api_key的请求共享同一个客户端及其keep-alive连接（客户端使用SDK默认的超时）
+    lease = client_pool.acquire('zhipuai', lambda: ZhipuAI(api_key=api_key), api_key=api_key)
+    response = None
     try:
-        print(f"✅ Creating ZhipuAI client...")
-        client = ZhipuAI(api_key=api_key)
-        print(f"✅ ZhipuAI client created successfully")
+        client = lease.client
+        print(f"✅ ZhipuAI client acquired from pool")
         
         request_params = {
             'model': model,
@@ -81,6 +84,9 @@ def stream_chat_with_zhipuai(messages, model='glm-4-flash', response_json=False,
         print(f"✅ API request initiated successfully in {time.time() - start_time:.2f}s, starting to stream response")
         
         messages.append({'role': 'assistant', 'content': ''})
+        # 增量过滤思考过程（处理 <think> </think> 等标签）
+        from prompts.prompt_utils import ThinkingProcessFilter
+        thinking_filter = ThinkingProcessFilter()
         chunk_count = 0
         first_chunk_time = None
         
@@ -93,15 +99,16 @@ def stream_chat_with_zhipuai(messages, model='glm-4-flash', response_json=False,
             if chunk_count <= 3:  # Log first few chunks for debugging
                 print(f"📦 Chunk #{chunk_count}: {str(chunk)[:200]}...")
             
-            messages[-1]['content'] += chunk.choices[0].delta.content or ''
-            
-            # 对内容进行思考过程过滤（处理 <think> </think> 等标签）
-            from prompts.prompt_utils import filter_thinking_process
-            filtered_content = filter_thinking_process(messages[-1]['content'])
-            messages[-1]['content'] = filtered_content
+            # 最后一个chunk包含本次请求的实际用量
+            messages.update_usage(getattr(chunk, 'usage', None))
+            thinking_filter.feed(chunk.choices[0].delta.content or '')
+            messages[-1]['content'] = thinking_filter.text
             
             yield messages
         
+        thinking_filter.finish()
+        messages[-1]['content'] = thinking_filter.text
+        
         total_time = time.time() - start_time
         print(f"✅ ZhipuAI API call completed successfully in {total_time:.2f}s, received {chunk_count} chunks")
         return messages
@@ -126,6 +133,10 @@ def stream_chat_with_zhipuai(messages, model='glm-4-flash', response_json=False,
         raise Exception(f"ZhipuAI API调用失败 - {type(e).__name__}: {str(e)}")
         
     finally:
+        # 提前结束（如客户端停止）时关闭流，使连接回到连接池
+        if response is not None:
+            close_stream(response)
+        lease.release()
         print(f"=== ZhipuAI API Call Finished ===\n")
 
 if __name__ == '__main__':
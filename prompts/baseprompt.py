@@ -1,16 +1,14 @@
 import os
 import re
 from prompts.chat_utils import chat, log
+from llm_api import StreamDeltaTracker
 from prompts.pf_parse_chat import parse_chat
 from prompts.prompt_utils import load_text, match_code_block
 
 def parser(response_msgs):
+    # stream_chat的各个适配器已经在流式输出时增量过滤了思考过程，这里不再对每个快照重复过滤
     content = response_msgs.response
     
-    # 过滤掉思考过程
-    from prompts.prompt_utils import filter_thinking_process
-    content = filter_thinking_process(content)
-    
     blocks = match_code_block(content)
     if blocks:
         concat_blocks = "\n".join(blocks)
@@ -106,9 +104,24 @@ def main(model, dirname, user_prompt_text, **kwargs):
     final_prompt = system_prompt + context_prompt + user_prompt
     
     # Chat and parse results
+    # 回复中出现代码块标记之前，parser的结果就是回复本身，不需要对每个快照重新解析
+    # ret['delta']为解析结果的增量（StreamDelta，没有变化时为None），消费者可以只处理新增的文本
+    tracker = StreamDeltaTracker()
+    has_code_block = False
+    checked_len = 0
     for response_msgs in chat(final_prompt, None, model, parse_chat=False):
-        text = parser(response_msgs)
-        ret = {'text': text, 'response_msgs': response_msgs}
+        response = response_msgs.response
+        if not has_code_block:
+            # 往前多检查两个字符，处理被拆分到多个token中的```
+            has_code_block = '```' in response[max(0, checked_len - 2):]
+            checked_len = len(response)
+        
+        if has_code_block:
+            text = parser(response_msgs)
+        else:
+            text = response
+        delta = tracker.update(text, finished=response_msgs.finished, usage=response_msgs.usage, append_only=not has_code_block)
+        ret = {'text': text, 'response_msgs': response_msgs, 'delta': delta}
         yield ret
 
     return ret
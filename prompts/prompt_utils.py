@@ -42,6 +42,105 @@ def filter_thinking_process(text):
     
     return text
 
+THINKING_TAGS = ('think', 'thinking', 'thought', 'reasoning')
+_OPEN_TAG_PATTERN = re.compile(r'<(' + '|'.join(THINKING_TAGS) + r')>', re.IGNORECASE)
+_OPEN_TAG_PREFIXES = {f'<{tag}>'[:i] for tag in THINKING_TAGS for i in range(1, len(tag) + 2)}
+_TOKEN_PATTERN = re.compile(r'(\s+)|(\S+)')
+
+class ThinkingProcessFilter:
+    """
+    filter_thinking_process的流式版本，逐段输入增量文本，每个字符只处理一次
+    - 在<think>/<thinking>/<thought>/<reasoning>标签内的内容不输出
+    - 可能是标签开头的末尾几个字符会暂存，等待后续文本确定
+    - 空白按filter_thinking_process的规则处理：去掉开头的空白，连续空行合并为一个，末尾空白暂不输出
+    标签正常嵌套时，finish()之后的text与filter_thinking_process(完整文本)的结果一致
+    """
+    def __init__(self):
+        self.text = ''          # 目前为止过滤后的完整文本
+        self._pending = ''      # 还未处理的文本（可能是不完整的标签）
+        self._inside = None     # 当前所在的标签名
+        self._hidden = []       # 当前标签内的原文，标签未闭合时在finish中还原
+        self._ws_run = ''       # 暂存的末尾空白
+        self._started = False   # 是否已经输出过非空白字符
+
+    def _normalize_ws(self, ws):
+        first, last = ws.find('\n'), ws.rfind('\n')
+        if first != last:
+            return ws[:first] + '\n\n' + ws[last + 1:]
+        return ws
+
+    def _emit(self, text):
+        out = []
+        for ws, word in _TOKEN_PATTERN.findall(text):
+            if ws:
+                self._ws_run += ws
+            else:
+                if self._started:
+                    out.append(self._normalize_ws(self._ws_run))
+                self._ws_run = ''
+                self._started = True
+                out.append(word)
+        return ''.join(out)
+
+    def _holdback(self, text, prefixes):
+        """返回text末尾可能是标签开头的部分的长度"""
+        start = text.rfind('<', max(0, len(text) - 13))
+        if start != -1 and text[start:].lower() in prefixes:
+            return len(text) - start
+        return 0
+
+    def feed(self, delta):
+        """输入增量文本，返回新增的可见文本"""
+        text = self._pending + delta
+        self._pending = ''
+        out = []
+        while text:
+            if self._inside is None:
+                match = _OPEN_TAG_PATTERN.search(text)
+                if match is None:
+                    keep = self._holdback(text, _OPEN_TAG_PREFIXES)
+                    out.append(self._emit(text[:len(text) - keep]))
+                    self._pending = text[len(text) - keep:]
+                    break
+                out.append(self._emit(text[:match.start()]))
+                self._inside = match.group(1).lower()
+                self._hidden = [match.group(0)]
+                text = text[match.end():]
+            else:
+                close_tag = f'</{self._inside}>'
+                end = text.lower().find(close_tag)
+                if end == -1:
+                    keep = self._holdback(text, {close_tag[:i] for i in range(1, len(close_tag))})
+                    self._hidden.append(text[:len(text) - keep])
+                    self._pending = text[len(text) - keep:]
+                    break
+                self._inside = None
+                self._hidden = []
+                text = text[end + len(close_tag):]
+
+        out = ''.join(out)
+        self.text += out
+        return out
+
+    def finish(self):
+        """输入结束，返回新增的可见文本"""
+        if self._inside is not None:
+            # 标签未闭合：与filter_thinking_process一样保留标签原文，标签之后的内容继续过滤
+            hidden = ''.join(self._hidden) + self._pending
+            match = _OPEN_TAG_PATTERN.match(hidden)
+            self._inside = None
+            self._hidden = []
+            self._pending = ''
+            out = self._emit(match.group(0))
+            self.text += out
+            return out + self.feed(hidden[match.end():]) + self.finish()
+
+        out = self._emit(self._pending)
+        self._pending = ''
+        self._ws_run = ''   # 末尾空白不输出，相当于strip
+        self.text += out
+        return out
+
 def match_first_json_block(response):
     # 首先过滤掉思考过程
     filtered_response = filter_thinking_process(response)
@@ -6,7 +6,14 @@ BACKEND_PORT=${BACKEND_PORT:-7869}
 BACKEND_HOST=${BACKEND_HOST:-0.0.0.0}
 WORKERS=${WORKERS:-4}
 THREADS=${THREADS:-2}
+# /write的生成会话（断线重连、停止生成）保存在创建它的worker进程内存中，
+# 重连请求到达其他worker时返回404，前端按断线处理。需要可靠的断线重连时设置WORKERS=1，
+# 并通过THREADS（sync）或SERVER_MODE=async提高单进程的并发
+if [ "$WORKERS" != "1" ]; then
+    echo "提示：WORKERS=$WORKERS，断线重连只在请求到达同一个worker进程时生效，需要时设置WORKERS=1"
+fi
 TIMEOUT=${TIMEOUT:-300}
+SERVER_MODE=${SERVER_MODE:-sync}
 
 # 在Linux环境下添加host.docker.internal解析
 # if ! grep -q "host.docker.internal" /etc/hosts; then
@@ -22,11 +29,22 @@ sed -i "s/host.docker.internal:7869/localhost:$BACKEND_PORT/g" /etc/nginx/conf.d
 nginx
 
 # 启动gunicorn
-gunicorn --bind $BACKEND_HOST:$BACKEND_PORT \
-    --workers $WORKERS \
-    --threads $THREADS \
-    --worker-class gthread \
-    --timeout $TIMEOUT \
-    --access-logfile - \
-    --error-logfile - \
-    app:app
\ No newline at end of file
+# SERVER_MODE=async时使用异步服务（backend/async_app.py），SSE连接不占用工作线程
+if [ "$SERVER_MODE" = "async" ]; then
+    gunicorn --bind $BACKEND_HOST:$BACKEND_PORT \
+        --workers $WORKERS \
+        --worker-class aiohttp.GunicornWebWorker \
+        --timeout $TIMEOUT \
+        --access-logfile - \
+        --error-logfile - \
+        async_app:create_app
+else
+    gunicorn --bind $BACKEND_HOST:$BACKEND_PORT \
+        --workers $WORKERS \
+        --threads $THREADS \
+        --worker-class gthread \
+        --timeout $TIMEOUT \
+        --access-logfile - \
+        --error-logfile - \
+        app:app
+fi
\ No newline at end of file
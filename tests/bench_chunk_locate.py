@@ -0,0 +1,59 @@
+import sys
+import os
+import time
+import random
+import string
+
+# Add the project root to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.writer import Writer, Chunk, StaleChunkError
+
+
+def make_pairs(num_pairs, seed=0):
+    """生成模拟的(剧情, 正文)pair"""
+    rng = random.Random(seed)
+    text = lambda n: ''.join(rng.choice(string.ascii_letters) for _ in range(n))
+    return [(text(rng.randint(20, 80)), text(rng.randint(100, 400))) for _ in range(num_pairs)]
+
+
+def without_ids(chunk):
+    """去掉pair id的chunk（如从前端状态恢复的chunk），只能按内容定位"""
+    return Chunk(**{**chunk, 'pair_ids': None, 'pair_id_space': None})
+
+
+def apply_one_by_one(writer, chunks, strip_ids):
+    """
+    模拟逐个接受修改：每个chunk写入后pair数量变化，后面chunk记录的位置都已失效
+    每个chunk的正文改为两个pair，保持剧情不变
+    """
+    start_time = time.perf_counter()
+    for chunk in chunks:
+        if strip_ids:
+            chunk = without_ids(chunk)
+        half = len(chunk.y_chunk) // 2
+        writer.apply_chunks([chunk], [chunk.edit(text_pairs=[(chunk.x_chunk, chunk.y_chunk[:half]), ('', chunk.y_chunk[half:])])])
+    return time.perf_counter() - start_time
+
+
+if __name__ == '__main__':
+    # 已被替换的chunk报错
+    writer = Writer(make_pairs(200), x_chunk_length=500, y_chunk_length=1000)
+    chunks = writer.get_chunks()
+    writer.apply_chunks([chunks[0]], [chunks[0].edit(y_chunk='新的正文')])
+    try:
+        writer.get_chunk_pair_span(chunks[0])
+        raise AssertionError('已被替换的chunk应当报错')
+    except StaleChunkError:
+        pass
+
+    print(f"{'pairs':>8} {'chunks':>7} {'by content (s)':>15} {'by pair id (s)':>15} {'us/chunk':>9}")
+    for num_pairs in [2_000, 8_000, 32_000]:
+        pairs = make_pairs(num_pairs)
+        results = []
+        for strip_ids in [True, False]:
+            writer = Writer(list(pairs), x_chunk_length=500, y_chunk_length=1000)
+            chunks = writer.get_chunks(context_length_ratio=0)
+            results.append((apply_one_by_one(writer, chunks, strip_ids), list(writer.xy_pairs)))
+        assert results[0][1] == results[1][1], '两种定位方式的结果不一致'
+        print(f"{num_pairs:>8} {len(chunks):>7} {results[0][0]:>15.3f} {results[1][0]:>15.3f} {results[1][0] / len(chunks) * 1e6:>9.1f}")
@@ -0,0 +1,92 @@
+import sys
+import os
+import time
+import random
+
+# Add the project root to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.writer import Writer
+
+
+def make_pairs(num_pairs, seed=0):
+    """生成模拟的(剧情, 正文)pair，部分pair的剧情为空"""
+    rng = random.Random(seed)
+    return [('剧' * rng.choice([0, rng.randint(20, 80)]), '文' * rng.randint(100, 400)) for _ in range(num_pairs)]
+
+
+def get_chunks_by_get_chunk(writer, pair_span=None, chunk_length_ratio=1, context_length_ratio=1, offset_ratio=0):
+    """原来的做法：每个chunk调用两次get_chunk（各自对齐span和context），并重新统计起点的长度"""
+    pair_span = pair_span or (0, len(writer.xy_pairs))
+    chunk_length = writer.x_chunk_length * chunk_length_ratio, writer.y_chunk_length * chunk_length_ratio
+    context_length = writer.x_chunk_length//2 * context_length_ratio, writer.y_chunk_length//2 * context_length_ratio
+    if 0 < offset_ratio < 1:
+        offset_ratio = int(chunk_length[0] * offset_ratio), int(chunk_length[1] * offset_ratio)
+
+    chunks = []
+    start = pair_span[0]
+    cstart = writer.count_span_length((0, start))
+    max_cend = writer.count_span_length((0, pair_span[1]))
+    while start < pair_span[1]:
+        if offset_ratio != 0:
+            cend = cstart[0] + offset_ratio[0], cstart[1] + offset_ratio[1]
+            offset_ratio = 0
+        else:
+            cend = cstart[0] + int(chunk_length[0] * 0.8), cstart[1] + int(chunk_length[1] * 0.8)
+        cend = min(cend[0], max_cend[0]), min(cend[1], max_cend[1])
+
+        x_len, y_len = cend[0] - cstart[0], cend[1] - cstart[1]
+        if x_len > 0:
+            chunk1 = writer.get_chunk(x_span=(cstart[0], cend[0]), context_length=context_length[0])
+        if y_len > 0:
+            chunk2 = writer.get_chunk(y_span=(cstart[1], cend[1]), context_length=context_length[1])
+        if x_len > 0 and y_len == 0:
+            chunk = chunk1
+        elif x_len == 0 and y_len > 0:
+            chunk = chunk2
+        elif x_len > 0 and y_len > 0:
+            chunk = chunk1 if chunk1.source_slice.stop - chunk1.source_slice.start < chunk2.source_slice.stop - chunk2.source_slice.start else chunk2
+        else:
+            raise ValueError("Both x_span and y_span have zero length")
+
+        chunks.append(chunk)
+        start = chunk.text_source_slice.stop
+        cstart = writer.count_span_length((0, start))
+    return chunks
+
+
+def chunk_loads(writer, chunks):
+    """每个chunk的负载：max(x长度 / x_chunk_length, y长度 / y_chunk_length)，大于1说明超过了chunk长度"""
+    return [max(chunk.x_chunk_len / writer.x_chunk_length, chunk.y_chunk_len / writer.y_chunk_length) for chunk in chunks]
+
+
+def bench(func, writer, **kwargs):
+    start = time.perf_counter()
+    chunks = func(writer, **kwargs)
+    return time.perf_counter() - start, chunks
+
+
+if __name__ == '__main__':
+    # 检查不同参数下与逐个get_chunk的结果一致
+    writer = Writer(make_pairs(500, seed=1), x_chunk_length=500, y_chunk_length=1000)
+    for kwargs in [{}, {'context_length_ratio': 0}, {'offset_ratio': 0.5}, {'pair_span': (37, 420)}, {'chunk_length_ratio': 0.3}]:
+        assert Writer.get_chunks(writer, **kwargs) == get_chunks_by_get_chunk(writer, **kwargs), f'get_chunks结果不一致: {kwargs}'
+
+    print(f"{'pairs':>8} {'chars':>10} {'chunks':>7} {'get_chunk loop (s)':>19} {'get_chunks (s)':>15} {'us/pair':>8}")
+    for num_pairs in [2_000, 4_000, 8_000, 16_000, 32_000]:
+        writer = Writer(make_pairs(num_pairs), x_chunk_length=500, y_chunk_length=1000)
+        chars = writer.x_len + writer.y_len
+        loop_time, loop_chunks = bench(get_chunks_by_get_chunk, writer)
+        plan_time, plan_chunks = bench(Writer.get_chunks, writer)
+        assert plan_chunks == loop_chunks, 'get_chunks结果不一致'
+        print(f"{num_pairs:>8} {chars:>10} {len(plan_chunks):>7} {loop_time:>19.3f} {plan_time:>15.3f} {plan_time / num_pairs * 1e6:>8.2f}")
+
+    # 两种划分方式的对比：调用次数、预计输入tokens、chunk负载的范围和超过chunk长度的chunk数
+    print()
+    print(f"{'pairs':>8} {'mode':>9} {'calls':>6} {'input tokens':>13} {'min load':>9} {'max load':>9} {'over limit':>11} {'plan (s)':>9}")
+    for num_pairs in [30, 200, 2_000, 16_000]:
+        writer = Writer(make_pairs(num_pairs), x_chunk_length=500, y_chunk_length=1000)
+        for mode in ['greedy', 'balanced']:
+            plan_time, plan = bench(Writer.get_chunks, writer, mode=mode)
+            loads = chunk_loads(writer, plan)
+            print(f"{num_pairs:>8} {mode:>9} {plan.calls:>6} {plan.input_tokens:>13} {min(loads):>9.2f} {max(loads):>9.2f} {sum(load > 1 for load in loads):>11} {plan_time:>9.3f}")
@@ -0,0 +1,78 @@
+import sys
+import os
+import time
+import random
+
+# Add the project root to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.pair_index import PairLengthIndex
+from core.pair_rope import PairRope
+
+
+def make_pairs(num_pairs, seed=0):
+    """生成模拟的(剧情, 正文)pair"""
+    rng = random.Random(seed)
+    return [('剧' * rng.randint(20, 80), '文' * rng.randint(100, 400)) for _ in range(num_pairs)]
+
+
+def make_edits(num_pairs, num_edits, seed=0):
+    """模拟apply_chunks：在随机位置把几个pair替换为数量不同的新pair，并查询一次长度"""
+    rng = random.Random(seed)
+    edits = []
+    for _ in range(num_edits):
+        start = rng.randrange(num_pairs - 8)
+        end = start + rng.randint(1, 8)
+        edits.append((start, end, make_pairs(rng.randint(1, 8), seed=rng.random())))
+    return edits
+
+
+def bench_list(pairs, edits):
+    """list存储：切片赋值 + PairLengthIndex同步（pair数量变化后下次查询时重建）"""
+    pairs = list(pairs)
+    index = PairLengthIndex(pairs)
+    start_time = time.perf_counter()
+    for start, end, new_pairs in edits:
+        pairs[start:end] = new_pairs
+        index.splice(start, end, new_pairs)
+        index.span_length((start, len(pairs)))
+    return time.perf_counter() - start_time
+
+
+def bench_rope(pairs, edits):
+    rope = PairRope(pairs)
+    start_time = time.perf_counter()
+    for start, end, new_pairs in edits:
+        rope[start:end] = new_pairs
+        rope.span_length((start, len(rope)))
+    return time.perf_counter() - start_time
+
+
+def bench_snapshot(storage, repeat=20):
+    """快照（如call_write中保存写作前的pair用于diff）"""
+    start_time = time.perf_counter()
+    for _ in range(repeat):
+        storage.copy()
+    return (time.perf_counter() - start_time) / repeat
+
+
+if __name__ == '__main__':
+    # 检查与list的结果一致
+    pairs = make_pairs(2_000, seed=1)
+    rope = PairRope(pairs)
+    for start, end, new_pairs in make_edits(len(pairs), 200, seed=1):
+        pairs[start:end] = new_pairs
+        rope[start:end] = new_pairs
+    assert list(rope) == pairs, 'PairRope与list的结果不一致'
+    assert rope.text(1) == ''.join(pair[1] for pair in pairs), 'PairRope的文本与list不一致'
+
+    num_edits = 200
+    print(f"{'pairs':>8} {'list edits (ms)':>16} {'rope edits (ms)':>16} {'list copy (ms)':>15} {'rope copy (us)':>15}")
+    for num_pairs in [10_000, 40_000, 160_000]:
+        pairs = make_pairs(num_pairs)
+        edits = make_edits(num_pairs, num_edits)
+        list_time = bench_list(pairs, edits)
+        rope_time = bench_rope(pairs, edits)
+        list_copy = bench_snapshot(pairs)
+        rope_copy = bench_snapshot(PairRope(pairs))
+        print(f"{num_pairs:>8} {list_time * 1e3:>16.1f} {rope_time * 1e3:>16.1f} {list_copy * 1e3:>15.3f} {rope_copy * 1e6:>15.2f}")
@@ -0,0 +1,127 @@
+"""
+/write并发SSE流的压测：比较线程模式的Flask服务（app.run）和异步服务（async_app）
+LLM调用用sleep模拟，两种模式下生成过程都在后台线程中运行，区别在于SSE连接是否各占用一个线程
+用法：python tests/bench_sse_concurrency.py [并发数,...]
+"""
+import sys
+import os
+import time
+import asyncio
+import subprocess
+
+# Add the project root and backend to the Python path
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+sys.path.append(os.path.join(ROOT_DIR, 'backend'))
+
+EVENTS = 20          # 每个流的事件数
+INTERVAL = 0.1       # 模拟上游LLM两次输出之间的等待（秒）
+PORTS = {'flask': 17101, 'async': 17102}
+
+WRITE_BODY = {
+    'writer_mode': 'draft', 'chunk_list': [['', '他推开门，走进了雨里。', '']], 'chunk_span': [0, 1],
+    'prompt_content': '', 'x_chunk_length': 500, 'y_chunk_length': 1000,
+    'main_model': 'bench/bench', 'sub_model': 'bench/bench', 'global_context': '',
+    'only_prompt': False, 'settings': {'MAX_THREAD_NUM': 1},
+}
+
+
+def fake_call_write(*args, **kwargs):
+    text = ''
+    for i in range(EVENTS):
+        time.sleep(INTERVAL)
+        text += '雨越下越大。'
+        yield {'chunk_rows': [((0, 0), ['', '他推开门，走进了雨里。', text])], 'changed': [(0, 0)], 'done': i == EVENTS - 1, 'msg': '正在创作...'}
+
+
+def serve(mode, port):
+    """在子进程中启动服务，call_write替换为模拟的生成过程"""
+    import app as backend_app
+    backend_app.call_write = fake_call_write
+    if mode == 'flask':
+        from werkzeug.serving import make_server
+        make_server('127.0.0.1', port, backend_app.app, threaded=True).serve_forever()
+    else:
+        from aiohttp import web
+        import async_app
+        web.run_app(async_app.create_app(), host='127.0.0.1', port=port, print=None, access_log=None)
+
+
+def read_proc_status(pid):
+    """返回进程的(线程数, 常驻内存MB)"""
+    threads, rss = 0, 0
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith('Threads:'):
+                threads = int(line.split()[1])
+            elif line.startswith('VmRSS:'):
+                rss = int(line.split()[1]) / 1024
+    return threads, rss
+
+
+async def run_stream(session, url, stats):
+    start = time.perf_counter()
+    first_event = None
+    events = 0
+    async with session.post(url, json=WRITE_BODY) as response:
+        async for line in response.content:
+            if line.startswith(b'data: '):
+                events += 1
+                if first_event is None:
+                    first_event = time.perf_counter() - start
+    stats.append((first_event, time.perf_counter() - start, events))
+
+
+async def load_test(mode, streams):
+    import aiohttp
+
+    port = PORTS[mode]
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), 'serve', mode, str(port)],
+                               cwd=os.path.join(ROOT_DIR, 'backend'), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0), timeout=aiohttp.ClientTimeout(total=600)) as session:
+            for _ in range(200):
+                try:
+                    async with session.get(f'http://127.0.0.1:{port}/health') as response:
+                        if response.status == 200:
+                            break
+                except aiohttp.ClientError:
+                    await asyncio.sleep(0.1)
+
+            peak = [0, 0]
+
+            async def sample():
+                while True:
+                    threads, rss = read_proc_status(process.pid)
+                    peak[0], peak[1] = max(peak[0], threads), max(peak[1], rss)
+                    await asyncio.sleep(0.05)
+
+            stats = []
+            sampler = asyncio.create_task(sample())
+            start = time.perf_counter()
+            results = await asyncio.gather(*[run_stream(session, f'http://127.0.0.1:{port}/write', stats) for _ in range(streams)], return_exceptions=True)
+            elapsed = time.perf_counter() - start
+            sampler.cancel()
+    finally:
+        process.terminate()
+        process.wait()
+
+    errors = sum(isinstance(result, Exception) for result in results)
+    complete = sum(events == EVENTS + 1 for _, _, events in stats)
+    first_events = sorted(first for first, _, _ in stats if first is not None)
+    p99 = first_events[int(len(first_events) * 0.99) - 1] if first_events else float('nan')
+    return elapsed, complete, errors, p99, peak[0], peak[1]
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'serve':
+        serve(sys.argv[2], int(sys.argv[3]))
+        sys.exit(0)
+
+    levels = [int(e) for e in sys.argv[1].split(',')] if len(sys.argv) > 1 else [50, 200, 500]
+    print(f"每个流{EVENTS}个事件，间隔{INTERVAL}s（单个流理想耗时{EVENTS * INTERVAL:.1f}s）")
+    print(f"{'mode':>6} {'streams':>8} {'complete':>9} {'errors':>7} {'wall (s)':>9} {'p99 first event (s)':>20} {'peak threads':>13} {'peak RSS (MB)':>14}")
+    for streams in levels:
+        for mode in PORTS:
+            elapsed, complete, errors, p99, threads, rss = asyncio.run(load_test(mode, streams))
+            print(f"{mode:>6} {streams:>8} {complete:>9} {errors:>7} {elapsed:>9.2f} {p99:>20.3f} {threads:>13} {rss:>14.1f}")
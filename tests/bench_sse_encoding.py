@@ -0,0 +1,77 @@
+import sys
+import os
+import json
+import time
+import random
+import zlib
+
+# Add the project root and backend to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from response_encoder import StreamCompressor, dumps, USE_ORJSON
+
+
+def make_draft(length, seed=0):
+    """生成模拟的中文正文"""
+    rng = random.Random(seed)
+    parts = []
+    size = 0
+    while size < length:
+        parts.append(rng.choice(['他推开门，走进了雨里。', '“你来了。”她说。', '\n', '远处传来钟声，街上的灯一盏盏亮起。', '林远没有回答。']))
+        size += len(parts[-1])
+    return ''.join(parts)[:length]
+
+
+def make_frames(draft, chunk_length=500, delta_size=8):
+    """
+    模拟/write的一次生成：首帧为完整chunk列表（reset），之后每个token一帧append操作
+    """
+    chunks = [draft[i:i + chunk_length] for i in range(0, len(draft), chunk_length)]
+    rows = [['', chunk, ''] for chunk in chunks]
+    frames = [{'chunk_type': 'ops', 'ops': [{'op': 'reset', 'ids': list(range(len(rows))), 'rows': rows}], 'done': False, 'msg': '正在创作...', 'seq': 1}]
+    for seq, i in enumerate(range(0, chunk_length * 4, delta_size), start=2):
+        frames.append({'chunk_type': 'ops', 'ops': [{'op': 'append', 'id': i // chunk_length, 'field': 2, 'text': draft[i:i + delta_size]}], 'done': False, 'msg': '正在创作...', 'seq': seq})
+    return frames
+
+
+ENCODERS = {
+    'json ascii': lambda obj: json.dumps(obj).encode('utf-8'),
+    'json utf-8': lambda obj: json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8'),
+    'dumps': dumps,
+}
+
+
+def bench_encoder(encode, frames, repeat=5):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        encoded = [b"data: " + encode(frame) + b"\n\n" for frame in frames]
+    return (time.perf_counter() - start) / repeat, encoded
+
+
+def gzip_stream(encoded):
+    """按帧Z_SYNC_FLUSH压缩，返回首帧和之后每帧的平均字节数"""
+    compressor = StreamCompressor('gzip')
+    sizes = [len(compressor.compress(frame)) for frame in encoded]
+    sizes[-1] += len(compressor.finish())
+    return sizes[0], sum(sizes[1:]) / max(len(sizes) - 1, 1)
+
+
+def check_gzip_stream(encoded):
+    compressor = StreamCompressor('gzip')
+    data = b''.join(compressor.compress(frame) for frame in encoded) + compressor.finish()
+    return zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(data) == b''.join(encoded)
+
+
+if __name__ == '__main__':
+    draft = make_draft(100_000)
+    frames = make_frames(draft)
+    print(f"orjson: {'enabled' if USE_ORJSON else 'disabled'}, frames: {len(frames)}")
+    print(f"{'encoder':>12} {'reset frame (B)':>16} {'append frame (B)':>17} {'gzip reset (B)':>15} {'gzip append (B)':>16} {'encode (ms)':>12}")
+    for name, encode in ENCODERS.items():
+        elapsed, encoded = bench_encoder(encode, frames)
+        assert json.loads(encoded[0][len(b"data: "):]) == frames[0], f'{name}编码结果不一致'
+        assert check_gzip_stream(encoded), 'gzip流解压结果不一致'
+        append_size = sum(len(frame) for frame in encoded[1:]) / (len(encoded) - 1)
+        gzip_reset, gzip_append = gzip_stream(encoded)
+        print(f"{name:>12} {len(encoded[0]):>16} {append_size:>17.1f} {gzip_reset:>15} {gzip_append:>16.1f} {elapsed * 1000:>12.2f}")
@@ -0,0 +1,58 @@
+import sys
+import os
+import time
+import random
+
+# Add the project root to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from prompts.prompt_utils import filter_thinking_process, ThinkingProcessFilter
+
+
+def make_response(length, seed=0):
+    """生成带有思考标签的模拟推理模型输出，约一半内容在<think>标签内"""
+    rng = random.Random(seed)
+    parts = ['<think>']
+    size = len(parts[0])
+    while size < length // 2:
+        parts.append(rng.choice(['让我想一想这个问题。', 'First, consider the plot.\n', '\n\n', '人物动机需要更清楚。']))
+        size += len(parts[-1])
+    parts.append('</think>\n\n')
+    while size < length:
+        parts.append(rng.choice(['他推开门，走进了雨里。', '\n', '“你来了。”她说。', ' ']))
+        size += len(parts[-1])
+    return ''.join(parts)[:length]
+
+
+def split_deltas(text, delta_size=4):
+    return [text[i:i + delta_size] for i in range(0, len(text), delta_size)]
+
+
+def bench_full_refilter(deltas):
+    """原来的做法：每收到一段增量，对累计的全文重新过滤"""
+    content = ''
+    start = time.perf_counter()
+    for delta in deltas:
+        content += delta
+        filtered = filter_thinking_process(content)
+    return time.perf_counter() - start, filtered
+
+
+def bench_streaming(deltas):
+    start = time.perf_counter()
+    thinking_filter = ThinkingProcessFilter()
+    for delta in deltas:
+        thinking_filter.feed(delta)
+    thinking_filter.finish()
+    return time.perf_counter() - start, thinking_filter.text
+
+
+if __name__ == '__main__':
+    print(f"{'chars':>8} {'deltas':>8} {'full re-filter (s)':>20} {'streaming (s)':>15} {'speedup':>10}")
+    for length in [6_250, 12_500, 25_000, 50_000]:
+        text = make_response(length)
+        deltas = split_deltas(text)
+        full_time, full_result = bench_full_refilter(deltas)
+        stream_time, stream_result = bench_streaming(deltas)
+        assert full_result == stream_result, '流式过滤结果与filter_thinking_process不一致'
+        print(f"{length:>8} {len(deltas):>8} {full_time:>20.4f} {stream_time:>15.4f} {full_time / stream_time:>9.1f}x")
@@ -0,0 +1,98 @@
+import sys
+import os
+import json
+import asyncio
+
+# Add the project root to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from aiohttp.test_utils import TestServer, TestClient
+
+import async_app
+from async_app import iterate_in_thread
+from write_stream import create_write_session
+
+
+def run_with_client(test):
+    """启动异步应用，用test(client)发送请求"""
+    async def main():
+        client = TestClient(TestServer(await async_app.create_app()))
+        await client.start_server()
+        try:
+            return await test(client)
+        finally:
+            await client.close()
+    return asyncio.run(main())
+
+
+def sse_payloads(body):
+    return [json.loads(line[len('data: '):]) for line in body.decode('utf-8').split('\n') if line.startswith('data: ')]
+
+
+def test_iterate_in_thread():
+    closed = []
+
+    def numbers():
+        try:
+            yield 1
+            yield 2
+            raise RuntimeError('upstream failed')
+        finally:
+            closed.append(True)
+
+    async def consume():
+        items = []
+        try:
+            async for item in iterate_in_thread(numbers()):
+                items.append(item)
+        except RuntimeError as e:
+            return items, str(e)
+
+    # 同步生成器中的异常在事件循环中重新抛出，生成器被关闭
+    assert asyncio.run(consume()) == ([1, 2], 'upstream failed')
+    assert closed == [True]
+
+
+def test_resume_write_replays_after_last_event_id():
+    session = create_write_session('test-resume')
+    for i in range(3):
+        session.publish({'msg': f'第{i}步', 'done': i == 2})
+    session.close()
+
+    async def test(client):
+        response = await client.get('/write/test-resume', headers={'Last-Event-ID': '1'})
+        assert response.status == 200
+        assert response.headers['Content-Type'] == 'text/event-stream'
+        return sse_payloads(await response.read())
+
+    # 补发Last-Event-ID之后的事件，会话已结束时连接随之结束
+    payloads = run_with_client(test)
+    assert [payload['seq'] for payload in payloads] == [2, 3]
+    assert payloads[-1]['done'] is True
+
+
+def test_unknown_stream_and_invalid_summary():
+    async def test(client):
+        missing = await client.get('/write/no-such-stream')
+        invalid = await client.post('/summary', json={
+            'content': '正文',
+            'novel_name': 'test',
+            'main_model': 'm',
+            'sub_model': 'm',
+            'settings': {'MAX_THREAD_NUM': 1, 'MAX_NOVEL_SUMMARY_LENGTH': 100, 'CACHE_REPLAY_MODE': 'fast'},
+        })
+        return missing.status, invalid.status, await invalid.json()
+
+    missing_status, invalid_status, error = run_with_client(test)
+    assert missing_status == 404
+    assert invalid_status == 400 and 'fast' in error['error']
+
+
+def test_other_routes_fall_back_to_flask():
+    async def test(client):
+        response = await client.get('/health')
+        return response.status, await response.json()
+
+    status, body = run_with_client(test)
+    assert status == 200 and body['status'] == 'healthy'
@@ -0,0 +1,125 @@
+import sys
+import os
+import json
+import threading
+
+# Add the project root to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm_api import cache_backend as cache_backend_module
+from llm_api.cache_backend import SQLiteCacheBackend
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+def make_entry(text):
+    return {
+        'return_value': [{'role': 'user', 'content': 'q'}, {'role': 'assistant', 'content': text}],
+        'yields': [{'index': len(text), 'delay': 0.1}],
+        'usage': None,
+        'args': ({'api_key': 'secret'},),
+    }
+
+
+def entry_size(text):
+    """SQLite中保存的条目大小（只保存回放需要的字段）"""
+    entry = make_entry(text)
+    del entry['args']
+    return len(json.dumps(entry, ensure_ascii=False).encode('utf-8'))
+
+
+def test_put_get_without_credentials(tmp_path):
+    backend = SQLiteCacheBackend(path=str(tmp_path / 'cache.db'), max_bytes=0, ttl=0)
+    backend.put('a', make_entry('回答'))
+    entry = backend.lookup('a')
+    assert entry['return_value'][-1]['content'] == '回答'
+    assert entry['yields'] == [{'index': 2, 'delay': 0.1}]
+    # 不保存包含api_key的调用参数
+    assert 'args' not in entry
+    assert backend.lookup('missing') is None
+    stats = backend.stats()
+    assert (stats['hits'], stats['misses'], stats['entries']) == (1, 1, 1)
+    backend.close()
+
+
+def test_lru_eviction_by_accessed_at(tmp_path, monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(cache_backend_module, 'time', clock)
+    size = entry_size('x' * 100)
+    backend = SQLiteCacheBackend(path=str(tmp_path / 'cache.db'), max_bytes=size * 3, ttl=0)
+    for key in ['a', 'b', 'c']:
+        clock.now += 1
+        backend.put(key, make_entry('x' * 100))
+
+    # 读取a更新其访问时间，之后最久未访问的是b
+    clock.now += 1
+    assert backend.get('a') is not None
+    clock.now += 1
+    backend.put('d', make_entry('x' * 100))
+    assert backend.get('b') is None
+    assert all(backend.get(key) is not None for key in ['a', 'c', 'd'])
+    stats = backend.stats()
+    assert stats['evictions'] == 1 and stats['bytes'] <= size * 3
+
+    # 单个条目超过上限时不写入
+    backend.put('huge', make_entry('x' * size * 3))
+    assert backend.get('huge') is None
+    backend.close()
+
+
+def test_ttl_expiry(tmp_path, monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(cache_backend_module, 'time', clock)
+    backend = SQLiteCacheBackend(path=str(tmp_path / 'cache.db'), max_bytes=0, ttl=60)
+    backend.put('old', make_entry('old'))
+    clock.now += 30
+    backend.put('new', make_entry('new'))
+    # 读取不延长有效期，过期按写入时间计算
+    assert backend.get('old') is not None
+
+    clock.now += 31
+    assert backend.get('old') is None
+    assert backend.get('new') is not None
+    clock.now += 30
+    # 写入时顺带清理过期的条目
+    backend.put('newest', make_entry('newest'))
+    stats = backend.stats()
+    assert stats['entries'] == 1 and stats['expirations'] == 2
+    backend.close()
+
+
+def test_concurrent_get_put_use_thread_local_connections(tmp_path):
+    backend = SQLiteCacheBackend(path=str(tmp_path / 'cache.db'), max_bytes=entry_size('x' * 50) * 20, ttl=0)
+    connections = set()
+    errors = []
+    barrier = threading.Barrier(8)
+
+    def worker(n):
+        try:
+            connections.add(id(backend._get_conn()))
+            barrier.wait(5)
+            for i in range(50):
+                key = f'{n}-{i % 25}'
+                backend.put(key, make_entry('x' * 50))
+                entry = backend.get(key)
+                # 其他线程的写入可能已把它淘汰，读到的内容必须完整
+                assert entry is None or entry['return_value'][-1]['content'] == 'x' * 50
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(30)
+    assert errors == []
+    # 每个线程使用独立的连接
+    assert len(connections) == 8
+    stats = backend.stats()
+    assert 0 < stats['entries'] <= 20 and stats['bytes'] <= backend.max_bytes
@@ -0,0 +1,92 @@
+import sys
+import os
+
+# Add the project root to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm_api import migrate_cache_keys as migrate_module
+from llm_api.mongodb_cache import create_cache_key, normalize_base_url, CACHE_KEY_VERSION
+
+
+MESSAGES = [{'role': 'system', 'content': '你是作家'}, {'role': 'user', 'content': '写一段开头'}]
+CONFIG = {'model': 'gpt-4o', 'base_url': 'https://api.openai.com/v1', 'api_key': 'key-a', 'max_tokens': 4096, 'system_prompt': ''}
+
+
+def test_normalize_base_url():
+    assert normalize_base_url('HTTPS://API.OpenAI.com:443/v1/') == 'https://api.openai.com/v1'
+    assert normalize_base_url(' http://localhost:80/v1 ') == 'http://localhost/v1'
+    # 非默认端口区分不同的本地服务
+    assert normalize_base_url('http://127.0.0.1:1234/v1') == 'http://127.0.0.1:1234/v1'
+    assert normalize_base_url(None) == normalize_base_url('') == ''
+
+
+def test_cache_key_canonicalization():
+    key = create_cache_key(CONFIG, MESSAGES)
+    # 与凭据、超时、等价的base_url写法、消息中的多余字段和换行符写法无关
+    assert create_cache_key({**CONFIG, 'api_key': 'key-b', 'timeout': 30}, MESSAGES) == key
+    assert create_cache_key({**CONFIG, 'base_url': 'https://API.openai.com/v1/'}, MESSAGES) == key
+    assert create_cache_key(CONFIG, [{**m, 'name': 'x'} for m in MESSAGES]) == key
+    assert create_cache_key(CONFIG, [{**m, 'content': m['content'].replace('\n', '\r\n')} for m in MESSAGES]) == key
+    assert create_cache_key(dict(reversed(list(CONFIG.items()))), MESSAGES) == key
+
+    # ModelConfig的system_prompt按prepare_chat的规则合并
+    merged = [{'role': 'system', 'content': '规则\n\n你是作家'}, MESSAGES[1]]
+    assert create_cache_key({**CONFIG, 'system_prompt': '规则'}, MESSAGES) == create_cache_key(CONFIG, merged)
+    assert create_cache_key({**CONFIG, 'system_prompt': '  '}, MESSAGES) == key
+
+    # 影响生成结果的差异使用不同的键
+    different = [
+        create_cache_key({**CONFIG, 'base_url': 'http://localhost:1234/v1'}, MESSAGES),
+        create_cache_key({**CONFIG, 'model': 'gpt-4o-mini'}, MESSAGES),
+        create_cache_key({**CONFIG, 'temperature': 0.2}, MESSAGES),
+        create_cache_key({**CONFIG, 'max_tokens': 100}, MESSAGES),
+        create_cache_key(CONFIG, MESSAGES, response_json=True),
+        create_cache_key(CONFIG, [MESSAGES[0], {'role': 'user', 'content': '写一段开头 '}]),
+    ]
+    assert len(set(different + [key])) == len(different) + 1
+
+
+def test_cache_key_provider_endpoint():
+    doubao = {'model': 'doubao-pro-32k', 'api_key': 'k', 'max_tokens': 4096, 'endpoint_id': 'ep-1'}
+    assert create_cache_key(doubao, MESSAGES) != create_cache_key({**doubao, 'endpoint_id': 'ep-2'}, MESSAGES)
+    assert create_cache_key(doubao, MESSAGES) == create_cache_key({**doubao, 'api_key': 'k2'}, MESSAGES)
+
+
+class FakeCollection:
+    def __init__(self, docs):
+        self.docs = docs
+        self.operations = []
+        self.indexes = []
+
+    def find(self, query, projection):
+        assert query == {'key_version': {'$ne': CACHE_KEY_VERSION}}
+        return iter(self.docs)
+
+    def bulk_write(self, operations, ordered=True):
+        self.operations.extend(operations)
+
+    def create_index(self, name):
+        self.indexes.append(name)
+
+
+def test_migrate_cache_keys(monkeypatch):
+    docs = [
+        {'_id': 1, 'args': [CONFIG, MESSAGES], 'kwargs': {}, 'cache_key': 'old-1'},
+        {'_id': 2, 'args': [{**CONFIG, 'api_key': 'key-b'}, MESSAGES], 'kwargs': {'response_json': True}, 'cache_key': 'old-2', 'legacy_cache_key': 'oldest-2'},
+        {'_id': 3, 'args': [], 'cache_key': 'broken'},
+    ]
+    collection = FakeCollection(docs)
+    monkeypatch.setattr(migrate_module, 'mongo_client', {migrate_module.MONOGODB_DB_NAME: {'stream_chat': collection}})
+
+    # dry run只统计，不写入
+    assert migrate_module.migrate_cache_keys(dry_run=True) == (2, 1)
+    assert collection.operations == [] and collection.indexes == []
+
+    assert migrate_module.migrate_cache_keys(batch_size=1) == (2, 1)
+    updates = {op._filter['_id']: op._doc['$set'] for op in collection.operations}
+    assert updates == {
+        1: {'cache_key': create_cache_key(CONFIG, MESSAGES), 'legacy_cache_key': 'old-1', 'key_version': CACHE_KEY_VERSION},
+        # 已迁移过的记录保留最早的键
+        2: {'cache_key': create_cache_key(CONFIG, MESSAGES, response_json=True), 'legacy_cache_key': 'oldest-2', 'key_version': CACHE_KEY_VERSION},
+    }
+    assert collection.indexes == ['cache_key']
@@ -0,0 +1,137 @@
+import sys
+import os
+import importlib
+
+# Add the project root to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+import config
+from llm_api import mongodb_cache
+
+
+class FakeClock:
+    def __init__(self):
+        self.sleeps = []
+
+    def time(self):
+        return 0
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+
+
+class FakeBackend:
+    def __init__(self, cached_data):
+        self.cached_data = cached_data
+        self.lookups = 0
+
+    def lookup(self, cache_key):
+        self.lookups += 1
+        return self.cached_data
+
+
+CACHED = {
+    'return_value': [{'role': 'user', 'content': '续写'}, {'role': 'assistant', 'content': 'abcdefgh'}],
+    'yields': [
+        {'index': 2, 'delay': 1.0},
+        {'index': 4, 'delay': 0},
+        {'index': 6, 'delay': 20},
+        {'index': 8, 'delay': 0.5},
+    ],
+    'usage': {'prompt_tokens': 10, 'completion_tokens': 4, 'cached_tokens': 0},
+}
+MODEL_CONFIG = {'model': 'gpt-4o', 'api_key': 'k', 'max_tokens': 100}
+
+
+def replay(monkeypatch, replay_mode=None, model_config=MODEL_CONFIG):
+    """缓存命中时调用被装饰的函数，返回(各帧的回复, 等待的秒数, 返回值)"""
+    clock = FakeClock()
+    backend = FakeBackend(CACHED)
+    monkeypatch.setattr(mongodb_cache, 'time', clock)
+    monkeypatch.setattr(mongodb_cache, 'cache_backend', backend)
+    monkeypatch.setattr(mongodb_cache, 'CACHE_REPLAY_SPEED', 2)
+    monkeypatch.setattr(mongodb_cache, 'CACHE_REPLAY_MAX_DELAY', 5)
+    monkeypatch.setattr(mongodb_cache, 'CACHE_REPLAY_COARSE_FRAMES', 4)
+
+    def stream_chat(model_config, messages, response_json=False):
+        assert False, "缓存命中时不应调用原函数"
+        yield
+
+    kwargs = {} if replay_mode is None else {'cache_replay': replay_mode}
+    gen = mongodb_cache.llm_api_cache()(stream_chat)(dict(model_config), CACHED['return_value'][:1], **kwargs)
+    frames = []
+    try:
+        while True:
+            frames.append(next(gen))
+    except StopIteration as e:
+        result = e.value
+    assert backend.lookups == 1
+    assert frames[-1] is result and result.finished
+    assert result.model == 'gpt-4o' and result.usage == CACHED['usage']
+    return [messages.response for messages in frames[:-1]], clock.sleeps, result
+
+
+def test_typewriter_replay(monkeypatch):
+    monkeypatch.setattr(mongodb_cache, 'CACHE_REPLAY_MODE', 'typewriter')
+    responses, sleeps, result = replay(monkeypatch)
+    # 按记录的间隔除以回放倍数等待，不超过最大间隔，间隔为0的帧被合并
+    assert responses == ['ab', 'abcdef', 'abcdefgh']
+    assert sleeps == [0.5, 5, 0.25]
+    assert result.response == 'abcdefgh'
+
+
+def test_coarse_replay(monkeypatch):
+    responses, sleeps, result = replay(monkeypatch, 'coarse')
+    # 不等待，只输出CACHE_REPLAY_COARSE_FRAMES - 1个中间帧
+    assert responses == ['abcd', 'abcdef', 'abcdefgh']
+    assert sleeps == []
+
+
+def test_instant_replay_from_model_config(monkeypatch):
+    responses, sleeps, result = replay(monkeypatch, model_config={**MODEL_CONFIG, 'cache_replay': 'instant'})
+    assert responses == [] and sleeps == []
+    assert result.response == 'abcdefgh'
+
+
+def test_invalid_replay_mode_fails_before_lookup(monkeypatch):
+    backend = FakeBackend(CACHED)
+    monkeypatch.setattr(mongodb_cache, 'cache_backend', backend)
+
+    def stream_chat(model_config, messages):
+        yield
+
+    gen = mongodb_cache.llm_api_cache()(stream_chat)(dict(MODEL_CONFIG), [], cache_replay='fast')
+    try:
+        next(gen)
+    except ValueError as e:
+        assert 'fast' in str(e)
+    else:
+        assert False, "无效的回放模式应该抛出ValueError"
+    assert backend.lookups == 0
+
+
+def test_invalid_replay_mode_in_config(monkeypatch):
+    monkeypatch.setenv('CACHE_REPLAY_MODE', 'fast')
+    try:
+        importlib.reload(config)
+    except ValueError as e:
+        assert 'CACHE_REPLAY_MODE' in str(e)
+    else:
+        assert False, "配置中无效的回放模式应该在载入时报错"
+    finally:
+        monkeypatch.delenv('CACHE_REPLAY_MODE')
+        importlib.reload(config)
+
+
+def test_summary_rejects_invalid_replay_mode():
+    from app import app
+    response = app.test_client().post('/summary', json={
+        'content': '正文',
+        'novel_name': 'test',
+        'main_model': 'm',
+        'sub_model': 'm',
+        'settings': {'MAX_THREAD_NUM': 1, 'MAX_NOVEL_SUMMARY_LENGTH': 100, 'CACHE_REPLAY_MODE': 'fast'},
+    })
+    assert response.status_code == 400
+    assert 'fast' in response.get_json()['error']
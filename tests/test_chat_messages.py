@@ -0,0 +1,95 @@
+import sys
+import os
+
+# Add the project root to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm_api import chat_messages
+from llm_api.chat_messages import ChatMessages, count_characters, counts_to_tokens
+
+
+def estimate_without_cache(messages):
+    return sum(counts_to_tokens(count_characters(value)) for message in messages for value in message.values())
+
+
+def test_incremental_counts_for_new_message_dicts(monkeypatch):
+    counted = []
+
+    def counting(text):
+        counted.append(text)
+        return count_characters(text)
+
+    prompt = ChatMessages([{'role': 'system', 'content': '你是作家'}, {'role': 'user', 'content': 'write a story'}], model='m')
+    prompt.get_estimated_tokens()
+    monkeypatch.setattr(chat_messages, 'count_characters', counting)
+
+    # 与缓存回放、流式输出相同，每帧新建最后一条消息的dict，内容在末尾追加
+    response = ''
+    for piece in ['从前', '有座山', ', and', ' a temple']:
+        response += piece
+        messages = prompt + [{'role': 'assistant', 'content': response}]
+        tokens = messages.get_estimated_tokens()
+        assert counted[-1] == piece
+        assert tokens == estimate_without_cache(messages)
+    # prompt部分和role字段不再重复统计
+    assert counted == ['assistant', '从前', '有座山', ', and', ' a temple']
+
+    # 切片使用原列表中的位置，与完整列表共享统计
+    counted.clear()
+    assert messages[-1:].get_estimated_tokens() == estimate_without_cache(messages[-1:])
+    assert messages[:-1].get_estimated_tokens() == estimate_without_cache(messages[:-1])
+    assert counted == []
+
+    # 同一位置换成了不同的内容时重新统计
+    messages = prompt + [{'role': 'assistant', 'content': '另一个回答'}]
+    assert messages.get_estimated_tokens() == estimate_without_cache(messages)
+    assert counted == ['另一个回答']
+    assert len(prompt._counts_cache) == 3
+
+
+class Usage:
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def test_update_usage_reads_provider_usage():
+    messages = ChatMessages([{'role': 'user', 'content': '你好'}, {'role': 'assistant', 'content': 'hi'}], model='m')
+    # 没有用量时使用估算值
+    messages.update_usage(None)
+    assert messages.usage is None and messages.cached_tokens == 0
+    assert messages.input_tokens == messages[:-1].get_estimated_tokens()
+
+    # OpenAI：对象形式，缓存命中数在prompt_tokens_details中
+    messages.update_usage(Usage(prompt_tokens=100, completion_tokens=20, prompt_tokens_details=Usage(cached_tokens=64)))
+    assert (messages.input_tokens, messages.output_tokens, messages.cached_tokens) == (100, 20, 64)
+    assert messages.total_tokens == 120
+
+    # DeepSeek：dict形式，缓存命中数为prompt_cache_hit_tokens
+    messages.update_usage({'prompt_tokens': 50, 'completion_tokens': 5, 'prompt_cache_hit_tokens': 30, 'prompt_tokens_details': None})
+    assert messages.usage == {'prompt_tokens': 50, 'completion_tokens': 5, 'cached_tokens': 30}
+    # 复制后保留用量
+    assert messages.copy().usage == messages.usage
+
+
+def test_cost_uses_cached_price(monkeypatch):
+    monkeypatch.setitem(chat_messages.model_prices, 'test-model', {
+        'input_cost_per_token': 1.0,
+        'cache_read_input_token_cost': 0.1,
+        'output_cost_per_token': 2.0,
+    })
+    monkeypatch.setitem(chat_messages.model_prices, 'test-model-no-cache-price', {
+        'input_cost_per_token': 1.0,
+        'output_cost_per_token': 2.0,
+    })
+    messages = ChatMessages([{'role': 'user', 'content': 'hi'}, {'role': 'assistant', 'content': 'ok'}], model='test-model')
+    messages.set_usage(100, 10, cached_tokens=60)
+    assert abs(messages.cost - (40 * 1.0 + 60 * 0.1 + 10 * 2.0)) < 1e-9
+
+    # 缓存命中数不超过输入tokens
+    messages.set_usage(10, 10, cached_tokens=60)
+    assert abs(messages.cost - (10 * 0.1 + 10 * 2.0)) < 1e-9
+
+    # 没有缓存价格时按普通输入价格计费
+    messages.model = 'test-model-no-cache-price'
+    messages.set_usage(100, 10, cached_tokens=60)
+    assert abs(messages.cost - (100 * 1.0 + 10 * 2.0)) < 1e-9
@@ -0,0 +1,141 @@
+import sys
+import os
+import random
+import functools
+
+# Add the project root to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from core.writer import Writer
+from core.writer_utils import KeyPointMsg, BatchYields
+from bench_get_chunks import get_chunks_by_get_chunk
+
+
+def random_writer(rng):
+    """随机的pair（包括空的x或y）和chunk长度，x、y不能同时为空"""
+    while True:
+        pairs = [('a' * rng.choice([0, 0, 1, 5, 30]), 'b' * rng.choice([0, 1, 10, 60])) for _ in range(rng.randint(1, 40))]
+        if any(x or y for x, y in pairs):
+            break
+    return Writer(pairs, x_chunk_length=rng.choice([10, 40, 100]), y_chunk_length=rng.choice([10, 40, 100]))
+
+
+def random_kwargs(rng, writer):
+    start = rng.randint(0, len(writer.xy_pairs) - 1)
+    end = rng.randint(start + 1, len(writer.xy_pairs))
+    return dict(
+        pair_span=(start, end),
+        chunk_length_ratio=rng.choice([1, 0.5]),
+        context_length_ratio=rng.choice([0, 1, 2]),
+        offset_ratio=rng.choice([0, 0.3, 0.9]),
+    )
+
+
+def call(func, *args, **kwargs):
+    # 原来的循环和新的实现在同样的输入上应该抛出同样类型的异常
+    try:
+        return func(*args, **kwargs)
+    except Exception as e:
+        return type(e)
+
+
+def test_greedy_matches_get_chunk_loop():
+    rng = random.Random(3)
+    for _ in range(1000):
+        writer = random_writer(rng)
+        kwargs = random_kwargs(rng, writer)
+        expected = call(get_chunks_by_get_chunk, writer, **kwargs)
+        got = call(writer.get_chunks, mode='greedy', **kwargs)
+        assert got == expected, (writer.xy_pairs, kwargs)
+
+
+def min_chunk_count(prefix, pair_span, chunk_length, offset):
+    """暴力搜索：在pair边界上划分pair_span的最少chunk数，每个chunk不超过长度上限（单个pair除外）"""
+    px, py = prefix
+    start, end = pair_span
+
+    @functools.lru_cache(None)
+    def count(i):
+        if i == end:
+            return 0
+        limit = offset if offset and i == start else chunk_length
+        best = None
+        for j in range(i + 1, end + 1):
+            if j - i > 1 and max((px[j] - px[i]) / max(limit[0], 1), (py[j] - py[i]) / max(limit[1], 1)) > 1:
+                break
+            best = 1 + count(j) if best is None else min(best, 1 + count(j))
+        return best
+    return count(start)
+
+
+def test_balanced_uses_min_chunks():
+    rng = random.Random(5)
+    for _ in range(1000):
+        writer = random_writer(rng)
+        pairs = writer.xy_pairs
+        kwargs = random_kwargs(rng, writer)
+        kwargs['offset_ratio'] = rng.choice([0, 0, 0.3])
+        start, end = kwargs['pair_span']
+        if not any(x or y for x, y in pairs[start:end]):
+            continue
+        chunks = writer.get_chunks(mode='balanced', **kwargs)
+        assert writer.last_chunk_plan is chunks and chunks.mode == 'balanced'
+
+        # 各chunk的正文首尾相接覆盖pair_span，上下文包含正文
+        spans = [(chunk.text_source_slice.start, chunk.text_source_slice.stop) for chunk in chunks]
+        assert spans[0][0] == start and spans[-1][1] == end
+        assert all(spans[k][1] == spans[k + 1][0] for k in range(len(spans) - 1))
+        for chunk in chunks:
+            assert chunk.source_slice.start <= chunk.text_source_slice.start
+            assert chunk.text_source_slice.stop <= chunk.source_slice.stop
+            assert chunk.text_pairs == tuple(pairs[chunk.text_source_slice.start:chunk.text_source_slice.stop])
+
+        prefix = tuple(writer._pair_index.prefix_sums(0)), tuple(writer._pair_index.prefix_sums(1))
+        chunk_length = writer.x_chunk_length * kwargs['chunk_length_ratio'], writer.y_chunk_length * kwargs['chunk_length_ratio']
+        offset = (int(chunk_length[0] * 0.3), int(chunk_length[1] * 0.3)) if kwargs['offset_ratio'] else None
+        assert len(chunks) == min_chunk_count(prefix, kwargs['pair_span'], chunk_length, offset)
+
+
+def test_balanced_rejects_empty_span():
+    writer = Writer([('', ''), ('a', 'b')], x_chunk_length=10, y_chunk_length=10)
+    try:
+        writer.get_chunks(pair_span=(0, 1), mode='balanced')
+    except ValueError:
+        pass
+    else:
+        assert False, "x和y都为空的span应该抛出ValueError"
+
+
+def test_batch_yield_key_point_before_llm_calls():
+    writer = Writer([('a', 'b')] * 4, x_chunk_length=10, y_chunk_length=10)
+    chunks = writer.get_chunks()
+    started = []
+
+    def generate(i):
+        started.append(i)
+        yield {'text': str(i)}
+        return i
+
+    gen = writer.batch_yield([generate(i) for i in range(len(chunks))], chunks, prompt_name='创作文本')
+    first = next(gen)
+    # 关键点消息在任何生成器开始执行之前yield，此时已可以读取本步骤的划分计划
+    assert isinstance(first, KeyPointMsg) and not first.is_finished()
+    assert started == []
+    assert writer.last_chunk_plan is chunks
+
+    values = []
+    try:
+        while True:
+            values.append(next(gen))
+    except StopIteration as e:
+        results = e.value
+    assert results == list(range(len(chunks)))
+    assert all(isinstance(value, BatchYields) for value in values[:-1])
+    assert values[-1] is first and first.is_finished()
+
+
+def test_batch_yield_without_generators():
+    writer = Writer([('a', 'b')], x_chunk_length=10, y_chunk_length=10)
+    # 没有需要执行的chunk时不产生关键点消息
+    assert list(writer.batch_yield([], [], prompt_name='创作文本')) == []
@@ -0,0 +1,86 @@
+import sys
+import os
+
+# Add the project root to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm_api import client_pool as client_pool_module
+from llm_api.client_pool import ClientPool, close_stream
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+class FakeClient:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def test_same_key_reuses_client():
+    pool = ClientPool(idle_timeout=60)
+    with pool.acquire('openai', FakeClient, base_url='u', api_key='k', timeout=300) as first:
+        pass
+    with pool.acquire('openai', FakeClient, base_url='u', api_key='k', timeout=300) as second:
+        pass
+    assert first is second
+
+    # base_url、api_key、超时时间任一不同都使用不同的客户端
+    others = [
+        pool.acquire('openai', FakeClient, base_url='v', api_key='k', timeout=300),
+        pool.acquire('openai', FakeClient, base_url='u', api_key='k2', timeout=300),
+        pool.acquire('openai', FakeClient, base_url='u', api_key='k', timeout=30),
+    ]
+    assert len({id(lease.client) for lease in others} | {id(first)}) == 4
+
+    stats = pool.stats()
+    assert stats['hits'] == 1 and stats['misses'] == 4
+    assert stats['clients'] == 4 and stats['in_use'] == 3
+    # api_key不出现在统计信息中
+    assert 'k2' not in repr(stats)
+    for lease in others:
+        lease.release()
+        lease.release()  # 重复release不会重复减少in_use
+    assert pool.stats()['in_use'] == 0
+
+
+def test_idle_clients_are_evicted(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(client_pool_module, 'time', clock)
+    pool = ClientPool(idle_timeout=60)
+    idle = pool.acquire('zhipuai', FakeClient, api_key='a')
+    busy = pool.acquire('zhipuai', FakeClient, api_key='b')
+    idle.release()
+
+    clock.now += 61
+    # 空闲超时的客户端在下次acquire时关闭并移除，使用中的客户端不受影响
+    fresh = pool.acquire('zhipuai', FakeClient, api_key='a')
+    assert idle.client.closed and fresh.client is not idle.client
+    assert not busy.client.closed
+    stats = pool.stats()
+    assert stats['evictions'] == 1 and stats['clients'] == 2
+
+    pool.close_all()
+    assert busy.client.closed and fresh.client.closed
+    assert pool.stats()['clients'] == 0
+
+
+def test_close_stream_falls_back_to_response():
+    class Stream:
+        def __init__(self):
+            self.response = FakeClient()
+
+    stream = Stream()
+    close_stream(stream)
+    assert stream.response.closed
+
+    client = FakeClient()
+    close_stream(client)
+    assert client.closed
@@ -0,0 +1,125 @@
+import sys
+import os
+import time
+import random
+import threading
+
+# Add the project root to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.writer_utils import concurrent_yield
+
+
+def wait_until(predicate, timeout=5):
+    deadline = time.time() + timeout
+    while not predicate() and time.time() < deadline:
+        time.sleep(0.001)
+    assert predicate()
+
+
+def run(gen):
+    outputs = []
+    try:
+        while True:
+            yields, finished = next(gen)
+            # 调用方拿到的是共享列表，保存副本
+            outputs.append((list(yields), list(finished)))
+    except StopIteration as e:
+        return outputs, e.value
+
+
+def test_yields_are_ordered_per_generator():
+    rng = random.Random(0)
+
+    def counter(i, n, delays):
+        for k in range(n):
+            time.sleep(delays[k])
+            yield (i, k)
+        return f'result {i}'
+
+    sizes = [rng.randint(1, 8) for _ in range(6)]
+    generators = [counter(i, n, [rng.random() * 0.005 for _ in range(n)]) for i, n in enumerate(sizes)]
+    outputs, results = run(concurrent_yield(generators, max_workers=3))
+
+    # 返回值按输入顺序排列
+    assert results == [f'result {i}' for i in range(len(sizes))]
+    for i, n in enumerate(sizes):
+        seen = [yields[i] for yields, _ in outputs if yields[i] is not None]
+        # 每个生成器的值按产生的顺序出现，最后一次yield的值总能被看到
+        assert [k for _, k in seen] == sorted(k for _, k in seen)
+        assert seen[-1] == (i, n - 1)
+
+
+def test_worker_exception_propagates_and_stops_others():
+    closed = threading.Event()
+    started = threading.Event()
+
+    def failing():
+        yield 'a'
+        started.wait(5)
+        raise ValueError('upstream failed')
+
+    def endless():
+        started.set()
+        try:
+            while True:
+                time.sleep(0.001)
+                yield 'b'
+        finally:
+            closed.set()
+
+    gen = concurrent_yield([failing(), endless()], max_workers=2)
+    try:
+        run(gen)
+    except ValueError as e:
+        assert str(e) == 'upstream failed'
+    else:
+        assert False, "worker中的异常应该抛给调用方"
+    # 其他仍在运行的生成器收到停止信号后在自己的worker中关闭
+    assert closed.wait(5)
+
+
+def test_close_stops_workers_without_leaking_threads():
+    thread_count = threading.active_count()
+    closed = []
+
+    def endless(i):
+        try:
+            while True:
+                time.sleep(0.001)
+                yield i
+        finally:
+            closed.append(i)
+
+    gen = concurrent_yield([endless(i) for i in range(4)], max_workers=4)
+    for _ in range(3):
+        next(gen)
+    gen.close()
+    # 所有生成器都被关闭，worker线程全部退出
+    wait_until(lambda: sorted(closed) == [0, 1, 2, 3])
+    wait_until(lambda: threading.active_count() == thread_count)
+
+
+def test_max_workers_bounds_concurrency():
+    lock = threading.Lock()
+    running = [0]
+    peak = [0]
+
+    def task(i):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        try:
+            for k in range(3):
+                time.sleep(0.002)
+                yield k
+        finally:
+            with lock:
+                running[0] -= 1
+        return i
+
+    outputs, results = run(concurrent_yield([task(i) for i in range(10)], max_workers=3))
+    assert results == list(range(10))
+    assert peak[0] == 3
+    # 没有生成器时直接返回
+    assert run(concurrent_yield([])) == ([], [])
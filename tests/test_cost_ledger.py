@@ -0,0 +1,150 @@
+import sys
+import os
+import time
+import datetime
+import threading
+
+# Add the project root to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm_api import mongodb_cost
+from llm_api.mongodb_cost import CostLedger, _RollingWindow, _to_timestamp
+
+
+def test_rolling_window_expire():
+    window = _RollingWindow(3600)
+    window.add(0, 1.0)
+    window.add(1800, 2.0)
+    # 乱序的记录插入到对应的桶
+    window.add(60, 4.0)
+    window.add(0, 8.0)
+    assert [bucket[0] for bucket in window.buckets] == [0, 60, 1800]
+    assert window.total == 15.0
+
+    window.expire(3600)
+    assert window.total == 6.0
+    window.expire(10000)
+    assert window.total == 0.0 and not window.buckets
+
+
+def make_ledger(monkeypatch, load_buckets):
+    ledger = CostLedger(reconcile_interval=10 ** 9)
+    flushed = []
+    monkeypatch.setattr(mongodb_cost, 'flush_writes', lambda: flushed.append(True))
+    monkeypatch.setattr(ledger, '_load_buckets', load_buckets)
+    return ledger, flushed
+
+
+def minute_of(dt):
+    timestamp = _to_timestamp(dt)
+    return timestamp - timestamp % CostLedger.bucket_seconds
+
+
+def wait_until(predicate, timeout=5):
+    deadline = time.time() + timeout
+    while not predicate() and time.time() < deadline:
+        time.sleep(0.001)
+    assert predicate()
+
+
+def test_reconcile_replaces_local_totals(monkeypatch):
+    now = datetime.datetime.now()
+    db_buckets = {
+        minute_of(now - datetime.timedelta(minutes=5)): 3.0,
+        minute_of(now - datetime.timedelta(hours=5)): 10.0,
+    }
+    loading = threading.Event()
+
+    def load_buckets():
+        loading.wait(5)
+        return dict(db_buckets)
+
+    ledger, flushed = make_ledger(monkeypatch, load_buckets)
+
+    # 第一次查询时在后台载入，载入完成前不阻塞，使用本进程记录的费用
+    ledger.add(1.0, now)
+    assert ledger.totals() == (1.0, 1.0)
+    assert ledger.totals() == (1.0, 1.0)
+    loading.set()
+    wait_until(lambda: ledger.stats()['reconcile_count'] == 1)
+    # 载入前先写完缓冲中的费用记录，之后以数据库为准
+    assert flushed == [True]
+    assert ledger.totals() == (3.0, 13.0)
+
+    ledger.add(2.0, now)
+    assert ledger.totals() == (5.0, 15.0)
+
+    # 其他进程写入了费用，对账后以数据库为准
+    db_buckets[minute_of(now)] = 2.0 + 7.0
+    ledger.reconcile()
+    assert ledger.totals() == (12.0, 22.0)
+    assert ledger.stats()['reconcile_count'] == 2
+
+
+def test_costs_recorded_during_reconcile_are_kept(monkeypatch):
+    now = datetime.datetime.now()
+    ledger = None
+
+    def load_buckets():
+        # 查询期间本进程又记录了一次费用，查询结果中还没有它
+        ledger.add(4.0, now)
+        return {minute_of(now): 1.0}
+
+    ledger, _ = make_ledger(monkeypatch, load_buckets)
+    ledger.reconcile()
+    assert ledger.totals() == (5.0, 5.0)
+    assert ledger._recorded_during_reconcile is None
+
+
+def test_costs_recorded_during_flush_are_kept(monkeypatch):
+    now = datetime.datetime.now()
+    ledger, _ = make_ledger(monkeypatch, lambda: {minute_of(now): 1.0})
+    # 写完缓冲时另一个线程记录了费用，它没有进入缓冲，查询结果中也没有它
+    monkeypatch.setattr(mongodb_cost, 'flush_writes', lambda: ledger.add(4.0, now))
+    ledger.reconcile()
+    assert ledger.totals() == (5.0, 5.0)
+
+
+def test_failed_reconcile_keeps_ledger(monkeypatch):
+    now = datetime.datetime.now()
+    ledger, _ = make_ledger(monkeypatch, lambda: {minute_of(now): 1.0})
+    ledger.reconcile()
+
+    def fail():
+        raise ConnectionError('mongodb unavailable')
+
+    monkeypatch.setattr(ledger, '_load_buckets', fail)
+    try:
+        ledger.reconcile()
+    except ConnectionError:
+        pass
+    else:
+        assert False, "对账失败应该抛出异常"
+    assert ledger._recorded_during_reconcile is None
+    ledger.add(2.0, now)
+    assert ledger.totals() == (3.0, 3.0)
+
+
+def test_old_costs_expire(monkeypatch):
+    now = datetime.datetime.now()
+    ledger, _ = make_ledger(monkeypatch, lambda: {})
+    ledger.reconcile()
+    ledger.add(1.0, now - datetime.timedelta(hours=2))
+    ledger.add(2.0, now - datetime.timedelta(days=2))
+    ledger.add(4.0, now)
+    assert ledger.totals() == (4.0, 5.0)
+
+
+def test_check_cost_limits(monkeypatch):
+    ledger, _ = make_ledger(monkeypatch, lambda: {})
+    ledger.reconcile()
+    monkeypatch.setattr(mongodb_cost, 'cost_ledger', ledger)
+    assert mongodb_cost.check_cost_limits()
+
+    ledger.add(mongodb_cost.API_COST_LIMITS['HOURLY_LIMIT_RMB'], datetime.datetime.now())
+    try:
+        mongodb_cost.check_cost_limits()
+    except Exception as e:
+        assert '1小时' in str(e)
+    else:
+        assert False, "超过每小时限额时应该抛出异常"
@@ -0,0 +1,127 @@
+import sys
+import os
+import socket
+import threading
+import http.client
+
+# Add the project root to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from frontend_server import BackendConnectionPool
+
+
+class FakeBackend:
+    """
+    逐行读取请求的最小HTTP后端，记录收到的请求方法
+    drop_after：每个连接处理这么多个请求后，读完下一个请求不响应直接断开（模拟keep-alive超时与请求发送交错）
+    """
+    def __init__(self, drop_after=1):
+        self.drop_after = drop_after
+        self.received = []
+        self.server = socket.socket()
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen(8)
+        self.port = self.server.getsockname()[1]
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def serve(self):
+        while True:
+            try:
+                conn, _ = self.server.accept()
+            except OSError:
+                return
+            threading.Thread(target=self.handle, args=(conn,), daemon=True).start()
+
+    def handle(self, conn):
+        reader = conn.makefile('rb')
+        handled = 0
+        while True:
+            line = reader.readline()
+            if not line:
+                break
+            while reader.readline() not in (b'\r\n', b''):
+                pass
+            self.received.append(line.split()[0].decode())
+            if handled == self.drop_after:
+                break
+            handled += 1
+            conn.sendall(b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok')
+        conn.close()
+
+    def close(self):
+        self.server.close()
+
+
+def warm_pool(backend):
+    """发送一个请求并把连接放回池中，下一个请求会复用它"""
+    pool = BackendConnectionPool('127.0.0.1', backend.port, timeout=5)
+    conn, response = pool.request('GET', '/', None, {})
+    assert response.read() == b'ok'
+    pool.put(conn)
+    backend.received.clear()
+    return pool
+
+
+def test_idempotent_request_is_retried():
+    backend = FakeBackend()
+    pool = warm_pool(backend)
+    # 复用的连接在读取响应时断开，GET用新连接重发
+    conn, response = pool.request('GET', '/', None, {})
+    assert response.status == 200 and response.read() == b'ok'
+    assert backend.received == ['GET', 'GET']
+    conn.close()
+    backend.close()
+
+
+def test_sent_post_is_not_retried():
+    backend = FakeBackend()
+    pool = warm_pool(backend)
+    # 后端已收到POST，可能已经开始处理，不能重发
+    try:
+        pool.request('POST', '/', b'{}', {'Content-Length': '2'})
+    except http.client.RemoteDisconnected:
+        pass
+    else:
+        assert False, "已发送的POST不应该重试"
+    assert backend.received == ['POST']
+    backend.close()
+
+
+def test_new_connection_is_not_retried():
+    backend = FakeBackend(drop_after=0)
+    pool = BackendConnectionPool('127.0.0.1', backend.port, timeout=5)
+    # 新建的连接断开说明后端有问题，不是长连接过期，不重试
+    try:
+        pool.request('GET', '/', None, {})
+    except http.client.RemoteDisconnected:
+        pass
+    else:
+        assert False, "新连接断开时不应该重试"
+    assert backend.received == ['GET']
+    backend.close()
+
+
+class ClosedConnection:
+    """已被后端关闭的连接，发送请求时失败"""
+    def __init__(self):
+        self.closed = False
+
+    def request(self, *args, **kwargs):
+        raise BrokenPipeError()
+
+    def close(self):
+        self.closed = True
+
+
+def test_unsent_post_is_retried():
+    backend = FakeBackend()
+    pool = BackendConnectionPool('127.0.0.1', backend.port, timeout=5)
+    stale = ClosedConnection()
+    pool.put(stale)
+    # 请求没有发送出去，POST也可以安全地用新连接重发
+    conn, response = pool.request('POST', '/', b'{}', {'Content-Length': '2'})
+    assert response.status == 200 and response.read() == b'ok'
+    assert stale.closed
+    assert backend.received == ['POST']
+    conn.close()
+    backend.close()
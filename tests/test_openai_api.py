@@ -0,0 +1,65 @@
+import sys
+import os
+
+import httpx
+from openai import BadRequestError
+
+# Add the project root to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm_api import openai_api
+from llm_api.openai_api import create_chat_stream
+
+
+def bad_request(message, param=None):
+    response = httpx.Response(400, request=httpx.Request('POST', 'http://localhost/v1/chat/completions'))
+    return BadRequestError(message, response=response, body={'message': message, 'param': param})
+
+
+class FakeClient:
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.calls = []
+        self.chat = self
+        self.completions = self
+
+    def create(self, **params):
+        self.calls.append(params)
+        if self.errors:
+            raise self.errors.pop(0)
+        return 'stream'
+
+
+PARAMS = {'model': 'm', 'messages': [], 'stream': True, 'stream_options': {'include_usage': True}}
+
+
+def test_retries_without_stream_options(monkeypatch):
+    monkeypatch.setattr(openai_api, '_no_stream_options', set())
+    client = FakeClient([bad_request("Unrecognized request argument supplied: stream_options")])
+    assert create_chat_stream(client, dict(PARAMS), base_url='http://a', timeout=10) == 'stream'
+    assert [('stream_options' in call) for call in client.calls] == [True, False]
+    assert client.calls[1]['timeout'] == 10
+
+    # 记住该接口，之后不再发送stream_options
+    client = FakeClient([])
+    create_chat_stream(client, dict(PARAMS), base_url='http://a')
+    assert 'stream_options' not in client.calls[0]
+
+    # 只在错误的param中指出stream_options也会回退
+    client = FakeClient([bad_request("Invalid parameter", param='stream_options.include_usage')])
+    assert create_chat_stream(client, dict(PARAMS), base_url='http://b') == 'stream'
+    assert openai_api._no_stream_options == {'http://a', 'http://b'}
+
+
+def test_other_bad_requests_are_raised(monkeypatch):
+    monkeypatch.setattr(openai_api, '_no_stream_options', set())
+    for error in [bad_request("This model's maximum context length is 8192 tokens"), bad_request("Invalid temperature", param='temperature')]:
+        client = FakeClient([error])
+        try:
+            create_chat_stream(client, dict(PARAMS), base_url='http://a')
+        except BadRequestError as e:
+            assert e is error
+        else:
+            assert False, "与stream_options无关的400错误应该直接抛出"
+        assert len(client.calls) == 1
+    assert openai_api._no_stream_options == set()
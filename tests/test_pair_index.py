@@ -0,0 +1,148 @@
+import sys
+import os
+import bisect
+import json
+import random
+import string
+import itertools
+
+# Add the project root to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.pair_index import FenwickTree, PairLengthIndex, PairIdIndex
+from core.writer import Writer, Chunk, StaleChunkError
+
+
+def random_text(rng):
+    return 'a' * rng.choice([0, 0, 1, 2, 5, 10])
+
+
+def prefix_sums(values):
+    return list(itertools.accumulate(values, initial=0))
+
+
+def test_fenwick_matches_prefix_sums():
+    rng = random.Random(0)
+    for _ in range(200):
+        values = [rng.choice([0, 0, 1, 3]) for _ in range(rng.randint(0, 20))]
+        tree = FenwickTree(values)
+        for _ in range(10):
+            if values:
+                i = rng.randrange(len(values))
+                delta = rng.randint(-values[i], 3)
+                values[i] += delta
+                tree.add(i, delta)
+            sums = prefix_sums(values)
+            assert [tree.prefix_sum(i) for i in range(len(values) + 1)] == sums
+            # 包括0长度的值和落在边界上的查询
+            for value in [x / 2 for x in range(-2, 2 * sums[-1] + 4)]:
+                assert tree.bisect_left(value) == bisect.bisect_left(sums, value)
+                assert tree.bisect_right(value) == bisect.bisect_right(sums, value)
+
+
+def ref_align(pairs, l, r, axis):
+    sums = prefix_sums(len(pair[axis]) for pair in pairs)
+    start = bisect.bisect_right(sums, l) - 1
+    end = bisect.bisect_left(sums, r)
+    return (sums[start], sums[end]), (start, end)
+
+
+def test_pair_length_index_splices():
+    rng = random.Random(1)
+    for _ in range(100):
+        pairs = [(random_text(rng), random_text(rng)) for _ in range(rng.randint(1, 20))]
+        index = PairLengthIndex(pairs)
+        for _ in range(20):
+            start = rng.randint(0, len(pairs))
+            end = rng.randint(start, len(pairs))
+            # 一半替换相同数量的pair（单点更新），一半改变pair数量（下次查询时重建）
+            count = end - start if rng.random() < 0.5 else rng.randint(0, 4)
+            new_pairs = [(random_text(rng), random_text(rng)) for _ in range(count)]
+            pairs[start:end] = new_pairs
+            index.splice(start, end, new_pairs)
+
+            assert len(index) == len(pairs)
+            for axis in (0, 1):
+                sums = prefix_sums(len(pair[axis]) for pair in pairs)
+                assert index.total(axis) == sums[-1]
+                assert index.prefix_sums(axis) == sums
+                assert [index.prefix(i, axis) for i in range(len(pairs) + 1)] == sums
+                if sums[-1]:
+                    l = rng.randrange(sums[-1])
+                    r = rng.randint(l + 1, sums[-1])
+                    assert index.align(l, r, axis) == ref_align(pairs, l, r, axis)
+            a = rng.randint(0, len(pairs))
+            b = rng.randint(a, len(pairs))
+            assert index.span_length((a, b)) == (sum(len(p[0]) for p in pairs[a:b]), sum(len(p[1]) for p in pairs[a:b]))
+
+
+def test_align_out_of_range():
+    index = PairLengthIndex([('ab', 'c'), ('d', '')])
+    try:
+        index.align(0, 4, 0)
+    except IndexError:
+        pass
+    else:
+        assert False, "超出总长度的span应该抛出IndexError"
+
+
+def test_pair_id_index_matches_list():
+    rng = random.Random(5)
+    for _ in range(100):
+        index = PairIdIndex(rng.randint(0, 30))
+        ids = list(index.ids)
+        removed = set()
+        for _ in range(200):
+            start = rng.randint(0, len(ids))
+            end = rng.randint(start, min(len(ids), start + 5))
+            if rng.random() < 0.5:
+                new_ids = index.splice(start, end, rng.randint(0, 6))
+                removed.update(ids[start:end])
+                ids[start:end] = new_ids
+                assert not removed & set(new_ids)
+            assert index.ids == ids
+            # 位移较多时会在查询时重建，两种状态下的查询都与列表上的index()相同
+            if ids and rng.random() < 0.7:
+                for _ in range(3):
+                    i = rng.randrange(len(ids))
+                    assert index.position(ids[i]) == i
+            if removed:
+                assert index.position(rng.choice(sorted(removed))) is None
+            assert index.position(-1) is None
+        assert [index.position(pair_id) for pair_id in ids] == list(range(len(ids)))
+
+
+def random_pair(rng):
+    text = lambda n: ''.join(rng.choice(string.ascii_letters) for _ in range(n))
+    return text(rng.randint(0, 30)), text(rng.randint(1, 60))
+
+
+def test_writer_locates_applied_and_stale_chunks():
+    rng = random.Random(6)
+    for _ in range(50):
+        pairs = [random_pair(rng) for _ in range(rng.randint(5, 80))]
+        writer = Writer(list(pairs), x_chunk_length=100, y_chunk_length=200)
+        chunks = writer.get_chunks(context_length_ratio=rng.choice([0, 1]))
+        new_chunks = [chunk.edit(text_pairs=[random_pair(rng) for _ in range(rng.randint(1, 3))]) for chunk in chunks]
+        # 按随机顺序逐个写入，前面的写入改变了后面chunk的位置
+        order = list(range(len(chunks)))
+        rng.shuffle(order)
+        for i in order:
+            writer.apply_chunks([chunks[i]], [new_chunks[i]])
+
+        for new_chunk in new_chunks:
+            start, end = writer.get_chunk_pair_span(new_chunk)
+            assert [list(pair) for pair in writer.xy_pairs[start:end]] == [list(pair) for pair in new_chunk.text_pairs]
+        # 已被替换的chunk不能再定位
+        for chunk in chunks:
+            try:
+                writer.get_chunk_pair_span(chunk)
+            except StaleChunkError:
+                pass
+            else:
+                assert False, "已被替换的chunk应该抛出StaleChunkError"
+        # 经过JSON（如前端传回）或其他Writer中的chunk没有可用的id，按内容定位到相同的位置
+        other = Writer(list(writer.xy_pairs), x_chunk_length=100, y_chunk_length=200)
+        for new_chunk in new_chunks:
+            restored = Chunk(**json.loads(json.dumps(new_chunk)))
+            assert other.get_chunk_pair_span(restored) == writer.get_chunk_pair_span(new_chunk)
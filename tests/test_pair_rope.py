@@ -0,0 +1,107 @@
+import sys
+import os
+import copy
+import pickle
+import random
+
+# Add the project root to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.pair_rope import PairRope
+from core.pair_index import PairLengthIndex
+from core.writer import Writer
+
+
+def random_pair(rng):
+    return 'a' * rng.choice([0, 0, rng.randint(1, 9)]), 'b' * rng.randint(0, 9)
+
+
+def check_same(rope, pairs, rng):
+    assert list(rope) == pairs and len(rope) == len(pairs)
+    if pairs:
+        i = rng.randrange(-len(pairs), len(pairs))
+        assert rope[i] == pairs[i]
+    a = rng.randint(0, len(pairs))
+    b = rng.randint(a, len(pairs))
+    assert rope[a:b] == pairs[a:b]
+    assert rope[a:] == pairs[a:] and rope[:b] == pairs[:b] and rope[-3:] == pairs[-3:]
+
+    # 长度查询与PairLengthIndex（列表存储时使用的索引）相同
+    index = PairLengthIndex(pairs)
+    assert rope.span_length((a, b)) == index.span_length((a, b))
+    for axis in (0, 1):
+        assert rope.total(axis) == index.total(axis)
+        assert rope.prefix_sums(axis) == index.prefix_sums(axis)
+        assert rope.text(axis) == ''.join(pair[axis] for pair in pairs)
+        total = rope.total(axis)
+        for _ in range(5):
+            l = rng.randint(0, total)
+            r = rng.randint(l, total + 1)
+            try:
+                expected = index.align(l, r, axis)
+            except IndexError:
+                expected = IndexError
+            try:
+                got = rope.align(l, r, axis)
+            except IndexError:
+                got = IndexError
+            assert got == expected, (l, r, axis)
+
+
+def test_random_splices_match_list():
+    rng = random.Random(0)
+    for _ in range(100):
+        pairs = [random_pair(rng) for _ in range(rng.randint(0, 40))]
+        rope = PairRope(pairs)
+        snapshots = []
+        for _ in range(30):
+            check_same(rope, pairs, rng)
+            snapshots.append((rope.copy(), list(pairs)))
+
+            a = rng.randint(0, len(pairs))
+            b = rng.randint(a, len(pairs))
+            new_pairs = [random_pair(rng) for _ in range(rng.randint(0, 5))]
+            op = rng.random()
+            if op < 0.6:
+                pairs[a:b] = new_pairs
+                rope[a:b] = new_pairs
+            elif op < 0.7 and pairs:
+                i = rng.randrange(len(pairs))
+                pairs[i] = rope[i] = random_pair(rng)
+            elif op < 0.8 and pairs:
+                i = rng.randrange(-len(pairs), len(pairs))
+                del pairs[i]
+                del rope[i]
+            elif op < 0.9:
+                pairs.extend(new_pairs)
+                rope.extend(new_pairs)
+            else:
+                pair = random_pair(rng)
+                pairs.append(pair)
+                rope.append(pair)
+        check_same(rope, pairs, rng)
+
+        # 快照不受之后修改的影响
+        for snapshot, expected in snapshots:
+            assert list(snapshot) == expected
+        assert pickle.loads(pickle.dumps(rope)) == pairs
+        assert copy.deepcopy(rope) == rope
+
+
+def test_writer_rope_storage_matches_list():
+    rng = random.Random(1)
+    pairs = [('x' * rng.randint(1, 30), 'y' * rng.randint(0, 60)) for _ in range(100)]
+    list_writer = Writer(list(pairs), x_chunk_length=100, y_chunk_length=200)
+    rope_writer = Writer(PairRope(pairs), x_chunk_length=100, y_chunk_length=200)
+    for step in range(20):
+        list_chunks = list_writer.get_chunks()
+        rope_chunks = rope_writer.get_chunks()
+        assert [chunk.source_slice for chunk in list_chunks] == [chunk.source_slice for chunk in rope_chunks]
+
+        # 替换一个chunk的正文，pair数量随机变化
+        i = rng.randrange(len(list_chunks))
+        new_pairs = [('x' * rng.randint(1, 30), f'new{step}') for _ in range(rng.randint(1, 4))]
+        list_writer.apply_chunks([list_chunks[i]], [list_chunks[i].edit(text_pairs=new_pairs)])
+        rope_writer.apply_chunks([rope_chunks[i]], [rope_chunks[i].edit(text_pairs=new_pairs)])
+        assert list(rope_writer.xy_pairs) == list_writer.xy_pairs
+        assert (rope_writer.x_len, rope_writer.y_len) == (list_writer.x_len, list_writer.y_len)
@@ -0,0 +1,67 @@
+import sys
+import os
+import json
+import zlib
+
+# Add the project root to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from response_encoder import StreamCompressor, choose_compression, encode_sse, dumps
+
+
+def parse_sse(data):
+    """按SSE规范解析事件：事件以空行分隔，每行为field: value"""
+    events = []
+    for block in data.decode('utf-8').split('\n\n')[:-1]:
+        event = {}
+        for line in block.split('\n'):
+            field, _, value = line.partition(': ')
+            event.setdefault(field, []).append(value)
+        events.append(event)
+    return events
+
+
+def test_encode_sse_keeps_multiline_data_on_one_line():
+    payload = {'msg': '第一行\n第二行\r\n第三行\r', 'text': '结尾\n\n', 'quote': '"\\'}
+    frame = encode_sse(payload, event_id=7)
+    assert frame.endswith(b'\n\n')
+    events = parse_sse(frame)
+    # 换行在JSON中转义，data只有一行，不会提前结束事件
+    assert events == [{'id': ['7'], 'data': [dumps(payload).decode('utf-8')]}]
+    assert json.loads(events[0]['data'][0]) == payload
+    # 中文直接输出为UTF-8
+    assert '第一行'.encode('utf-8') in frame
+
+    frames = encode_sse('a\nb') + encode_sse({'n': 1})
+    assert [json.loads(e['data'][0]) for e in parse_sse(frames)] == ['a\nb', {'n': 1}]
+    assert b'id:' not in encode_sse({'n': 1})
+
+
+def test_stream_compressor_sync_flush_framing():
+    for encoding in ('gzip', 'deflate'):
+        compressor = StreamCompressor(encoding)
+        wbits = 16 + zlib.MAX_WBITS if encoding == 'gzip' else zlib.MAX_WBITS
+        decompressor = zlib.decompressobj(wbits)
+        frames = [encode_sse({'i': i, 'text': '重复的内容' * 20}) for i in range(5)]
+        compressed = []
+        for frame in frames:
+            chunk = compressor.compress(frame)
+            compressed.append(chunk)
+            # 每帧以SYNC_FLUSH的空块结尾，客户端收到这一块就能解出完整的帧
+            assert chunk.endswith(b'\x00\x00\xff\xff')
+            assert decompressor.decompress(chunk) == frame
+        compressed.append(compressor.finish())
+        assert decompressor.decompress(compressed[-1]) == b''
+        assert decompressor.eof
+        # 共用压缩上下文，后面的帧引用前面的内容，比单独压缩小
+        assert len(compressed[-2]) < len(zlib.compress(frames[-1]))
+        assert zlib.decompress(b''.join(compressed), wbits) == b''.join(frames)
+
+
+def test_choose_compression():
+    assert choose_compression('gzip, deflate, br', 'gzip') == 'gzip'
+    assert choose_compression('deflate;q=0.5', 'deflate') == 'deflate'
+    assert choose_compression('br', 'gzip') is None
+    assert choose_compression(None, 'gzip') is None
+    assert choose_compression('gzip', 'none') is None
@@ -0,0 +1,139 @@
+import sys
+import os
+import time
+import threading
+
+# Add the project root to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm_api import scheduler
+from llm_api.scheduler import TokenBucket, RequestScheduler
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+def test_token_bucket_refill(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(scheduler, 'time', clock)
+    bucket = TokenBucket(60)  # 每秒补充1个
+
+    assert bucket.wait_time(60) == 0
+    bucket.consume(60)
+    assert bucket.wait_time(1) == 1
+    clock.now += 0.5
+    assert bucket.wait_time(1) == 0.5
+    clock.now += 100
+    # 补充不超过容量
+    assert bucket.wait_time(60) == 0 and bucket.tokens == 60
+    # 单次请求超过容量时按容量计算
+    assert bucket.wait_time(1000) == 0
+
+
+def test_token_bucket_adjust(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(scheduler, 'time', clock)
+    bucket = TokenBucket(60)
+    bucket.consume(10)
+    # 实际用量超过预估，余额为负，需要等待恢复
+    bucket.adjust(80)
+    assert bucket.tokens == -30
+    assert bucket.wait_time(1) == 31
+    # 实际用量少于预估时返还，不超过容量
+    bucket.adjust(-1000)
+    assert bucket.tokens == 60
+
+
+def test_token_bucket_unlimited():
+    bucket = TokenBucket(0)
+    bucket.consume(10 ** 9)
+    bucket.adjust(10 ** 9)
+    assert bucket.wait_time(10 ** 9) == 0
+
+
+def test_provider_name():
+    assert RequestScheduler.get_provider_name('gpt', 'https://api.deepseek.com/v1') == 'api.deepseek.com'
+    assert RequestScheduler.get_provider_name('wenxin') == 'wenxin'
+
+
+def wait_until(predicate, timeout=5):
+    deadline = time.time() + timeout
+    while not predicate() and time.time() < deadline:
+        time.sleep(0.001)
+    assert predicate()
+
+
+def test_key_concurrency_is_fifo():
+    request_scheduler = RequestScheduler(limits={'default': {'key_max_concurrency': 1}}, max_wait=5)
+    first = request_scheduler.acquire('p', 'key')
+    order = []
+
+    def acquire(name):
+        ticket = request_scheduler.acquire('p', 'key')
+        order.append(name)
+        ticket.release()
+
+    threads = []
+    for i, name in enumerate(['a', 'b', 'c']):
+        threads.append(threading.Thread(target=acquire, args=(name,)))
+        threads[-1].start()
+        # 等这个请求进入队列后再发起下一个，保证到达顺序
+        wait_until(lambda: request_scheduler.stats()['keys'][0]['queued'] == i + 1)
+
+    # 不同key不受这个key的并发限制
+    request_scheduler.acquire('p', 'other key').release()
+    assert order == []
+
+    first.release()
+    for thread in threads:
+        thread.join(5)
+    assert order == ['a', 'b', 'c']
+    stats = request_scheduler.stats()
+    assert stats['providers']['p']['in_flight'] == 0
+    assert stats['providers']['p']['requests'] == 5
+
+
+def test_provider_concurrency():
+    request_scheduler = RequestScheduler(limits={'default': {'max_concurrency': 1}}, max_wait=5)
+    ticket = request_scheduler.acquire('p', 'key1')
+    acquired = threading.Event()
+
+    def acquire():
+        request_scheduler.acquire('p', 'key2').release()
+        acquired.set()
+
+    thread = threading.Thread(target=acquire)
+    thread.start()
+    # 提供商的总并发已满，其他key也需要等待
+    assert not acquired.wait(0.1)
+    ticket.release()
+    thread.join(5)
+    assert acquired.is_set()
+
+
+def test_rpm_wait_times_out():
+    request_scheduler = RequestScheduler(limits={'default': {'rpm': 1}}, max_wait=0.05)
+    request_scheduler.acquire('p', 'key').release()
+    try:
+        request_scheduler.acquire('p', 'key')
+    except Exception as e:
+        assert '排队等待' in str(e)
+    else:
+        assert False, "超过RPM时应该等待到超时"
+    # 超时的请求已离开队列
+    assert request_scheduler.stats()['keys'][0]['queued'] == 0
+
+
+def test_release_settles_actual_tokens():
+    request_scheduler = RequestScheduler(limits={'default': {'tpm': 1000}}, max_wait=5)
+    ticket = request_scheduler.acquire('p', 'key', estimated_tokens=100)
+    ticket.release(used_tokens=400)
+    # 重复release不会重复结算
+    ticket.release(used_tokens=400)
+    available = request_scheduler.stats()['keys'][0]['tpm_available']
+    assert 600 <= available < 610
@@ -0,0 +1,204 @@
+import sys
+import os
+import time
+import threading
+
+# Add the project root to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm_api.single_flight import SingleFlightGroup, create_flight_key
+
+
+MESSAGES = [{'role': 'user', 'content': '1+1=?'}]
+
+
+def run_concurrently(group, keys):
+    """同时发起多个请求，上游在所有请求都加入后才返回，统计上游调用次数"""
+    upstream_calls = []
+    release = threading.Event()
+    results = [None] * len(keys)
+
+    def upstream(key):
+        upstream_calls.append(key)
+        release.wait(5)
+        yield 'partial'
+        return f'result of {key[2][:8]}'
+
+    def caller(i, key):
+        gen = group.run(key, lambda: upstream(key))
+        try:
+            while True:
+                next(gen)
+        except StopIteration as e:
+            results[i] = e.value
+
+    threads = [threading.Thread(target=caller, args=(i, key)) for i, key in enumerate(keys)]
+    for thread in threads:
+        thread.start()
+    # 所有调用方都加入后再让上游返回
+    deadline = time.time() + 5
+    while group.stats()['subscribers'] < len(keys) and time.time() < deadline:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    return upstream_calls, results
+
+
+def test_same_credentials_are_merged():
+    model_config = {'model': 'gpt-4o', 'api_key': 'key-a', 'base_url': 'https://api.openai.com/v1', 'max_tokens': 100}
+    keys = [create_flight_key('stream_chat', (dict(model_config), MESSAGES), {}) for _ in range(3)]
+    assert len(set(keys)) == 1
+
+    group = SingleFlightGroup()
+    upstream_calls, results = run_concurrently(group, keys)
+    assert len(upstream_calls) == 1
+    assert len(set(results)) == 1
+    assert group.stats()['coalesced_calls'] == 2
+
+
+def test_different_api_keys_are_not_merged():
+    model_config = {'model': 'gpt-4o', 'base_url': 'https://api.openai.com/v1', 'max_tokens': 100}
+    key_a = create_flight_key('stream_chat', ({**model_config, 'api_key': 'key-a'}, MESSAGES), {})
+    key_b = create_flight_key('stream_chat', ({**model_config, 'api_key': 'key-b'}, MESSAGES), {})
+    assert key_a != key_b
+
+    group = SingleFlightGroup()
+    upstream_calls, results = run_concurrently(group, [key_a, key_b])
+    assert len(upstream_calls) == 2
+    assert results[0] != results[1]
+    assert group.stats()['coalesced_calls'] == 0
+
+
+def test_different_endpoints_or_ak_sk_are_not_merged():
+    local = {'model': 'qwen', 'api_key': 'lm-studio', 'base_url': 'http://localhost:1234/v1'}
+    remote = {**local, 'base_url': 'https://api.example.com/v1'}
+    assert create_flight_key('stream_chat', (local, MESSAGES), {}) != create_flight_key('stream_chat', (remote, MESSAGES), {})
+
+    wenxin = {'model': 'ERNIE-4.0-8K', 'ak': 'ak', 'sk': 'sk-a'}
+    assert create_flight_key('stream_chat', (wenxin, MESSAGES), {}) != create_flight_key('stream_chat', ({**wenxin, 'sk': 'sk-b'}, MESSAGES), {})
+
+
+def wait_until(predicate, timeout=5):
+    deadline = time.time() + timeout
+    while not predicate() and time.time() < deadline:
+        time.sleep(0.001)
+    assert predicate()
+
+
+def test_runs_inline_without_waiters():
+    threads = []
+
+    def upstream():
+        threads.append(threading.current_thread())
+        yield 1
+        yield 2
+        return 'done'
+
+    group = SingleFlightGroup()
+    thread_count = threading.active_count()
+    gen = group.run('key', upstream)
+    assert next(gen) == 1
+    # 没有其他调用方时上游在调用方的线程中运行，不额外启动线程
+    assert threads == [threading.current_thread()]
+    assert threading.active_count() == thread_count
+    assert list(gen) == [2]
+    assert group.stats()['in_flight'] == 0
+
+
+def test_slow_subscriber_sees_every_snapshot():
+    group = SingleFlightGroup()
+    release = threading.Event()
+
+    def upstream():
+        # 与流式接口相同，原地修改并重复yield同一个对象
+        state = []
+        release.wait(5)
+        for i in range(50):
+            state.append(i)
+            yield state
+        return state
+
+    leader_frames = []
+
+    def leader():
+        for value in group.run('key', upstream, snapshot=list):
+            leader_frames.append(value)
+
+    frames = []
+    results = []
+
+    def follower():
+        gen = group.run('key', upstream, snapshot=list)
+        try:
+            while True:
+                frames.append(next(gen))
+                time.sleep(0.002)
+        except StopIteration as e:
+            results.append(e.value)
+
+    threads = [threading.Thread(target=leader), threading.Thread(target=follower)]
+    threads[0].start()
+    wait_until(lambda: group.stats()['subscribers'] == 1)
+    threads[1].start()
+    wait_until(lambda: group.stats()['subscribers'] == 2)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    # 较慢的调用方按顺序收到每一个快照，不会只看到最新值
+    assert frames == [list(range(i + 1)) for i in range(50)]
+    assert results == [list(range(50))]
+    assert len(leader_frames) == 50
+
+
+def test_upstream_continues_after_leader_exits():
+    group = SingleFlightGroup()
+    closed = threading.Event()
+    step = threading.Semaphore(0)
+
+    def upstream():
+        try:
+            for i in range(5):
+                step.acquire(timeout=5)
+                yield i
+            return 'done'
+        finally:
+            closed.set()
+
+    leader = group.run('key', upstream)
+    step.release()
+    assert next(leader) == 0
+    follower = group.run('key', upstream)
+    # 加入时先收到最新值
+    assert next(follower) == 0
+
+    # 第一个调用方提前退出，上游转到后台线程继续为其他调用方运行
+    leader.close()
+    assert not closed.is_set()
+    for _ in range(4):
+        step.release()
+    assert list(follower) == [1, 2, 3, 4]
+    assert closed.is_set()
+    assert group.stats()['handoffs'] == 1 and group.stats()['in_flight'] == 0
+
+
+def test_upstream_closed_when_all_callers_exit():
+    group = SingleFlightGroup()
+    closed = threading.Event()
+
+    def upstream():
+        try:
+            while True:
+                yield 'partial'
+        finally:
+            closed.set()
+
+    leader = group.run('key', upstream)
+    next(leader)
+    follower = group.run('key', upstream)
+    next(follower)
+    leader.close()
+    follower.close()
+    # 后台线程在下一帧后发现已取消，关闭上游
+    assert closed.wait(5)
+    wait_until(lambda: group.stats()['in_flight'] == 0)
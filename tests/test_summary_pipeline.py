@@ -0,0 +1,146 @@
+import sys
+import os
+import time
+
+# Add the project root to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from core import summary_novel
+from core.summary_novel import summary_chapter
+import summary
+
+
+class FakeWriter:
+    def __init__(self, x='', xy_pairs=None, global_context=None):
+        self.x = x
+        self.xy_pairs = xy_pairs or []
+        self.global_context = global_context or {}
+
+
+class TickClock:
+    """每次调用time()前进1秒"""
+    def __init__(self):
+        self.now = 0
+
+    def time(self):
+        self.now += 1
+        return self.now
+
+
+def progress(chars_num, current_cost):
+    return dict(progress_msg='', chars_num=chars_num, current_cost=current_cost, currency_symbol='￥', model='m')
+
+
+def stub_llm(monkeypatch, draft_delays=None):
+    """替换调用LLM的剧情摘要、章节大纲、全书大纲阶段，剧情摘要可以按章节指定耗时"""
+    calls = []
+
+    def fake_draft(model, sub_model, chapter_title, chapter_text):
+        calls.append(('draft', chapter_title))
+        time.sleep((draft_delays or {}).get(chapter_title, 0))
+        yield progress(5, 0.1)
+        yield progress(10, 0.2)
+        return FakeWriter(x=f'剧情：{chapter_text}', xy_pairs=[(f'剧情：{chapter_text}', chapter_text)])
+
+    def fake_plot(model, sub_model, chapter_title, chapter_plot):
+        calls.append(('plot', chapter_title))
+        assert chapter_plot.startswith('剧情：')
+        yield progress(3, 0.05)
+        return FakeWriter(global_context={'chapter': f'大纲：{chapter_title}'})
+
+    def fake_outline(model, sub_model, title, chapter_titles, chapter_content):
+        calls.append(('outline', title))
+        yield progress(7, 0.3)
+        return FakeWriter(xy_pairs=[('', f'全书：{c}') for c in chapter_content], global_context={'outline': '全书大纲'})
+
+    monkeypatch.setattr(summary_novel, 'summary_draft', fake_draft)
+    monkeypatch.setattr(summary_novel, 'summary_plot', fake_plot)
+    monkeypatch.setattr(summary, 'summary_chapters', fake_outline)
+    return calls
+
+
+def test_batch_yield_runs_chapters_concurrently():
+    def chapter(i, delay):
+        time.sleep(delay)
+        yield {'chapter': i, 'stage': 'draft'}
+        yield {'chapter': i, 'stage': 'done'}
+        return f'result {i}'
+
+    ret = []
+    start = time.time()
+    snapshots = [list(yields) for yields in summary.batch_yield([chapter(i, 0.2) for i in range(4)], max_co_num=4, ret=ret)]
+    # 4章同时运行，总耗时接近单章的耗时
+    assert time.time() - start < 0.6
+    assert ret == [f'result {i}' for i in range(4)]
+    # 每次yield的是各章最近一次的进度，最后一次全部完成
+    assert snapshots[-1] == [{'chapter': i, 'stage': 'done'} for i in range(4)]
+    assert all(len(s) == 4 for s in snapshots)
+
+
+def test_summary_chapter_stages(monkeypatch):
+    calls = stub_llm(monkeypatch)
+    monkeypatch.setattr(summary_novel, 'time', TickClock())
+
+    gen = summary_chapter({}, {}, '第1章', '正文')
+    yields = []
+    try:
+        while True:
+            yields.append(next(gen))
+    except StopIteration as e:
+        dw, cw, stage_times, final_progress = e.value
+
+    assert calls == [('draft', '第1章'), ('plot', '第1章')]
+    assert [y['stage'] for y in yields] == ['draft', 'draft', 'plot', 'done']
+    # 章节大纲阶段的数值累加了剧情摘要阶段，最后一次yield就是该章的总计
+    assert [(y['chars_num'], round(y['current_cost'], 6)) for y in yields] == [(5, 0.1), (10, 0.2), (13, 0.25), (13, 0.25)]
+    assert final_progress['chars_num'] == 13 and abs(final_progress['current_cost'] - 0.25) < 1e-9
+    assert dw.x == '剧情：正文' and cw.global_context['chapter'] == '大纲：第1章'
+    assert stage_times == {
+        'draft_start': 1, 'draft_end': 2, 'draft_time': 1,
+        'plot_start': 3, 'plot_end': 4, 'plot_time': 1,
+    }
+
+
+def test_process_novel_pipelines_chapters(monkeypatch):
+    # 第3章的剧情摘要最慢，其他章节的章节大纲不必等它
+    calls = stub_llm(monkeypatch, draft_delays={'第3章 三': 0.3})
+    monkeypatch.setattr(summary, 'ENABLE_ONLINE_DEMO', False)
+    content = '第1章 一\n甲\n第2章 二\n乙\n第3章 三\n丙\n'
+
+    results = list(summary.process_novel(content, '测试', {}, {}, max_novel_summary_length=1000, max_thread_num=3))
+    messages = [r['progress_msg'] for r in results]
+    assert messages[:3] == ['正在解析章节...', '解析出章节数：3', '正在生成剧情摘要和章节大纲...']
+
+    # 进度中的完成数不减少，章节大纲完成数不超过剧情摘要完成数
+    counts = []
+    for message in messages:
+        if message.startswith('正在生成剧情摘要和章节大纲 '):
+            draft, plot = message.split('剧情摘要：')[1].split(' 模型')[0].split(' 章节大纲：')
+            counts.append((int(draft.split(' / ')[0]), int(plot.split(' / ')[0])))
+    assert counts == sorted(counts) and counts[-1] == (3, 3)
+    assert all(plot <= draft for draft, plot in counts)
+    assert messages[-2].startswith('正在生成全书大纲 ')
+    assert calls[-1] == ('outline', '测试')
+
+    final = results[-1]
+    assert final['progress_msg'] == '处理完成！'
+    assert list(final['plot']) == list(final['draft']) == ['第1章 一', '第2章 二', '第3章 三']
+    assert final['plot']['第2章 二']['context'] == '全书：大纲：第2章 二'
+    assert final['outline']['context'] == '全书大纲'
+
+    stats = final['stats']
+    assert stats['total_api_calls'] == 2 * 3 + 1
+    assert stats['total_chars_generated'] == 3 * 13 + 7
+    assert abs(stats['total_cost'] - (3 * 0.25 + 0.3)) < 1e-9
+
+    stages = stats['processing_stages']
+    chapters = stages['chapters']
+    assert [c['chapter'] for c in chapters] == ['第1章 一', '第2章 二', '第3章 三']
+    for c in chapters:
+        assert c['draft_start'] <= c['draft_end'] <= c['plot_start'] <= c['plot_end']
+    # 阶段耗时为该阶段从第一章开始到最后一章结束的时间跨度
+    assert stages['draft_time'] == max(c['draft_end'] for c in chapters) - min(c['draft_start'] for c in chapters)
+    assert stages['plot_time'] == max(c['plot_end'] for c in chapters) - min(c['plot_start'] for c in chapters)
+    # 流水线：第1章的章节大纲在第3章的剧情摘要完成前就已开始
+    assert chapters[0]['plot_start'] < chapters[2]['draft_end']
@@ -0,0 +1,72 @@
+import sys
+import os
+import random
+
+# Add the project root to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from prompts.prompt_utils import filter_thinking_process, ThinkingProcessFilter, THINKING_TAGS
+
+
+def feed_in_pieces(text, rng, max_piece=5):
+    """随机切分后逐段输入，返回(各段返回值之和, 过滤器)"""
+    thinking_filter = ThinkingProcessFilter()
+    outputs = []
+    pos = 0
+    while pos < len(text):
+        size = rng.randint(1, max_piece)
+        outputs.append(thinking_filter.feed(text[pos:pos + size]))
+        pos += size
+    outputs.append(thinking_filter.finish())
+    return ''.join(outputs), thinking_filter
+
+
+def test_matches_full_filter_single_tag():
+    rng = random.Random(1)
+    for _ in range(5000):
+        tag = rng.choice(THINKING_TAGS)
+        tag = tag.upper() if rng.random() < 0.3 else tag
+        pieces = [f'<{tag}>', f'</{tag.lower()}>', '\n', '\n\n', ' ', '  \n ', 'abc', '你好', '<', '>', '</', '<th', 'x<y']
+        text = ''.join(rng.choice(pieces) for _ in range(rng.randint(0, 15)))
+        output, thinking_filter = feed_in_pieces(text, rng)
+        assert thinking_filter.text == output == filter_thinking_process(text), repr(text)
+
+
+def test_matches_full_filter_nested_blocks():
+    rng = random.Random(2)
+    visible = ['正文', 'text', ' ', '\n', '\n \n', '<', 'a<b', '</']
+    hidden = ['想一想', '\n\n', ' ', 'plan', '<th', '<']
+    for _ in range(3000):
+        parts = []
+        for _ in range(rng.randint(0, 6)):
+            if rng.random() < 0.3:
+                tag = rng.choice(THINKING_TAGS)
+                content = ''.join(rng.choice(hidden) for _ in range(rng.randint(0, 4)))
+                parts.append(f'<{tag}>{content}</{tag}>')
+            else:
+                parts.append(rng.choice(visible))
+        # 末尾可能有未闭合的标签
+        if rng.random() < 0.2:
+            parts.append(f'<{rng.choice(THINKING_TAGS)}>' + rng.choice(hidden))
+        text = ''.join(parts)
+        output, thinking_filter = feed_in_pieces(text, rng, max_piece=rng.choice([1, 3, 8]))
+        assert thinking_filter.text == output == filter_thinking_process(text), repr(text)
+
+
+def test_split_tag_is_not_leaked():
+    thinking_filter = ThinkingProcessFilter()
+    # 可能是标签开头的部分暂存，不会先输出再撤回
+    assert thinking_filter.feed('<thi') == ''
+    assert thinking_filter.feed('nk>hmm') == ''
+    assert thinking_filter.feed('</think>\n\nHel') == 'Hel'
+    assert thinking_filter.feed('lo\n') == 'lo'
+    assert thinking_filter.finish() == ''
+    assert thinking_filter.text == 'Hello'
+
+
+def test_unclosed_tag_is_kept():
+    thinking_filter = ThinkingProcessFilter()
+    thinking_filter.feed('答案<think>还没想完')
+    assert thinking_filter.text == '答案'
+    thinking_filter.finish()
+    assert thinking_filter.text == filter_thinking_process('答案<think>还没想完') == '答案<think>还没想完'
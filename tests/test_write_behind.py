@@ -0,0 +1,126 @@
+import sys
+import os
+import threading
+
+# Add the project root to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm_api.write_behind import WriteBehindBuffer
+
+
+class BulkWriteError(Exception):
+    def __init__(self, n_inserted):
+        super().__init__('batch op errors occurred')
+        self.details = {'nInserted': n_inserted}
+
+
+class FakeCollection:
+    def __init__(self, db, name):
+        self.db = db
+        self.name = name
+        self.docs = []
+        self.batches = []
+        self.fail_after = None  # 设置后insert_many只写入前fail_after条，然后抛出异常
+
+    def insert_many(self, docs, ordered=True):
+        assert ordered is False
+        self.db.entered.set()
+        self.db.gate.wait(5)
+        if self.fail_after is not None:
+            self.docs.extend(docs[:self.fail_after])
+            raise BulkWriteError(self.fail_after)
+        self.docs.extend(docs)
+        self.batches.append(len(docs))
+
+    def insert_one(self, doc):
+        self.docs.append(doc)
+
+
+class FakeDB(dict):
+    def __init__(self):
+        super().__init__()
+        self.gate = threading.Event()
+        self.gate.set()
+        self.entered = threading.Event()
+
+    def __missing__(self, name):
+        self[name] = FakeCollection(self, name)
+        return self[name]
+
+
+class FakeClient(dict):
+    def __missing__(self, name):
+        self[name] = FakeDB()
+        return self[name]
+
+
+def test_batches_grouped_by_collection():
+    client = FakeClient()
+    buffer = WriteBehindBuffer(client, db_name='test', batch_size=4, flush_interval=5)
+    for i in range(10):
+        buffer.submit('api_cost' if i % 2 else 'llm_cache', {'i': i})
+    # close写完队列中剩余的文档，不必等flush_interval
+    buffer.close()
+
+    db = client['test']
+    assert [doc['i'] for doc in db['api_cost'].docs] == [1, 3, 5, 7, 9]
+    assert [doc['i'] for doc in db['llm_cache'].docs] == [0, 2, 4, 6, 8]
+    stats = buffer.stats()
+    assert stats['submitted'] == stats['written'] == 10
+    assert stats['failed'] == 0 and stats['queue_depth'] == 0
+
+
+def test_flush_interval_writes_partial_batch():
+    client = FakeClient()
+    buffer = WriteBehindBuffer(client, db_name='test', batch_size=100, flush_interval=0.05)
+    buffer.submit('api_cost', {'i': 0})
+    buffer.flush()
+    assert client['test']['api_cost'].batches == [1]
+    buffer.close()
+
+
+def test_partial_failure_is_counted():
+    client = FakeClient()
+    client['test']['api_cost'].fail_after = 2
+    buffer = WriteBehindBuffer(client, db_name='test', batch_size=5, flush_interval=5)
+    for i in range(5):
+        buffer.submit('api_cost', {'i': i})
+    buffer.flush()
+    stats = buffer.stats()
+    assert stats['written'] == 2 and stats['failed'] == 3
+    buffer.close()
+
+
+def test_full_queue_blocks_submit():
+    client = FakeClient()
+    db = client['test']
+    db.gate.clear()
+    buffer = WriteBehindBuffer(client, db_name='test', batch_size=1, flush_interval=5, max_queue=1)
+    buffer.submit('api_cost', {'i': 0})
+    # 后台线程正在写入第一条（被阻塞），第二条占满队列
+    assert db.entered.wait(5)
+    buffer.submit('api_cost', {'i': 1})
+
+    submitted = threading.Event()
+
+    def submit():
+        buffer.submit('api_cost', {'i': 2})
+        submitted.set()
+
+    thread = threading.Thread(target=submit)
+    thread.start()
+    assert not submitted.wait(0.1)
+    db.gate.set()
+    thread.join(5)
+    assert submitted.is_set()
+    buffer.close()
+    assert [doc['i'] for doc in db['api_cost'].docs] == [0, 1, 2]
+    assert buffer.stats()['max_queue_depth'] == 1
+
+
+def test_submit_after_close_writes_synchronously():
+    client = FakeClient()
+    buffer = WriteBehindBuffer(client, db_name='test', batch_size=10, flush_interval=5)
+    buffer.close()
+    buffer.submit('api_cost', {'i': 0})
+    assert client['test']['api_cost'].docs == [{'i': 0}]
@@ -0,0 +1,143 @@
+import sys
+import os
+import json
+import random
+
+# Add the project root and backend to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+import write_stream
+from write_stream import ChunkListStream, WriteStreamSession, create_write_session, get_write_session, sweep_write_sessions
+
+
+def apply_ops(state, ops):
+    """与前端相同的方式应用操作，state为[(id, row)]"""
+    for op in ops:
+        if op['op'] == 'reset':
+            state[:] = [(chunk_id, list(row)) for chunk_id, row in zip(op['ids'], op['rows'])]
+        elif op['op'] == 'delete':
+            state[:] = [(chunk_id, row) for chunk_id, row in state if chunk_id != op['id']]
+        elif op['op'] == 'insert':
+            state.insert(op['index'], (op['id'], list(op['row'])))
+        else:
+            row = next(row for chunk_id, row in state if chunk_id == op['id'])
+            if op['op'] == 'append':
+                row[op['field']] += op['text']
+            else:
+                row[op['field']] = op['text']
+    return state
+
+
+def rows_of(state):
+    return [row for _, row in state]
+
+
+def parse_sse(events):
+    """返回[(seq, payload)]"""
+    parsed = []
+    for data in events:
+        lines = data.decode('utf-8').strip().split('\n')
+        seq = int(lines[0][len('id: '):])
+        parsed.append((seq, json.loads(lines[1][len('data: '):])))
+    return parsed
+
+
+def test_ops_reproduce_rows():
+    rng = random.Random(0)
+    stream = ChunkListStream()
+    state = []
+    keyed_rows = [(('s0', i), [f'x{i}', '', '']) for i in range(5)]
+    next_key = 5
+    step = 0
+    for _ in range(300):
+        action = rng.random()
+        if action < 0.5:
+            # 在某个chunk的y末尾追加文本
+            pos = rng.randrange(len(keyed_rows))
+            key, row = keyed_rows[pos]
+            keyed_rows[pos] = (key, [row[0], row[1] + rng.choice('abc'), row[2]])
+            ops = stream.update(keyed_rows, changed={key})
+        elif action < 0.65:
+            pos = rng.randrange(len(keyed_rows))
+            key, row = keyed_rows[pos]
+            keyed_rows[pos] = (key, [row[0], 'rewritten', row[2]])
+            ops = stream.update(keyed_rows)
+        elif action < 0.8 and len(keyed_rows) > 1:
+            del keyed_rows[rng.randrange(len(keyed_rows))]
+            ops = stream.update(keyed_rows)
+        elif action < 0.9:
+            keyed_rows.insert(rng.randrange(len(keyed_rows) + 1), (('s0', next_key), [f'x{next_key}', '', '']))
+            next_key += 1
+            ops = stream.update(keyed_rows)
+        else:
+            # 开始新的步骤：key全部改变，内容相同的chunk被复用
+            step += 1
+            keyed_rows = [((f's{step}', i), row) for i, (_, row) in enumerate(keyed_rows)]
+            ops = stream.update(keyed_rows)
+            assert all(op['op'] not in ('insert', 'reset') for op in ops)
+        apply_ops(state, ops)
+        assert rows_of(state) == [row for _, row in keyed_rows]
+        assert [chunk_id for chunk_id, _ in state] == stream.ids
+
+
+def test_append_only_sends_delta():
+    stream = ChunkListStream()
+    stream.update([('a', ['x', 'hello', ''])])
+    ops = stream.update([('a', ['x', 'hello world', ''])], changed={'a'})
+    assert ops == [{'op': 'append', 'id': stream.ids[0], 'field': 1, 'text': ' world'}]
+
+
+def publish_rows(session, count):
+    keyed_rows = [('a', ['x', '', ''])]
+    for i in range(count):
+        keyed_rows = [('a', ['x', keyed_rows[0][1][1] + str(i % 10), ''])]
+        session.publish({'chunk_rows': keyed_rows, 'changed': {'a'}, 'done': False, 'msg': f'step {i}'})
+    return keyed_rows
+
+
+def test_resume_from_last_event_id():
+    session = WriteStreamSession('resume', max_events=100, resume_timeout=60)
+    keyed_rows = publish_rows(session, 20)
+    session.close()
+
+    events = parse_sse(list(session.subscribe()))
+    assert [seq for seq, _ in events] == list(range(1, 21))
+
+    # 收到前8个事件后断线，从第9个事件继续
+    state = []
+    for _, payload in events[:8]:
+        apply_ops(state, payload['ops'])
+    resumed = parse_sse(list(session.subscribe(last_event_id=8)))
+    assert [seq for seq, _ in resumed] == list(range(9, 21))
+    for _, payload in resumed:
+        apply_ops(state, payload['ops'])
+    assert rows_of(state) == [keyed_rows[0][1]]
+
+
+def test_resume_outside_buffer_sends_reset():
+    session = WriteStreamSession('overflow', max_events=5, resume_timeout=60)
+    keyed_rows = publish_rows(session, 20)
+    session.close()
+
+    resumed = parse_sse(list(session.subscribe(last_event_id=3)))
+    seq, payload = resumed[0]
+    assert seq == 20
+    assert payload['ops'][0]['op'] == 'reset'
+    assert payload['msg'] == 'step 19'
+    state = apply_ops([], payload['ops'])
+    assert rows_of(state) == [keyed_rows[0][1]]
+
+
+def test_sweep_removes_expired_sessions():
+    session = create_write_session('expired')
+    running = create_write_session('running')
+    assert write_stream._sweeper is not None
+    session.resume_timeout = -1
+    running.resume_timeout = -1
+    session.close()
+
+    assert sweep_write_sessions() == 1
+    assert get_write_session('expired') is None
+    # 未结束的会话不会被清理
+    assert get_write_session('running') is running